@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Compares the text and typed binary broadcast encodings: the
+proxy's cost of encoding a message, its size on the wire and a
+consumer's cost of turning it back into ints and floats, per
+message and, for binary records, a batch at a time with NumPy.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from ibzmq.broadcast import encode
+from ibzmq.binary import unpack, unpack_array, message_id, CONVERTERS
+from ibzmq.incoming import TICK_PRICE, TICK_SIZE, FIELD_DELIMITER
+
+def synthetic(count):
+    messages = []
+    for i in xrange(count):
+        tickerid = str(1000 + i % 50)
+        if i % 2:
+            messages.append((TICK_PRICE, 6, tickerid, '1', '%.2f' % (100 + i % 7 * 0.25), '100', '1'))
+        else:
+            messages.append((TICK_SIZE, 6, tickerid, '0', str(100 + i % 13)))
+    return messages
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+def encode_all(messages, binary):
+    return [encode(message, binary=binary) for message in messages]
+
+def decode_text(frames):
+    decoded = []
+    for frame in frames:
+        fields = frame.split(FIELD_DELIMITER)
+        msgid = int(fields[0])
+        decoded.append((msgid, int(fields[1])) +
+                       tuple(convert(field) for convert, field in zip(CONVERTERS[msgid], fields[2:-1])))
+    return decoded
+
+def decode_binary(frames):
+    return [unpack(frame) for frame in frames]
+
+def decode_arrays(frames):
+    batches = {}
+    for frame in frames:
+        batches.setdefault(message_id(frame), []).append(frame)
+    return [unpack_array(batch, msgid) for msgid, batch in batches.iteritems()]
+
+def report(name, count, elapsed, size=None):
+    line = '{0:<16} {1:>8.3f}s {2:>14,.0f} msgs/sec'.format(name, elapsed, count / elapsed)
+    if size is not None:
+        line += ' {0:>6.1f} bytes/msg'.format(size / float(count))
+    print(line)
+
+def main(count):
+    messages = synthetic(count)
+    print('{0:,} messages'.format(count))
+
+    elapsed, text = timed(encode_all, messages, False)
+    report('encode/text', count, elapsed, sum(map(len, text)))
+    elapsed, binary = timed(encode_all, messages, True)
+    report('encode/binary', count, elapsed, sum(map(len, binary)))
+
+    elapsed, from_text = timed(decode_text, text)
+    report('decode/text', count, elapsed)
+    elapsed, from_binary = timed(decode_binary, binary)
+    report('decode/binary', count, elapsed)
+    assert from_text == from_binary, 'Encodings decode differently.'
+    try:
+        elapsed, _ = timed(decode_arrays, binary)
+        report('decode/numpy', count, elapsed)
+    except ImportError:
+        print('decode/numpy     NumPy not installed.')
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        print('Usage: {0} [count]'.format(sys.argv[0]))
+        sys.exit(1)
+
+    main(int(sys.argv[1]) if len(sys.argv) == 2 else 200000)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Measures the fields/sec throughput of the per-field
+LineOnlyReceiver framing against the chunked FieldSplitter
+framing used by IBTWSProtocol, on a recorded or
+synthetic TWS stream.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import sqlite3
+
+from twisted.protocols.basic import LineOnlyReceiver
+from twisted.test.proto_helpers import StringTransport
+
+from ibzmq.framing import FieldSplitter, join_fields
+from ibzmq.proxy import IBTWSProtocol
+
+CHUNK_SIZE = 4096
+
+HANDSHAKE = join_fields([76, '20121018 10:00:00 EST'])
+
+class NullRequests(object):
+    def setTWSProtocol(self, protocol):
+        pass
+
+class NullBroadcast(object):
+    def send(self, message):
+        pass
+
+class LegacyIBTWSProtocol(LineOnlyReceiver, IBTWSProtocol):
+    """
+    IBTWSProtocol driven by one lineReceived callback
+    per field, as it was before chunked framing.
+
+    """
+    delimiter = IBTWSProtocol.delimiter
+    MAX_LENGTH = sys.maxint
+
+    def lineReceived(self, field):
+        self._field_buffer.append(field)
+
+        if len(self._field_buffer) == self.state.fieldcount:
+            self.fieldsReceived_dispatch(tuple(self._field_buffer))
+            self._field_buffer = []
+
+            if not self.state.fieldcount:
+                self.fieldsReceived_dispatch(())
+
+def load_recorded(database):
+    db = sqlite3.connect(database)
+    rows = db.execute('SELECT content FROM messages ORDER BY id')
+    return HANDSHAKE + ''.join(str(content) for content, in rows)
+
+def synthetic(count=100000):
+    messages = []
+    for i in xrange(count):
+        tickerid = 1000 + i % 50
+        if i % 2:
+            messages.append(join_fields([1, 6, tickerid, 1, '%.2f' % (100 + i % 7 * 0.25), 100, 1]))
+        else:
+            messages.append(join_fields([2, 6, tickerid, 0, 100 + i % 13]))
+    return HANDSHAKE + ''.join(messages)
+
+def chunked(stream, size=CHUNK_SIZE):
+    return [stream[i:i+size] for i in xrange(0, len(stream), size)]
+
+def bench_splitter(chunks):
+    splitter = FieldSplitter()
+    start = time.time()
+    for chunk in chunks:
+        splitter.split(chunk)
+    return time.time() - start
+
+def bench_lineonly(chunks):
+    fields = []
+    receiver = LineOnlyReceiver()
+    receiver.delimiter = '\0'
+    receiver.MAX_LENGTH = sys.maxint
+    receiver.lineReceived = fields.append
+    receiver.makeConnection(StringTransport())
+    start = time.time()
+    for chunk in chunks:
+        receiver.dataReceived(chunk)
+    return time.time() - start
+
+def bench_protocol(factory, chunks):
+    protocol = factory(NullRequests(), NullBroadcast())
+    protocol.makeConnection(StringTransport())
+    start = time.time()
+    for chunk in chunks:
+        protocol.dataReceived(chunk)
+    return time.time() - start
+
+def report(name, fieldcount, elapsed):
+    print('{0:<24} {1:>8.3f}s {2:>14,.0f} fields/sec'.format(name, elapsed, fieldcount / elapsed))
+
+def main(stream):
+    chunks = chunked(stream)
+    fieldcount = stream.count('\0')
+    print('{0:,} bytes, {1:,} fields, {2:,} chunks'.format(len(stream), fieldcount, len(chunks)))
+
+    report('framing/lineonly', fieldcount, bench_lineonly(chunks))
+    report('framing/splitter', fieldcount, bench_splitter(chunks))
+    report('protocol/lineonly', fieldcount, bench_protocol(LegacyIBTWSProtocol, chunks))
+    report('protocol/splitter', fieldcount, bench_protocol(IBTWSProtocol, chunks))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        print('Usage: {0} [msglog.db]'.format(sys.argv[0]))
+        sys.exit(1)
+
+    stream = load_recorded(sys.argv[1]) if len(sys.argv) == 2 else synthetic()
+    main(stream)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Measures the messages/sec throughput of IBTWSProtocol's parse
+loop with the proxy's logging at WARNING, INFO and DEBUG, with
+records written to /dev/null. As in the proxy, message counts are
+summarized below WARNING.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import logging
+
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransport
+
+from ibzmq.proxy import IBTWSProtocol
+from ibzmq.logsummary import MessageSummary
+
+from benchframing import HANDSHAKE, NullRequests, NullBroadcast, synthetic, chunked
+
+LEVELS = ('WARNING', 'INFO', 'DEBUG')
+
+def bench(chunks, level):
+    logger = logging.getLogger('ibzmq')
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(getattr(logging, level))
+    try:
+        summary = MessageSummary(clock=Clock()) if logger.isEnabledFor(logging.INFO) else None
+        protocol = IBTWSProtocol(NullRequests(), NullBroadcast(), summary=summary)
+        protocol.makeConnection(StringTransport())
+        protocol.dataReceived(HANDSHAKE)
+        start = time.time()
+        for chunk in chunks:
+            protocol.dataReceived(chunk)
+        return time.time() - start
+    finally:
+        logger.removeHandler(handler)
+
+def main(count):
+    chunks = chunked(synthetic(count)[len(HANDSHAKE):])
+    print('{0:,} messages'.format(count))
+    for level in LEVELS:
+        elapsed = bench(chunks, level)
+        print('{0:<8} {1:>8.3f}s {2:>14,.0f} msgs/sec'.format(level, elapsed, count / elapsed))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        print('Usage: {0} [count]'.format(sys.argv[0]))
+        sys.exit(1)
+
+    main(int(sys.argv[1]) if len(sys.argv) == 2 else 100000)
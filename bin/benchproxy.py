@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+End to end proxy benchmark.
+
+Runs the TWS simulator and a broadcast subscriber in child
+processes and the proxy in this process, then measures wire-in
+to PUB-out latency percentiles from the simulator's probes,
+the sustained messages/sec seen by the subscriber and the
+proxy's CPU time per message. With --spawn, and always for the
+asyncio engine, the proxy runs in a child process of its own
+and its CPU time includes starting the interpreter. Results are appended to a JSON
+lines file, tagged with the current commit, so runs can be
+compared across commits with --compare.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import yaml
+import zmq
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from ibzmq.broadcast import message_frame
+from ibzmq.framing import join_fields
+from ibzmq.simulator import probe, PROBE_END
+from ibzmq.stats import summarize
+
+import logging
+log = logging.getLogger(__name__)
+
+PROBE_PREFIX = join_fields(probe('')[:-1])
+
+METRICS = ('rate', 'p50', 'p90', 'p99', 'max', 'cpu_us')
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except socket.error:
+            time.sleep(0.05)
+    raise RuntimeError('Simulator did not start listening on port {0}.'.format(port))
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def subscriber(endpoint, timeout):
+    """
+    Receives broadcasts until the simulator's end probe and
+    prints the receive statistics as JSON.
+
+    """
+    ctx = zmq.Context(1)
+    s = ctx.socket(zmq.SUB)
+    s.setsockopt(zmq.SUBSCRIBE, '')
+    s.setsockopt(zmq.RCVTIMEO, int(timeout * 1000))
+    s.connect(endpoint)
+
+    received, latencies, first, last = 0, [], None, None
+    try:
+        while True:
+            msg = message_frame(s.recv_multipart())
+            now = time.time()
+            if msg.startswith(PROBE_PREFIX):
+                value = msg[len(PROBE_PREFIX):-1]
+                if value == PROBE_END:
+                    break
+                latencies.append(now - float(value))
+            else:
+                received += 1
+                if first is None:
+                    first = now
+                last = now
+    except zmq.Again:
+        log.error('Timed out waiting for broadcasts.')
+
+    print(json.dumps({'received': received, 'first': first, 'last': last, 'latencies': latencies}))
+
+def spawn(args, path, env):
+    """
+    Starts the proxy with engine args.engine in a child process.
+
+    """
+    if args.engine == 'asyncio':
+        command = [args.python, os.path.join(ROOT, 'ibzmq', 'aioproxy.py'), path]
+    else:
+        command = [sys.executable, os.path.join(ROOT, 'ibzmq', 'proxy.py'), path]
+    return subprocess.Popen(command, env=env)
+
+def run_spawned(args, path, env, client):
+    """
+    Runs the proxy in a child process until the subscriber
+    exits, returning the CPU seconds the proxy used.
+
+    """
+    proxy = spawn(args, path, env)
+    try:
+        client.wait()
+    finally:
+        proxy.terminate()
+    usage = os.wait4(proxy.pid, 0)[2]
+    return usage.ru_utime + usage.ru_stime
+
+def run(args):
+    tmpdir = tempfile.mkdtemp(prefix='benchproxy')
+    port = free_port()
+    broadcast = 'ipc://{0}/broadcast'.format(tmpdir)
+
+    settings = {
+        'ibtws.host': '127.0.0.1',
+        'ibtws.port': port,
+        'endpoint.command': 'ipc://{0}/command'.format(tmpdir),
+        'endpoint.broadcast': broadcast,
+    }
+    spawned = args.spawn or args.engine == 'asyncio'
+    if spawned:
+        # As in this process, which logs warnings only.
+        settings['log.level'] = 'WARNING'
+    for setting in args.set:
+        key, value = setting.split('=', 1)
+        settings[key] = yaml.safe_load(value)
+    path = os.path.join(tmpdir, 'config.yaml')
+    with open(path, 'w') as f:
+        yaml.safe_dump({'ibzmq': settings}, f, default_flow_style=False)
+
+    # Subscribe to the first worker when fanning out.
+    endpoint = settings['fanout.endpoints'][0] if settings.get('fanout.enabled') else broadcast
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    simulator = subprocess.Popen([sys.executable, os.path.join(ROOT, 'ibzmq', 'simulator.py'),
+                                  str(port), str(args.count), args.rate] + ([args.log] if args.log else []),
+                                 env=env)
+    client = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--subscriber', endpoint,
+                               '--timeout', str(args.timeout)], env=env, stdout=subprocess.PIPE)
+    try:
+        wait_for_port(port)
+        # Let the subscriber connect before anything is published.
+        time.sleep(0.5)
+
+        if spawned:
+            cpu = [0, run_spawned(args, path, env, client)]
+        else:
+            cpu = run_in_process(path, client)
+
+        stats = json.loads(client.stdout.read())
+    finally:
+        for process in (simulator, client):
+            if process.poll() is None:
+                process.terminate()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    received = stats['received']
+    elapsed = (stats['last'] - stats['first']) if received > 1 else None
+    latency = summarize(stats['latencies'])
+    return {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'engine': args.engine,
+        'spawned': spawned,
+        'count': args.count,
+        'rate_limit': args.rate,
+        'log': args.log,
+        'settings': args.set,
+        'received': received,
+        'rate': received / elapsed if elapsed else None,
+        'p50': latency['p50'],
+        'p90': latency['p90'],
+        'p99': latency['p99'],
+        'max': latency['max'],
+        'cpu_us': (cpu[1] - cpu[0]) / received * 1e6 if received else None,
+    }
+
+def run_in_process(path, client):
+    """
+    Runs the proxy in this process until the subscriber exits,
+    returning the process' CPU seconds before and after.
+
+    """
+    from twisted.internet import reactor
+    from twisted.internet.task import LoopingCall
+    from ibzmq import proxy
+    from ibzmq.config import Config
+
+    cpu = []
+    def started():
+        cpu.append(sum(os.times()[:2]))
+        proxy.start(Config(path))
+
+    def poll():
+        if client.poll() is not None:
+            cpu.append(sum(os.times()[:2]))
+            reactor.stop()
+
+    reactor.callWhenRunning(started)
+    LoopingCall(poll).start(0.05)
+    reactor.run()
+    return cpu
+
+def format_result(result):
+    def value(metric):
+        v = result.get(metric)
+        if v is None:
+            return '-'
+        if metric in ('p50', 'p90', 'p99', 'max'):
+            return '{0:.0f}us'.format(v * 1e6)
+        if metric == 'cpu_us':
+            return '{0:.1f}us'.format(v)
+        return '{0:,.0f}'.format(v)
+    return '{0:<9} {1:<20} {2:<8} {3:>10} {4}'.format(result['commit'] or '-', result['time'],
+                                                      result.get('engine', 'twisted'), result['rate_limit'],
+                                                      ' '.join('{0}={1}'.format(m, value(m)) for m in METRICS))
+
+def compare(path):
+    with open(path) as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    for result in results:
+        print(format_result(result))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=200000, help='messages to stream')
+    parser.add_argument('--rate', default='max', help='messages/sec or max')
+    parser.add_argument('--log', help='stream a recorded message log instead of synthetic messages')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='override a proxy config setting')
+    parser.add_argument('--results', default='benchmarks.jsonl', help='file results are appended to')
+    parser.add_argument('--compare', action='store_true', help='print stored results and exit')
+    parser.add_argument('--engine', choices=('twisted', 'asyncio'), default='twisted')
+    parser.add_argument('--spawn', action='store_true', help='run the proxy in a child process')
+    parser.add_argument('--python', default='python3', help='interpreter running the asyncio engine')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--subscriber', metavar='ENDPOINT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.subscriber:
+        subscriber(args.subscriber, args.timeout)
+    elif args.compare:
+        compare(args.results)
+    else:
+        result = run(args)
+        with open(args.results, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+        print(format_result(result))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Converts message logs between the sqlite format and the
+binary capture format written by bin/msglog.py. A source
+directory is read as a capture and written to a sqlite
+database, a source file is read as a sqlite database and
+written to a capture directory.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import logging
+
+from ibzmq.msglog import connect, read_messages, insert_messages
+from ibzmq.capture import CaptureReader, CaptureWriter
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = 10000
+
+def sqlite_to_capture(database, directory):
+    db = connect(database)
+    writer = CaptureWriter(directory)
+    for t, type, content in read_messages(db):
+        writer.write(type, content, t)
+    writer.close()
+    return writer.written
+
+def capture_to_sqlite(directory, database):
+    reader = CaptureReader(directory)
+    db = connect(database)
+
+    count, batch = 0, []
+    for record in reader:
+        batch.append((record.time / 1e9, record.type, record.content))
+        if len(batch) >= BATCH_SIZE:
+            insert_messages(db, batch)
+            count, batch = count + len(batch), []
+    if batch:
+        insert_messages(db, batch)
+        count += len(batch)
+
+    reader.close()
+    db.close()
+    return count
+
+def main(source, destination):
+    if not os.path.exists(source):
+        raise IOError('Message log {0} not found.'.format(source))
+
+    if os.path.isdir(source):
+        log.info('Converting capture {0} to sqlite {1}.'.format(source, destination))
+        count = capture_to_sqlite(source, destination)
+    else:
+        log.info('Converting sqlite {0} to capture {1}.'.format(source, destination))
+        count = sqlite_to_capture(source, destination)
+    log.info('Converted {0} messages.'.format(count))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    if len(sys.argv) != 3:
+        print('Usage: {0} source destination'.format(sys.argv[0]))
+        sys.exit(1)
+
+    main(sys.argv[1], sys.argv[2])
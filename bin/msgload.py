@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Loads the messages of one type from a sqlite message log or a
+capture directory into NumPy, optionally restricted to a time
+range and to ticker or request ids, and either writes them to a
+directory of column files or prints a summary of the columns.
+
+"""
+
+from __future__ import print_function
+
+import time
+import sqlite3
+import argparse
+import logging
+
+from ibzmq.incoming import MESSAGE_NAMES
+from ibzmq.loader import load_chunks, write_columns, index_messages, CHUNK_SIZE
+
+log = logging.getLogger(__name__)
+
+MESSAGE_IDS = dict((name, msgid) for msgid, name in MESSAGE_NAMES.iteritems())
+
+def message_type(name):
+    if name.isdigit():
+        return int(name)
+    if name not in MESSAGE_IDS:
+        raise argparse.ArgumentTypeError('Unknown message type {0}.'.format(name))
+    return MESSAGE_IDS[name]
+
+def summarize(chunks):
+    count, columns = 0, {}
+    for chunk in chunks:
+        count += len(chunk)
+        for name in chunk.dtype.names:
+            low, high = chunk[name].min(), chunk[name].max()
+            if name in columns:
+                low, high = min(low, columns[name][0]), max(high, columns[name][1])
+            columns[name] = low, high
+    for name in sorted(columns):
+        print('{0:<16} {1!r:>20} {2!r:>20}'.format(name, *columns[name]))
+    return count
+
+def main(args):
+    if args.index:
+        db = sqlite3.connect(args.source)
+        index_messages(db)
+        db.close()
+
+    started = time.time()
+    chunks = load_chunks(args.source, args.type, args.start, args.end, args.ids, args.chunk_size)
+    if args.output:
+        count = write_columns(chunks, args.output)
+    else:
+        count = summarize(chunks)
+    elapsed = time.time() - started
+
+    print('{0:,} messages of type {1} in {2:.3f}s, {3:,.0f} msgs/sec'.format(
+        count, MESSAGE_NAMES.get(args.type, args.type), elapsed, count / elapsed if elapsed else 0))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('source', help='sqlite message log or capture directory')
+    parser.add_argument('type', type=message_type, help='message type name or id, e.g. TickPrice')
+    parser.add_argument('--start', type=float, help='seconds since the epoch')
+    parser.add_argument('--end', type=float, help='seconds since the epoch')
+    parser.add_argument('--ids', type=int, nargs='+', help='ticker or request ids')
+    parser.add_argument('--output', help='directory to write column files to')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--index', action='store_true', help='index a sqlite log by type and time first')
+    main(parser.parse_args())
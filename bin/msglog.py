@@ -8,7 +8,8 @@
 
 """
 Listens on the ibzmq broadcast endpoint and logs
-messages into a sqlite database.
+messages into a sqlite database or, with msglog.backend
+set to capture, a binary capture directory.
 
 """
 
@@ -16,29 +17,41 @@ from __future__ import print_function
 
 import os
 import sys
+import signal
 import logging
 
 import zmq
-import sqlite3
 
 from ibzmq.incoming import MESSAGE_NAMES, FIELD_DELIMITER
+from ibzmq.broadcast import message_frame
+from ibzmq.binary import to_text
+from ibzmq.msglog import BatchWriter
+from ibzmq.capture import CaptureWriter
 from ibzmq.config import Config
 
 log = logging.getLogger(__name__)
 
-def create_schema(db):
-    if not db.execute('SELECT * FROM sqlite_master WHERE name="messages"').fetchall():
-        log.info('messages table not found: creating.')
-        db.execute('CREATE TABLE messages (id INTEGER PRIMARY KEY, time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, type INTEGER, content BLOB)')
-        db.commit()
-
-def insert_message(db, type, content):
-    db.execute('INSERT INTO messages (type, content) VALUES (?,?)', (type, sqlite3.Binary(content)))
-    db.commit()
+def open_writer(database, config):
+    backend = config['msglog.backend']
+    if backend == 'sqlite':
+        writer = BatchWriter(database,
+                             batch_size=config['msglog.batch.size'],
+                             batch_interval=config['msglog.batch.interval'],
+                             queue_size=config['msglog.queue.size'],
+                             wal=config['msglog.wal'],
+                             synchronous=config['msglog.synchronous'])
+        writer.start()
+        return writer
+    elif backend == 'capture':
+        return CaptureWriter(database, segment_size=config['msglog.segment.size'])
+    else:
+        raise ValueError('Unknown msglog backend {0}.'.format(backend))
 
 def main(database, config):
-    db = sqlite3.connect(database)
-    create_schema(db)
+    writer = open_writer(database, config)
+
+    # Flush pending messages on termination as well as on interrupt.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
     log.info('Inserting messages into {0}.'.format(os.path.abspath(database)))
 
@@ -49,16 +62,26 @@ def main(database, config):
 
     log.info('Subcribed to {0}.'.format(config['endpoint.broadcast']))
 
-    while 1:
-        msg = s.recv()
-        fields = msg.split(FIELD_DELIMITER)
-        msgid = int(fields[0])
-        msgname = MESSAGE_NAMES.get(msgid, 'Unknown')
-        log.info('Received. Field Count: {0:>2} Type: ({1:>02}) {2}'.format(len(fields), msgid, msgname))
-        insert_message(db, msgid, msg)
+    # Checked once rather than formatting a line per message.
+    debug = log.isEnabledFor(logging.DEBUG)
+    try:
+        while 1:
+            # Logs hold the text encoding whatever the broadcast encoding.
+            msg = to_text(message_frame(s.recv_multipart()))
+            msgid = int(msg[:msg.index(FIELD_DELIMITER)])
+            if debug:
+                log.debug('Received. Field Count: %2d Type: (%02d) %s', msg.count(FIELD_DELIMITER), msgid,
+                          MESSAGE_NAMES.get(msgid, 'Unknown'))
+            writer.write(msgid, msg)
+    except KeyboardInterrupt:
+        log.info('Interrupted.')
+    finally:
+        log.info('Flushing pending messages.')
+        writer.close()
+        log.info('Wrote {0} messages, dropped {1}.'.format(writer.written, getattr(writer, 'dropped', 0)))
 
 if __name__ == '__main__':
-    logging.basicConfig(level=logging.DEBUG)
+    logging.basicConfig(level=logging.INFO)
 
     if len(sys.argv) != 3:
         print('Usage: {0} database config.yaml'.format(sys.argv[0]))
@@ -66,4 +89,5 @@ if __name__ == '__main__':
 
     database = sys.argv[1]
     config = Config(sys.argv[2])
+    logging.getLogger().setLevel(config['log.level'])
     main(database, config)
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Runs the proxy on asyncio and pyzmq in place of Twisted and
+txzmq: the TWS connections are asyncio protocols and the ZeroMQ
+sockets are read straight from the event loop, without a
+Deferred per message.
+
+It needs Python 3 with the ibzmq directory on the path, as when
+run as a script or selected with engine: asyncio. It serves the
+command and broadcast endpoints like the Twisted proxy, decoding
+with MessageDecoder and answering requests with CommandHandler,
+over the same connection pool and pacing schedulers.
+The derived processing (conflation, depth books, bars), request
+sharing, tracked requests, caches, metrics, fan-out and the
+shed policy are not supported, and start refuses configs
+enabling them.
+
+To embed the proxy in an asyncio application, call start with
+the application's event loop.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import asyncio
+
+from functools import partial
+
+import zmq
+
+from decoder import MessageDecoder, Disconnected, Connecting, WaitingForMessageID
+from incoming import MESSAGE_NAMES, CONNECTION_STATUS
+from framing import FieldSplitter
+from broadcast import encode
+from pacing import Scheduler, HISTORICAL, MARKET_DATA
+from pool import ConnectionPool
+from orderids import OrderIdAllocator
+from logsummary import MessageSummary
+from commands import CommandHandler, configure_socket, ENCODINGS, CONNECTED, DISCONNECTED
+from config import Config
+
+import logging
+log = logging.getLogger(__name__)
+
+# TWS and ZeroMQ carry bytes while the decoders, the pool and
+# the encoders work on str, which latin-1 maps one to one.
+ENCODING = 'latin-1'
+
+# Features of the Twisted proxy this engine does not have.
+UNSUPPORTED = ('conflation.enabled', 'depth.enabled', 'bars.enabled', 'multiplex.enabled',
+               'snapshot.enabled', 'histcache.enabled', 'correlation.enabled',
+               'metrics.enabled', 'fanout.enabled')
+
+def to_bytes(frame):
+    return frame.encode(ENCODING) if isinstance(frame, str) else frame
+
+class LoopClock(object):
+    """
+    The part of Twisted's IReactorTime the pacing schedulers and
+    the log summary use, over an asyncio event loop.
+
+    """
+    def __init__(self, loop):
+        self._loop = loop
+
+    def seconds(self):
+        return self._loop.time()
+
+    def callLater(self, delay, f, *args, **kwargs):
+        return DelayedCall(self._loop, delay, partial(f, *args, **kwargs))
+
+class DelayedCall(object):
+    def __init__(self, loop, delay, f):
+        self._f = f
+        self._called = False
+        self._handle = loop.call_later(delay, self._call)
+
+    def _call(self):
+        self._called = True
+        self._f()
+
+    def active(self):
+        return not self._called and not self._handle.cancelled()
+
+    def cancel(self):
+        self._handle.cancel()
+
+class TWSProtocol(MessageDecoder, asyncio.Protocol):
+    """
+    A TWS connection, publishing every message received on the
+    broadcast socket and writing the requests routed to it.
+
+    """
+    def __init__(self, connector, zmq_requests, zmq_broadcast, clientid=0, topics=False,
+                 source=None, pool=None, binary=False, orderids=None, summary=None,
+                 write_buffer=None):
+        super(TWSProtocol, self).__init__()
+
+        self._connector = connector
+        self._clientid = clientid
+        self._binary = binary
+        self._pool = pool
+        self._topics = topics
+        self._orderids = orderids
+        self._summary = summary
+        self._write_buffer = write_buffer
+        self._splitter = FieldSplitter(self.delimiter)
+        self._zmq_requests = zmq_requests
+        self._zmq_broadcast = zmq_broadcast
+
+        self.transport = None
+        self.source = source
+        self.serverVersion = None
+        self.connectionTime = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        # Stop taking requests while TWS reads them slower than
+        # they arrive, rather than buffer them without bound.
+        if self._write_buffer is not None:
+            transport.set_write_buffer_limits(high=self._write_buffer)
+        self.writeField(self.CLIENT_VERSION)
+        self.transition(Connecting())
+
+    def connection_lost(self, exc):
+        log.error('Connection {0} to TWS lost: {1}'.format(self.source or 'default',
+                                                           exc or 'Connection was closed cleanly.'))
+        self._zmq_requests.resumeReading(self.source)
+        if not self.is_state(Disconnected):
+            self.transition(Disconnected())
+        if self.serverVersion is not None:
+            self._zmq_requests.lostTWSProtocol(self)
+            self.publishStatus(DISCONNECTED)
+        self._connector.retry()
+
+    def data_received(self, data):
+        fields = self._splitter.split(data.decode(ENCODING))
+        if self._field_buffer:
+            fields = self._field_buffer + fields
+        self.fieldsReceived(fields)
+
+    def pause_writing(self):
+        self._zmq_requests.pauseReading(self.source)
+
+    def resume_writing(self):
+        self._zmq_requests.resumeReading(self.source)
+
+    def fieldsReceived_Connecting(self, fields):
+        self.serverVersion = int(fields[0])
+        self.connectionTime = fields[1]
+
+        log.info("Connected. Server Version: {0} Connection Time: {1}".format(self.serverVersion, self.connectionTime))
+        self._connector.resetDelay()
+
+        self.transition(WaitingForMessageID())
+
+        self.writeField(self._clientid)
+
+        # Subscriptions are restored once the client id is written.
+        restored = self._zmq_requests.setTWSProtocol(self)
+        if restored is not None:
+            self.publishStatus(CONNECTED, restored)
+
+    def messageParsed(self, message):
+        msgid = int(message[0])
+        if self._debug:
+            log.debug('Message Parsed. Field Count: %2d, Type: (%02d) %s', len(message), msgid, MESSAGE_NAMES.get(msgid, 'Unknown'))
+        if self._summary is not None:
+            self._summary.add(msgid)
+        if self._orderids is not None:
+            self._orderids.received(message)
+        if self._pool:
+            self._pool.completed(self.source, message)
+        self.publishFields(message)
+
+    def subscriptionCancelled(self, msgid, id):
+        # No state is derived from the messages received.
+        pass
+
+    def publishFields(self, fields):
+        if self._debug:
+            log.debug('Publishing %r', fields)
+        self._zmq_broadcast.send(encode(fields, self._topics, self.source, self._binary))
+
+    def publishStatus(self, status, restored=0):
+        self.publishFields((CONNECTION_STATUS, 1, status, self.source or '', int(time.time()), restored))
+
+    def writeField(self, field):
+        self.transport.write((str(field) + self.delimiter).encode(ENCODING))
+
+    def writeFields(self, fields):
+        assert fields, 'Cannot write zero count fields.'
+        self.transport.write((self.delimiter.join(map(str, fields)) + self.delimiter).encode(ENCODING))
+
+    def writeMessage(self, msg):
+        self.transport.write(msg.encode(ENCODING))
+
+class TWSConnector(object):
+    """
+    Connects to TWS, reconnecting with exponential backoff from
+    initialDelay up to maxDelay seconds when the connection fails
+    or is lost, if reconnect is set, as Twisted's
+    ReconnectingClientFactory does. connected resolves with the
+    first protocol built.
+
+    """
+    factor = 2.7182818284590451
+
+    def __init__(self, loop, host, port, zmq_requests, zmq_broadcast, reconnect=True,
+                 initialDelay=1.0, maxDelay=60, **options):
+        self.host = host
+        self.port = port
+        self.zmq_requests = zmq_requests
+        self.zmq_broadcast = zmq_broadcast
+        self.options = options
+        self.continueTrying = reconnect
+        self.initialDelay = self.delay = initialDelay
+        self.maxDelay = maxDelay
+        self.connected = loop.create_future()
+        self._loop = loop
+
+    def connect(self):
+        attempt = self._loop.create_task(self._loop.create_connection(self.buildProtocol, self.host, self.port))
+        attempt.add_done_callback(self._attempted)
+
+    def buildProtocol(self):
+        protocol = TWSProtocol(self, self.zmq_requests, self.zmq_broadcast, **self.options)
+        if not self.connected.done():
+            self.connected.set_result(protocol)
+        return protocol
+
+    def _attempted(self, attempt):
+        if not attempt.cancelled() and attempt.exception() is not None:
+            log.error('Connection to TWS at {0}:{1} failed: {2}'.format(self.host, self.port, attempt.exception()))
+            self.retry()
+
+    def retry(self):
+        if not self.continueTrying:
+            return
+        self.delay = min(self.delay * self.factor, self.maxDelay)
+        log.info('Reconnecting to TWS in {0:.1f} seconds.'.format(self.delay))
+        self._loop.call_later(self.delay, self.connect)
+
+    def resetDelay(self):
+        self.delay = self.initialDelay
+
+class ZmqBroadcast(object):
+    """
+    The broadcast socket, a PUB socket dropping the messages a
+    subscriber has no room for.
+
+    """
+    def __init__(self, context, endpoint, **options):
+        self.socket = context.socket(zmq.PUB)
+        configure_socket(self.socket, **options)
+        self.socket.bind(endpoint)
+
+    def send(self, message):
+        if isinstance(message, list):
+            self.socket.send_multipart([to_bytes(frame) for frame in message], zmq.NOBLOCK)
+        else:
+            self.socket.send(to_bytes(message), zmq.NOBLOCK)
+
+    def close(self):
+        self.socket.close()
+
+class ZmqRequests(CommandHandler):
+    """
+    The command socket, a ROUTER socket answering requests as
+    txzmq's ZmqREPConnection does, read from the event loop
+    whenever ZeroMQ signals it.
+
+    """
+    def __init__(self, context, loop, endpoint, **options):
+        self.socket = context.socket(zmq.ROUTER)
+        configure_socket(self.socket, **options)
+        self.socket.bind(endpoint)
+        self._loop = loop
+        self._fd = self.socket.get(zmq.FD)
+        self._routingInfo = {}
+        self._read_scheduled = False
+        super(ZmqRequests, self).__init__()
+        loop.add_reader(self._fd, self.doRead)
+
+    def close(self):
+        self._loop.remove_reader(self._fd)
+        self.socket.close()
+
+    def doRead(self):
+        # The socket's descriptor only signals new messages, so
+        # those left unread while paused are read on resuming.
+        self._read_scheduled = False
+        while not self._paused:
+            if not self.socket.get(zmq.EVENTS) & zmq.POLLIN:
+                return
+            message = self.socket.recv_multipart(zmq.NOBLOCK)
+            try:
+                self.messageReceived(message)
+            except Exception:
+                log.exception('Failed handling request {0!r}.'.format(message))
+
+    def messageReceived(self, message):
+        i = message.index(b'')
+        assert i > 0
+        messageid = message[i - 1]
+        self._routingInfo[messageid] = message[:i - 1]
+        self.gotMessage(messageid, *[part.decode(ENCODING) for part in message[i + 1:]])
+
+    def reply(self, messageid, *parts):
+        routingInfo = self._routingInfo.pop(messageid)
+        self.socket.send_multipart(routingInfo + [messageid, b''] + [to_bytes(part) for part in parts], zmq.NOBLOCK)
+        # ZeroMQ may not signal requests arriving meanwhile.
+        if not self._read_scheduled:
+            self._read_scheduled = True
+            self._loop.call_soon(self.doRead)
+
+def start(config, loop=None):
+    """
+    Binds the ZeroMQ endpoints and connects to TWS on loop, the
+    current event loop by default, returning the command socket,
+    broadcast socket and a future resolving once every
+    connection of the pool has connected.
+
+    """
+    enabled = [key for key in UNSUPPORTED if config[key]]
+    if enabled:
+        raise ValueError('The asyncio engine does not support {0}.'.format(', '.join(enabled)))
+    if config['broadcast.policy'] != 'drop':
+        raise ValueError('The asyncio engine only supports the drop broadcast policy.')
+    if config['broadcast.encoding'] not in ENCODINGS:
+        raise ValueError('Unknown broadcast encoding {0}.'.format(config['broadcast.encoding']))
+    if loop is None:
+        loop = asyncio.get_event_loop()
+
+    clock = LoopClock(loop)
+    context = zmq.Context.instance()
+    zmq_requests = ZmqRequests(context, loop, config['endpoint.command'],
+                               hwm=config['command.hwm'],
+                               sndbuf=config['command.sndbuf'],
+                               rcvbuf=config['command.rcvbuf'],
+                               linger=config['command.linger'])
+    pool = ConnectionPool.from_config(config)
+    zmq_requests.setPool(pool)
+    if config['pacing.enabled']:
+        lane_limits = dict((lane, (config['pacing.{0}.rate'.format(lane)], config['pacing.{0}.burst'.format(lane)]))
+                           for lane in (MARKET_DATA, HISTORICAL)
+                           if config['pacing.{0}.rate'.format(lane)])
+        # IB paces each client connection separately.
+        for connection in pool:
+            connection.scheduler = Scheduler(partial(zmq_requests.writeRequest, connection),
+                                             rate=config['pacing.rate'],
+                                             burst=config['pacing.burst'],
+                                             lane_limits=lane_limits,
+                                             queue_size=config['pacing.queue.size'],
+                                             clock=clock)
+    summary = None
+    if config['log.summary.interval'] and log.isEnabledFor(logging.INFO):
+        summary = MessageSummary(config['log.summary.interval'], clock=clock)
+    orderids = OrderIdAllocator() if config['orderids.enabled'] else None
+    if orderids is not None:
+        zmq_requests.setOrderIdAllocator(orderids)
+
+    zmq_broadcast = ZmqBroadcast(context, config['endpoint.broadcast'],
+                                 hwm=config['broadcast.hwm'],
+                                 sndbuf=config['broadcast.sndbuf'],
+                                 linger=config['broadcast.linger'])
+
+    connecting = []
+    for connection in pool:
+        connector = TWSConnector(loop, connection.host, connection.port, zmq_requests, zmq_broadcast,
+                                 reconnect=config['reconnect.enabled'],
+                                 initialDelay=config['reconnect.delay.initial'],
+                                 maxDelay=config['reconnect.delay.max'],
+                                 clientid=connection.clientid,
+                                 source=connection.name,
+                                 pool=pool,
+                                 topics=config['broadcast.topics'],
+                                 binary=config['broadcast.encoding'] == 'binary',
+                                 orderids=orderids,
+                                 summary=summary,
+                                 write_buffer=config['command.buffer.size'] or None)
+        connector.connect()
+        connecting.append(connector.connected)
+    return zmq_requests, zmq_broadcast, asyncio.gather(*connecting)
+
+def main(config):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    start(config, loop)
+    loop.run_forever()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    if len(sys.argv) != 2:
+        print('Usage: {0} config.yaml'.format(sys.argv[0]))
+        sys.exit(1)
+
+    config = Config(sys.argv[1])
+    logging.getLogger().setLevel(config['log.level'])
+    main(config)
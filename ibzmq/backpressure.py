@@ -0,0 +1,226 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Bounds the memory the proxy spends on peers that cannot keep up:
+subscribers of the broadcast reading too slowly, and TWS reading
+requests too slowly while clients keep sending them.
+
+"""
+
+from collections import Counter, deque
+
+from zope.interface import implementer
+from twisted.internet.interfaces import IPushProducer
+
+from zmq import constants, ZMQError
+from txzmq import ZmqPubConnection
+
+from incoming import (TICK_PRICE, TICK_SIZE, TICK_OPTION_COMPUTATION, TICK_GENERIC,
+                      TICK_STRING, TICK_EFP, MARKET_DEPTH, MARKET_DEPTH_L2,
+                      BOOK_SNAPSHOT, BOOK_DIFF, PROXY_METRICS, MESSAGE_NAMES)
+from binary import message_id
+from commands import configure_socket
+
+import logging
+log = logging.getLogger(__name__)
+
+POLICIES = { 'drop', 'shed' }
+
+# Market data, superseded by the next update, that may be shed
+# when a subscriber falls behind. Everything else, orders and
+# executions above all, is held until there is room.
+SHEDDABLE = {
+    TICK_PRICE, TICK_SIZE, TICK_OPTION_COMPUTATION, TICK_GENERIC,
+    TICK_STRING, TICK_EFP, MARKET_DEPTH, MARKET_DEPTH_L2,
+    BOOK_SNAPSHOT, BOOK_DIFF, PROXY_METRICS,
+}
+
+# Seconds between attempts to send held messages.
+RETRY_INTERVAL = 0.01
+
+# Seconds the shed policy falls back to dropping messages for full
+# subscribers alone, once more than held_max messages were held.
+FALLBACK_PERIOD = 60.0
+
+def configure(connection, **options):
+    """
+    Configures the socket of a txzmq connection as
+    configure_socket does. Must be called before the
+    connection's endpoints are added.
+
+    """
+    configure_socket(connection.socket, **options)
+
+def frame_message_id(message):
+    """
+    Returns the message id of an encoded broadcast, sent as one
+    frame or several.
+
+    """
+    return message_id(message if isinstance(message, str) else message[-1])
+
+class BroadcastConnection(ZmqPubConnection):
+    """
+    The broadcast socket, with one of two policies for messages
+    a subscriber has no room for past its high water mark:
+
+    drop - a PUB socket, which drops them silently for that
+           subscriber alone.
+    shed - an XPUB socket refusing them for every subscriber of
+           the message's topic. Market data in SHEDDABLE is
+           dropped and counted by message type, while every
+           other message is held in order and sent once there is
+           room. Market data sent while messages are held is
+           shed, so nothing overtakes them.
+
+    So that a subscriber that stays full cannot hold up the others
+    for long, once held_max messages are held the shed policy
+    sends them and falls back to the drop policy for
+    FALLBACK_PERIOD seconds, counting the overflow.
+
+    """
+    def __init__(self, factory, endpoint=None, policy='drop', held_max=10000, clock=None):
+        if policy not in POLICIES:
+            raise ValueError('Unknown broadcast policy {0}.'.format(policy))
+        if held_max <= 0:
+            raise ValueError('The broadcast must be able to hold at least one message.')
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.policy = policy
+        self._held_max = held_max
+        self._clock = clock
+        self._held = deque()
+        self._retry = None
+        self._fallback = None
+        self._shedding = False
+
+        self.dropped = Counter()
+        self.held = 0
+        self.overflows = 0
+
+        if policy == 'shed':
+            self.socketType = constants.XPUB
+        ZmqPubConnection.__init__(self, factory, endpoint)
+        if policy == 'shed':
+            self.socket.set(constants.XPUB_NODROP, 1)
+
+    def messageReceived(self, message):
+        # Subscriptions, read by XPUB sockets.
+        pass
+
+    def send(self, message):
+        if self.policy == 'drop' or self._fallback is not None:
+            ZmqPubConnection.send(self, message)
+        elif self._held or not self._trySend(message):
+            self._refused(message)
+        elif self._shedding:
+            self._recovered()
+
+    def _trySend(self, message):
+        try:
+            ZmqPubConnection.send(self, message)
+        except ZMQError as e:
+            if e.errno != constants.EAGAIN:
+                raise
+            return False
+        return True
+
+    def _refused(self, message):
+        if not self._shedding:
+            self._shedding = True
+            log.warning('A broadcast subscriber is full: shedding market data and holding other messages.')
+        msgid = frame_message_id(message)
+        if msgid in SHEDDABLE:
+            self.dropped[msgid] += 1
+            return
+        if len(self._held) >= self._held_max:
+            self._overflow(message)
+            return
+        self._held.append(message)
+        self.held += 1
+        if self._retry is None:
+            self._retry = self._clock.callLater(RETRY_INTERVAL, self.sendHeld)
+
+    def sendHeld(self):
+        """
+        Sends the held messages there is room for, retrying the
+        rest after RETRY_INTERVAL.
+
+        """
+        self._retry = None
+        # Has the socket process the notices of subscribers that
+        # made room, which sends only do now and then.
+        self.socket.get(constants.EVENTS)
+        while self._held:
+            if not self._trySend(self._held[0]):
+                self._retry = self._clock.callLater(RETRY_INTERVAL, self.sendHeld)
+                return
+            self._held.popleft()
+
+    def _overflow(self, message):
+        self.overflows += 1
+        log.error('{0} broadcast messages held for a full subscriber: dropping for full subscribers alone '
+                  'for {1} seconds.'.format(len(self._held), FALLBACK_PERIOD))
+        self.socket.set(constants.XPUB_NODROP, 0)
+        if self._retry is not None:
+            self._retry.cancel()
+            self._retry = None
+        self._fallback = self._clock.callLater(FALLBACK_PERIOD, self._rearm)
+        self._shedding = False
+        while self._held:
+            ZmqPubConnection.send(self, self._held.popleft())
+        ZmqPubConnection.send(self, message)
+
+    def _rearm(self):
+        self._fallback = None
+        self.socket.set(constants.XPUB_NODROP, 1)
+        log.info('Shedding for full broadcast subscribers again.')
+
+    def _recovered(self):
+        self._shedding = False
+        log.info('Broadcast subscribers caught up. Dropped so far: %s', self.droppedReport() or 'none')
+
+    @property
+    def pending(self):
+        return len(self._held)
+
+    def droppedReport(self):
+        return dict((MESSAGE_NAMES.get(msgid, str(msgid)), count) for msgid, count in self.dropped.iteritems())
+
+    def stats(self):
+        return {
+            'policy': self.policy,
+            'dropped': self.droppedReport(),
+            'held': self.held,
+            'pending': self.pending,
+            'overflows': self.overflows,
+            'fallback': self._fallback is not None,
+        }
+
+@implementer(IPushProducer)
+class RequestProducer(object):
+    """
+    Registered with the transport of a TWS connection, stops the
+    command connection reading requests while the transport
+    buffers more than its bufferSize bytes, until it drains.
+    Requests then queue in the command socket up to its high
+    water mark, and clients block or drop them.
+
+    """
+    def __init__(self, requests, source=None):
+        self._requests = requests
+        self._source = source
+
+    def pauseProducing(self):
+        self._requests.pauseReading(self._source)
+
+    def resumeProducing(self):
+        self._requests.resumeReading(self._source)
+
+    def stopProducing(self):
+        self._requests.resumeReading(self._source)
@@ -0,0 +1,182 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Aggregates the trades reported by TICK_PRICE and TICK_SIZE
+messages into OHLCV bars of any number of intervals, so bars
+are built once in the proxy rather than by every consumer.
+
+Bars are aligned to multiples of their interval in seconds since
+the epoch and published once their interval has passed as BAR
+messages,
+
+    BAR, version, tickerId, interval, start time,
+    open, high, low, close, volume, trade count
+
+Intervals without trades publish no bar.
+
+"""
+
+from incoming import TICK_PRICE, TICK_SIZE, BAR
+
+import logging
+log = logging.getLogger(__name__)
+
+BAR_VERSION = 1
+
+# Trade price tick types, live and delayed, by their size tick
+# type.
+LAST_SIZES = {
+    4:  5,
+    68: 71,
+}
+
+LAST_PRICES = dict((size, price) for price, size in LAST_SIZES.items())
+
+class Bar(object):
+    __slots__ = ('start', 'open', 'high', 'low', 'close', 'volume', 'count')
+
+    def __init__(self, start, price, size):
+        self.start = start
+        self.open = self.high = self.low = self.close = price
+        self.volume = size
+        self.count = 1
+
+    def add(self, price, size):
+        if price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += size
+        self.count += 1
+
+def bar_message(id, interval, bar):
+    return (BAR, BAR_VERSION, id, interval, bar.start,
+            bar.open, bar.high, bar.low, bar.close, bar.volume, bar.count)
+
+def parse_bar(fields):
+    """
+    Returns the (tickerId, interval, start, open, high, low,
+    close, volume, count) of a BAR message.
+
+    """
+    return (fields[2], int(fields[3]), int(fields[4]),
+            float(fields[5]), float(fields[6]), float(fields[7]), float(fields[8]),
+            int(fields[9]), int(fields[10]))
+
+class BarEngine(object):
+    """
+    Builds a bar of each interval per tickerId from its trades,
+    keeping the open bars and the last trade price per tickerId,
+    and publishes the bars of an interval at its end.
+
+    TWS reports a trade as a TICK_PRICE of the last price and
+    size followed by a TICK_SIZE repeating the size; a TICK_SIZE
+    of the last size on its own is a further trade at the last
+    price.
+
+    """
+    TICK_MESSAGES = { TICK_PRICE, TICK_SIZE }
+
+    def __init__(self, publish, intervals=(1, 60), clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        if not intervals or any(int(interval) != interval or interval <= 0 for interval in intervals):
+            raise ValueError('Bar intervals must be positive whole seconds.')
+
+        self._publish = publish
+        self._clock = clock
+        self._bars = dict((interval, {}) for interval in intervals)
+        self._calls = {}
+        self._last = {}
+
+        self.trades = 0
+        self.published = 0
+
+    def add(self, message):
+        try:
+            msgid, id, ticktype = message[0], message[2], int(message[3])
+            if msgid == TICK_PRICE:
+                if ticktype not in LAST_SIZES:
+                    return
+                price = float(message[4])
+                size = int(message[5]) if len(message) > 5 and message[5] else 0
+                if price <= 0:
+                    return
+                # The size is repeated by the TICK_SIZE following.
+                self._last[id] = [price, size]
+            elif ticktype in LAST_PRICES:
+                size = int(message[4])
+                last = self._last.get(id)
+                if last is None:
+                    return
+                echo, last[1] = last[1], None
+                if echo == size:
+                    return
+                price = last[0]
+            else:
+                return
+        except (ValueError, IndexError):
+            log.error('Malformed tick message {0}.'.format(repr(message)))
+            return
+
+        self.trade(id, price, size)
+
+    def trade(self, id, price, size):
+        now = self._clock.seconds()
+        for interval, bars in self._bars.iteritems():
+            start = int(now // interval) * interval
+            bar = bars.get(id)
+            if bar is not None and bar.start == start:
+                bar.add(price, size)
+                continue
+
+            # The bar of the previous interval is still open if
+            # its close is running late.
+            if bar is not None:
+                self._publishBar(id, interval, bar)
+            bars[id] = Bar(start, price, size)
+            if interval not in self._calls:
+                self._calls[interval] = self._clock.callLater(start + interval - now, self.close, interval)
+        self.trades += 1
+
+    def close(self, interval):
+        """
+        Publishes the bars of interval that have ended.
+
+        """
+        call = self._calls.pop(interval, None)
+        if call is not None and call.active():
+            call.cancel()
+
+        now = self._clock.seconds()
+        current = int(now // interval) * interval
+        bars = self._bars[interval]
+        for id in sorted(id for id, bar in bars.iteritems() if bar.start < current):
+            self._publishBar(id, interval, bars.pop(id))
+        if bars:
+            self._calls[interval] = self._clock.callLater(current + interval - now, self.close, interval)
+
+    def _publishBar(self, id, interval, bar):
+        self._publish(bar_message(id, interval, bar))
+        self.published += 1
+
+    def reset(self, id=None):
+        """
+        Discards the open bars and last price of tickerId id, or
+        of every tickerId.
+
+        """
+        if id is None:
+            self._last.clear()
+            for bars in self._bars.itervalues():
+                bars.clear()
+        else:
+            self._last.pop(id, None)
+            for bars in self._bars.itervalues():
+                bars.pop(id, None)
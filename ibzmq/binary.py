@@ -0,0 +1,124 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+The typed binary broadcast encoding, and its client side
+decoders.
+
+With broadcast.encoding set to binary, messages with a schema
+in MESSAGE_SCHEMAS are broadcast as fixed size little endian
+records: a NUL marker byte, the message id and version as
+unsigned shorts, then the fields packed natively. Text messages
+never start with NUL, so both kinds can share the socket; any
+message without a schema, or whose fields do not fit it, is
+sent as text.
+
+Records of one message type have a fixed size, so a batch of
+them can be decoded in one go into a NumPy record array with
+unpack_array.
+
+"""
+
+import struct
+
+from incoming import MESSAGE_SCHEMAS, FIELD_DELIMITER
+
+BINARY_MARKER = b'\0'
+
+HEADER = '<cHH'
+
+MSGID = struct.Struct('<H')
+
+NUMPY_TYPES = { 'i': '<i4', 'q': '<i8', 'd': '<f8' }
+
+def _converters(schema):
+    return tuple(float if type == 'd' else int for _, type in schema)
+
+STRUCTS = dict((msgid, struct.Struct(HEADER + ''.join(type for _, type in schema)))
+               for msgid, schema in MESSAGE_SCHEMAS.items())
+
+CONVERTERS = dict((msgid, _converters(schema)) for msgid, schema in MESSAGE_SCHEMAS.items())
+
+def pack(fields):
+    """
+    Packs a parsed message as a binary record, returning None
+    if it has no schema or its fields do not fit it.
+
+    """
+    msgid = fields[0]
+    converters = CONVERTERS.get(msgid)
+    if converters is None or len(fields) != len(converters) + 2:
+        return None
+    try:
+        return STRUCTS[msgid].pack(BINARY_MARKER, msgid, int(fields[1]),
+                                   *[convert(field) for convert, field in zip(converters, fields[2:])])
+    except (ValueError, struct.error):
+        return None
+
+def is_binary(frame):
+    return frame[:1] == BINARY_MARKER
+
+def message_id(frame):
+    """
+    Returns the message id of a binary or text frame.
+
+    """
+    if is_binary(frame):
+        return MSGID.unpack_from(frame, 1)[0]
+    return int(frame[:frame.index(FIELD_DELIMITER)])
+
+def unpack(frame):
+    """
+    Returns the (msgid, version, fields...) tuple of a binary
+    record, with its fields as ints and floats.
+
+    """
+    return STRUCTS[message_id(frame)].unpack(frame)[1:]
+
+def decode(frame):
+    """
+    Returns the fields of a broadcast message frame: typed for
+    binary records and strings for text messages.
+
+    """
+    if is_binary(frame):
+        return unpack(frame)
+    return tuple(frame.split(FIELD_DELIMITER)[:-1])
+
+def to_text(frame):
+    """
+    Returns the text encoding of a broadcast message frame.
+
+    """
+    if is_binary(frame):
+        return FIELD_DELIMITER.join(map(repr_field, unpack(frame))) + FIELD_DELIMITER
+    return frame
+
+def repr_field(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+def dtype(msgid):
+    """
+    Returns the NumPy dtype of the binary records of message
+    type msgid.
+
+    """
+    import numpy
+    fields = [('marker', 'S1'), ('msgid', '<u2'), ('version', '<u2')]
+    fields += [(name, NUMPY_TYPES[type]) for name, type in MESSAGE_SCHEMAS[msgid]]
+    return numpy.dtype(fields)
+
+def unpack_array(records, msgid):
+    """
+    Returns a NumPy record array over binary records of message
+    type msgid, given as a list of frames or a buffer of records
+    laid end to end. A buffer is decoded without copying.
+
+    """
+    import numpy
+    if isinstance(records, (list, tuple)):
+        records = ''.join(records)
+    return numpy.frombuffer(records, dtype=dtype(msgid))
@@ -0,0 +1,92 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Helpers shared by the proxy and clients of the broadcast
+endpoint.
+
+With broadcast.topics enabled every broadcast is a two frame
+message: a topic frame followed by the message itself. Topics
+take the form 'MM|ID|', where MM is the zero padded message id
+and ID the ticker, request or order id of the message, so
+subscribing to topic(TICK_PRICE, 1042) receives only the
+TickPrice messages of ticker 1042 and subscribing to
+topic(TICK_PRICE) every TickPrice message.
+
+"""
+
+from incoming import MESSAGES_WITH_ID, ID_FIELD, FIELD_DELIMITER
+from binary import pack
+
+TOPIC_SEPARATOR = '|'
+
+def topic(msgid, id=None):
+    """
+    Returns the topic, or topic prefix if id is None, of
+    message type msgid.
+
+    """
+    prefix = '{0:02}{1}'.format(int(msgid), TOPIC_SEPARATOR)
+    if id is None:
+        return prefix
+    return '{0}{1}{2}'.format(prefix, id, TOPIC_SEPARATOR)
+
+def message_topic(message):
+    """
+    Returns the topic of a parsed message tuple.
+
+    """
+    msgid = int(message[0])
+    if msgid in MESSAGES_WITH_ID:
+        return topic(msgid, message[ID_FIELD])
+    return topic(msgid)
+
+def encode(fields, topics=False, source=None, binary=False):
+    """
+    Encodes a parsed message for sending on the broadcast
+    socket, as a binary record if binary is set and it has a
+    schema, preceded by its topic frame if topics is set and
+    by a frame naming the TWS connection it was received on
+    if source is given.
+
+    """
+    message = pack(fields) if binary else None
+    if message is None:
+        message = FIELD_DELIMITER.join(map(str, fields)) + FIELD_DELIMITER
+    if source is not None:
+        if topics:
+            return [message_topic(fields), source, message]
+        return [source, message]
+    if topics:
+        return [message_topic(fields), message]
+    return message
+
+def encode_raw(message, topics=False):
+    """
+    As encode for an already encoded message such as those
+    stored in message logs.
+
+    """
+    if topics:
+        return [message_topic(message.split(FIELD_DELIMITER, ID_FIELD + 1)), message]
+    return message
+
+def message_frame(frames):
+    """
+    Returns the message frame of a received broadcast,
+    whether or not it was sent with a topic or source frame.
+
+    """
+    return frames[-1]
+
+def message_source(frames, topics=False):
+    """
+    Returns the name of the TWS connection a received broadcast
+    came from, or None if it was sent without a source frame.
+
+    """
+    frames = frames[1:] if topics else frames
+    return frames[0] if len(frames) > 1 else None
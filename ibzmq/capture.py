@@ -0,0 +1,365 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Append-only binary capture of broadcast messages.
+
+A capture is a directory of numbered segments. Each segment
+is a data file (NNNNNN.cap) holding a magic header followed
+by records of
+
+    uint64 capture time in nanoseconds since the epoch
+    uint32 message length
+    message bytes
+
+and a sidecar index file (NNNNNN.idx) holding one fixed size
+entry per record of
+
+    uint64 capture time in nanoseconds since the epoch
+    uint64 offset of the record in the data file
+    uint16 message id
+    int32  ticker, request or order id, or NO_ID
+
+All integers are little endian. Readers mmap both files,
+bisect the index by time and select types and ids on the index
+entries alone, with NumPy, only touching the data of the
+records they return. The writer flushes the data before
+the index, and readers ignore entries whose records are not
+all on disk, so a live segment can be read safely.
+
+"""
+
+import os
+import re
+import mmap
+import time
+import struct
+from bisect import bisect_left
+from collections import namedtuple
+
+from incoming import MESSAGES_WITH_ID, ID_FIELD, FIELD_DELIMITER
+
+import logging
+log = logging.getLogger(__name__)
+
+MAGIC = 'IBZCAP01'
+
+RECORD_HEADER = struct.Struct('<QI')
+INDEX_ENTRY   = struct.Struct('<QQHi')
+
+# NumPy layout of the index entries.
+INDEX_DTYPE = [('time', '<u8'), ('offset', '<u8'), ('type', '<u2'), ('id', '<i4')]
+
+NO_ID = -1
+
+SEGMENT_SIZE = 256 * 1024 * 1024
+
+# Index entries held back until the data they point to is flushed.
+INDEX_BATCH = 1024
+
+SEGMENT_PATTERN = re.compile(r'^(\d{6})\.cap$')
+
+CaptureRecord = namedtuple('CaptureRecord', 'time type id content')
+
+def now_ns():
+    return int(time.time() * 1e9)
+
+def message_id(type, content):
+    """
+    Returns the ticker, request or order id of a raw
+    message, or NO_ID if it has none.
+
+    """
+    if type not in MESSAGES_WITH_ID:
+        return NO_ID
+    fields = content.split(FIELD_DELIMITER, ID_FIELD + 1)
+    try:
+        return int(fields[ID_FIELD])
+    except (IndexError, ValueError):
+        return NO_ID
+
+def segment_numbers(directory):
+    numbers = []
+    for name in os.listdir(directory):
+        match = SEGMENT_PATTERN.match(name)
+        if match:
+            numbers.append(int(match.group(1)))
+    return sorted(numbers)
+
+def segment_path(directory, number):
+    return os.path.join(directory, '{0:06}'.format(number))
+
+class CaptureWriter(object):
+    """
+    Appends messages to a capture directory, starting a new
+    segment on open and whenever the current segment exceeds
+    segment_size bytes.
+
+    """
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._directory = directory
+        self._segment_size = segment_size
+
+        numbers = segment_numbers(directory)
+        self._number = numbers[-1] + 1 if numbers else 0
+        self._data = None
+        self._index = None
+        self._entries = []
+
+        self.written = 0
+        self.segments = 0
+
+        self._open()
+
+    def _open(self):
+        path = segment_path(self._directory, self._number)
+        log.info('Opening capture segment {0}.'.format(path))
+
+        self._data = open(path + '.cap', 'wb')
+        self._index = open(path + '.idx', 'wb')
+        self._data.write(MAGIC)
+        # Readers of the live segment see a valid, empty segment.
+        self._data.flush()
+        self._offset = len(MAGIC)
+        self.segments += 1
+
+    def _close(self):
+        self._write_entries()
+        self._data.close()
+        self._index.close()
+
+    def _write_entries(self):
+        # The data is flushed first so that an index entry never
+        # reaches the disk before the record it points to.
+        self._data.flush()
+        self._index.write(''.join(self._entries))
+        self._entries = []
+
+    def write(self, type, content, t=None):
+        """
+        Appends a message captured at time t, in seconds
+        since the epoch, defaulting to now.
+
+        """
+        t_ns = now_ns() if t is None else int(t * 1e9)
+        self.write_ns(type, content, t_ns)
+
+    def write_ns(self, type, content, t_ns):
+        if self._offset >= self._segment_size:
+            self._close()
+            self._number += 1
+            self._open()
+
+        self._data.write(RECORD_HEADER.pack(t_ns, len(content)))
+        self._data.write(content)
+        self._entries.append(INDEX_ENTRY.pack(t_ns, self._offset, type, message_id(type, content)))
+        self._offset += RECORD_HEADER.size + len(content)
+        self.written += 1
+        if len(self._entries) >= INDEX_BATCH:
+            self._write_entries()
+
+    def flush(self):
+        self._write_entries()
+        self._index.flush()
+
+    def close(self):
+        self._close()
+
+def _map(path):
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return ''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class Segment(object):
+    """
+    A memory mapped capture segment.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self._data = _map(path + '.cap')
+        self._index = _map(path + '.idx')
+
+        # A segment just opened by a writer may not have its
+        # header yet, and is read as empty.
+        if self._data and self._data[:len(MAGIC)] != MAGIC:
+            raise ValueError('{0}.cap is not a capture segment.'.format(path))
+
+        self.count = self._complete(len(self._index) // INDEX_ENTRY.size) if self._data else 0
+        self._offsets = None
+
+    def _complete(self, count):
+        # The records of the last entries of a live segment
+        # may not be on disk yet.
+        size = len(self._data)
+        while count:
+            offset = self.entry(count - 1)[1]
+            if offset + RECORD_HEADER.size <= size and \
+               offset + RECORD_HEADER.size + RECORD_HEADER.unpack_from(self._data, offset)[1] <= size:
+                break
+            count -= 1
+        return count
+
+    def entry(self, i):
+        return INDEX_ENTRY.unpack_from(self._index, i * INDEX_ENTRY.size)
+
+    def entries(self):
+        """
+        Returns the index entries as a NumPy record array over
+        the mapped index, without copying.
+
+        """
+        import numpy
+        return numpy.frombuffer(self._index, dtype=INDEX_DTYPE, count=self.count)
+
+    def offsets(self):
+        """
+        Returns the offsets of the records and of their ends
+        as NumPy arrays, computed once per segment. Records are
+        laid end to end, so each but the last ends where the
+        next starts and only the last record's header is read.
+
+        """
+        if self._offsets is None:
+            import numpy
+            offsets = self.entries()['offset'].astype(numpy.int64)
+            ends = numpy.append(offsets[1:], 0)
+            if self.count:
+                last = int(offsets[-1])
+                ends[-1] = last + RECORD_HEADER.size + RECORD_HEADER.unpack_from(self._data, last)[1]
+            self._offsets = offsets, ends
+        return self._offsets
+
+    def time(self, i):
+        return struct.unpack_from('<Q', self._index, i * INDEX_ENTRY.size)[0]
+
+    @property
+    def start(self):
+        return self.time(0) if self.count else None
+
+    @property
+    def end(self):
+        return self.time(self.count - 1) if self.count else None
+
+    def bisect(self, t_ns):
+        """
+        Returns the position of the first entry captured
+        at or after t_ns.
+
+        """
+        return bisect_left(_Times(self), t_ns)
+
+    def content(self, offset):
+        _, length = RECORD_HEADER.unpack_from(self._data, offset)
+        start = offset + RECORD_HEADER.size
+        return self._data[start:start+length]
+
+    def contents(self, positions):
+        """
+        Returns the contents of the records at the index
+        positions given as a NumPy array.
+
+        """
+        offsets, ends = self.offsets()
+        starts = offsets[positions] + RECORD_HEADER.size
+        ends = ends[positions]
+        data = self._data
+        return [data[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+
+    def positions(self, start=None, end=None, types=None, ids=None):
+        """
+        Returns the index positions of the records captured in
+        [start, end) with one of the message types and ids given,
+        as a NumPy array, selected on the index entries.
+
+        """
+        import numpy
+        first = self.bisect(start) if start is not None else 0
+        last = self.bisect(end) if end is not None else self.count
+        entries = self.entries()[first:last]
+        selected = numpy.ones(len(entries), dtype=bool)
+        if types is not None:
+            selected &= numpy.in1d(entries['type'], list(types))
+        if ids is not None:
+            selected &= numpy.in1d(entries['id'], list(ids))
+        return numpy.flatnonzero(selected) + first
+
+    def records(self, start=None, end=None, types=None, ids=None):
+        if types is not None or ids is not None:
+            return self._selected(self.positions(start, end, types, ids))
+        return self._records(start, end)
+
+    def _selected(self, positions, chunk_size=10000):
+        entries = self.entries()
+        for i in xrange(0, len(positions), chunk_size):
+            chunk = positions[i:i+chunk_size]
+            selected = entries[chunk]
+            for t_ns, type, id, content in zip(selected['time'].tolist(), selected['type'].tolist(),
+                                               selected['id'].tolist(), self.contents(chunk)):
+                yield CaptureRecord(t_ns, type, id, content)
+
+    def _records(self, start=None, end=None):
+        first = self.bisect(start) if start is not None else 0
+        for i in xrange(first, self.count):
+            t_ns, offset, type, id = self.entry(i)
+            if end is not None and t_ns >= end:
+                break
+            yield CaptureRecord(t_ns, type, id, self.content(offset))
+
+    def close(self):
+        for m in (self._data, self._index):
+            if m:
+                m.close()
+
+class _Times(object):
+    """
+    Sequence view of the index times of a segment for bisect.
+
+    """
+    def __init__(self, segment):
+        self._segment = segment
+
+    def __len__(self):
+        return self._segment.count
+
+    def __getitem__(self, i):
+        return self._segment.time(i)
+
+class CaptureReader(object):
+    """
+    Reads the records of a capture directory in capture
+    order, optionally restricted to the [start, end) time
+    range in nanoseconds, to message types and to ticker,
+    request or order ids.
+
+    """
+    def __init__(self, directory):
+        self.segments = [Segment(segment_path(directory, number))
+                         for number in segment_numbers(directory)]
+
+    def read(self, start=None, end=None, types=None, ids=None):
+        types = set(types) if types is not None else None
+        ids = set(ids) if ids is not None else None
+        for segment in self.segments:
+            if not segment.count:
+                continue
+            if start is not None and segment.end < start:
+                continue
+            if end is not None and segment.start >= end:
+                break
+            for record in segment.records(start, end, types, ids):
+                yield record
+
+    def __iter__(self):
+        return self.read()
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
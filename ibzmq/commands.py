@@ -0,0 +1,405 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Handles the requests of the command socket, whichever event
+loop and ZeroMQ binding serve it: the OOB requests, tracked
+requests, and the routing of requests over the connection pool
+through the request sharing, caches and pacing configured.
+
+"""
+
+import json
+
+from zmq import constants
+
+from incoming import ID_FIELD, PROXY_METRICS
+from outgoing import CANCEL_MKT_DATA, CANCEL_MKT_DEPTH
+from broadcast import encode
+
+import logging
+log = logging.getLogger(__name__)
+
+ZMQ_OK_RESPONSE  = 'OK'
+ZMQ_ERR_RESPONSE = 'ERR'
+
+ZMQ_OOB_PREFIX = 'OOB'
+
+ZMQ_TRACK_PREFIX = 'TRACK'
+
+ENCODINGS = { 'text', 'binary' }
+
+CANCEL_MKT_DATA_PREFIX = '{0}\0'.format(CANCEL_MKT_DATA)
+CANCEL_MKT_DEPTH_PREFIX = '{0}\0'.format(CANCEL_MKT_DEPTH)
+
+# Connection statuses published in CONNECTION_STATUS messages.
+CONNECTED    = 'CONNECTED'
+DISCONNECTED = 'DISCONNECTED'
+
+def configure_socket(socket, hwm=0, sndbuf=0, rcvbuf=0, linger=None):
+    """
+    Sets the high water marks in messages, the kernel buffer
+    sizes in bytes and the linger period in milliseconds of a
+    pyzmq socket. Must be called before the socket binds or
+    connects, as high water marks only apply to peers connecting
+    later. Zero buffer sizes keep the OS defaults.
+
+    """
+    socket.set(constants.SNDHWM, hwm)
+    socket.set(constants.RCVHWM, hwm)
+    if sndbuf:
+        socket.set(constants.SNDBUF, sndbuf)
+    if rcvbuf:
+        socket.set(constants.RCVBUF, rcvbuf)
+    if linger is not None:
+        socket.set(constants.LINGER, linger)
+
+class CommandHandler(object):
+    """
+    Answers the requests received on the command socket, passed
+    to gotMessage. Engines subclass it with their command socket,
+    providing reply(), sending a reply to a request, doRead(),
+    reading the requests waiting, and the routing information of
+    the requests unanswered in _routingInfo, keyed by message id.
+    Engines supporting tracked requests also provide sendTracked().
+
+    """
+    _pool = None
+    _multiplexer = None
+    _snapshot = None
+    _histcache = None
+    _correlator = None
+    _orderids = None
+    _metrics = None
+    _broadcast = None
+
+    def __init__(self, *args, **kwargs):
+        self._paused = set()
+        super(CommandHandler, self).__init__(*args, **kwargs)
+
+    def setPool(self, pool):
+        """
+        Writes requests to the connections of pool. Connection
+        schedulers, where set, pace the requests written to their
+        connection, acknowledging them once they are written.
+
+        """
+        self._pool = pool
+
+    def setTWSProtocol(self, protocol):
+        """
+        Attaches a newly connected protocol to its connection of
+        the pool and, if the connection is being re-established,
+        restores its subscriptions. Returns the number of
+        subscriptions restored, or None on first connection.
+
+        """
+        connection = self._pool.attach(protocol)
+        if connection.connections == 1:
+            return None
+
+        requests = connection.session.requests()
+        log.info('Restoring {0} subscriptions on connection {1}.'.format(len(requests), connection.name or 'default'))
+        for msg in requests:
+            if connection.scheduler:
+                connection.scheduler.submit(None, msg)
+            else:
+                self.writeRequest(connection, None, msg)
+        return len(requests)
+
+    def lostTWSProtocol(self, protocol):
+        self._pool.detach(protocol)
+        if self._snapshot is not None:
+            self._snapshot.discard_source(protocol.source)
+        if self._histcache:
+            self._histcache.clear_pending(protocol.source)
+        if self._multiplexer:
+            self._multiplexer.clear_last()
+
+    def setMultiplexer(self, multiplexer):
+        """
+        Shares market data subscriptions between clients through
+        multiplexer. Requests satisfied by an existing upstream
+        subscription are acknowledged without writing to TWS, and
+        answered with its last market data. OOB RELEASE requests
+        cancel every subscription of the client sending them.
+
+        """
+        self._multiplexer = multiplexer
+
+    def setSnapshotCache(self, snapshot):
+        """
+        Answers OOB SNAPSHOT requests from snapshot. The request
+        may be followed by tickerIds to limit the reply to their
+        market data.
+
+        """
+        self._snapshot = snapshot
+
+    def setHistoricalCache(self, histcache):
+        """
+        Answers historical data requests from histcache where
+        possible, publishing the cached result on the broadcast
+        socket instead of sending the request to TWS.
+
+        """
+        self._histcache = histcache
+
+    def setCorrelator(self, correlator):
+        """
+        Accepts tracked requests, prefixed with TRACK, whose
+        replies are sent to the client after the OK on the
+        command socket, with the client's message id, through
+        correlator.
+
+        """
+        self._correlator = correlator
+
+    def setOrderIdAllocator(self, orderids):
+        """
+        Answers OOB ORDERIDS requests, optionally followed by a
+        count, with the first of that many order ids from
+        orderids, and the count.
+
+        """
+        self._orderids = orderids
+
+    def setMetrics(self, metrics):
+        """
+        Times the acknowledgement of every request in metrics
+        and answers OOB METRICS requests with its report as JSON.
+
+        """
+        self._metrics = metrics
+
+    def setBroadcast(self, broadcast):
+        """
+        Reports the messages broadcast dropped or held for slow
+        subscribers in the metrics and in answer to OOB
+        BROADCAST requests.
+
+        """
+        self._broadcast = broadcast
+
+    def pauseReading(self, source):
+        """
+        Stops reading requests from the command socket while the
+        TWS connection source cannot take more.
+
+        """
+        if not self._paused:
+            log.warning('TWS connection {0} is not keeping up: pausing requests.'.format(source or 'default'))
+        self._paused.add(source)
+
+    def resumeReading(self, source):
+        if source not in self._paused:
+            return
+        self._paused.discard(source)
+        if not self._paused:
+            log.info('Resuming requests.')
+            self.doRead()
+
+    def gotMessage(self, messageid, msg):
+        if self._metrics is not None:
+            self._metrics.request_received(messageid)
+        if self._multiplexer:
+            self._multiplexer.seen(tuple(self._routingInfo[messageid]))
+
+        # Handle OOB messages.
+        if msg.startswith(ZMQ_OOB_PREFIX + '\0'):
+            fields = msg.split('\0')
+            if fields[1] == 'NOP':
+                log.debug('Sending NOP response.')
+                self.reply_ok(messageid)
+            elif fields[1] == 'PACING' and any(c.scheduler for c in self._pool):
+                self.reply_ok(messageid, json.dumps(self.pacingReport()))
+            elif fields[1] == 'SNAPSHOT' and self._snapshot is not None:
+                tickerids = [field for field in fields[2:] if field]
+                self.reply_ok(messageid, *self._snapshot.snapshot(tickerids or None))
+            elif fields[1] == 'ORDERIDS' and self._orderids is not None:
+                try:
+                    count = int(fields[2]) if len(fields) > 2 and fields[2] else 1
+                    self.reply_ok(messageid, str(self._orderids.allocate(count)), str(count))
+                except ValueError as e:
+                    log.error('Cannot allocate order ids: {0}'.format(e))
+                    self.reply_err(messageid)
+            elif fields[1] == 'METRICS' and self._metrics is not None:
+                self.reply_ok(messageid, json.dumps(self.metricsReport()))
+            elif fields[1] == 'BROADCAST' and self._broadcast is not None:
+                self.reply_ok(messageid, json.dumps(self._broadcast.stats()))
+            elif fields[1] == 'POOL':
+                self.reply_ok(messageid, json.dumps(self._pool.report()))
+            elif fields[1] == 'RELEASE' and self._multiplexer:
+                self.writeCancels(self._multiplexer.release(tuple(self._routingInfo[messageid])))
+                self.reply_ok(messageid)
+            else:
+                log.error('Unrecognized out-of-band message {0}.'.format(msg))
+                self.reply_err(messageid)
+        elif not self._pool.connected():
+            self.reply_err(messageid)
+        else:
+            try:
+                if msg.startswith(ZMQ_TRACK_PREFIX + '\0'):
+                    self.submitTracked(messageid, msg[len(ZMQ_TRACK_PREFIX) + 1:])
+                else:
+                    self.submitRequest(messageid, msg)
+            except ValueError as e:
+                log.error('Malformed request {0}: {1}'.format(repr(msg), e))
+                self.reply_err(messageid)
+
+    def submitTracked(self, messageid, msg):
+        if self._correlator is None:
+            log.error('Tracked requests are not enabled.')
+            self.reply_err(messageid)
+            return
+
+        client = tuple(self._routingInfo[messageid])
+        messages = self._correlator.outgoing(client, messageid, msg)
+        if not messages:
+            self.reply_ok(messageid)
+            return
+
+        for msg in messages[:-1]:
+            self.submitRequest(None, msg, client)
+        self.submitRequest(messageid, messages[-1], client)
+
+    def submitRequest(self, messageid, msg, client=None):
+        if self._orderids is not None:
+            self._orderids.placed(msg)
+        if msg.startswith(CANCEL_MKT_DATA_PREFIX):
+            id = msg.split('\0', ID_FIELD + 1)[ID_FIELD]
+            if self._snapshot is not None:
+                self._snapshot.discard_ticker(id)
+            self.subscriptionCancelled(CANCEL_MKT_DATA, id)
+        elif msg.startswith(CANCEL_MKT_DEPTH_PREFIX):
+            self.subscriptionCancelled(CANCEL_MKT_DEPTH, msg.split('\0', ID_FIELD + 1)[ID_FIELD])
+
+        if self._histcache:
+            cached = self._histcache.request(msg)
+            if cached is not None:
+                protocol = self._pool.any_protocol()
+                protocol.publishFields(cached)
+                self.reply_ok(messageid)
+                if self._correlator is not None:
+                    protocol.replyTracked(cached)
+                return
+
+        if self._multiplexer:
+            if client is None:
+                client = tuple(self._routingInfo[messageid])
+            messages = self._multiplexer.outgoing(client, msg)
+            replayed = self._multiplexer.replay(client, msg)
+            if replayed:
+                protocol = self._pool.any_protocol()
+                for message in replayed:
+                    protocol.publishFields(message)
+                    if self._correlator is not None:
+                        protocol.replyTracked(message)
+            if not messages:
+                self.reply_ok(messageid)
+                return
+        else:
+            messages = [msg]
+
+        # Only the last of several messages standing in for a
+        # request is acknowledged.
+        for msg in messages[:-1]:
+            self.routeRequest(None, msg)
+        self.routeRequest(messageid, messages[-1])
+
+    def subscriptionCancelled(self, msgid, id):
+        """
+        Tells every connection a client cancelled tickerId id,
+        so that state derived from its messages is not carried
+        over to the ticker id's next subscription.
+
+        """
+        for connection in self._pool:
+            if connection.protocol is not None:
+                connection.protocol.subscriptionCancelled(msgid, id)
+
+    def writeCancels(self, cancels):
+        for msg in cancels:
+            self.routeRequest(None, msg)
+
+    def expireClients(self):
+        """
+        Cancels the shared subscriptions of the clients not
+        heard from within the multiplexer's timeout.
+
+        """
+        self.writeCancels(self._multiplexer.expire())
+
+    def routeRequest(self, messageid, msg):
+        connection = self._pool.route(msg)
+        if connection is None:
+            log.error('No connection for request {0}.'.format(repr(msg)))
+            self.reply_err(messageid)
+            return
+        if self._histcache:
+            self._histcache.routed(msg, connection.name)
+        if connection.scheduler:
+            if not connection.scheduler.submit(messageid, msg):
+                self.reply_err(messageid)
+        else:
+            self.writeRequest(connection, messageid, msg)
+
+    def writeRequest(self, connection, messageid, msg):
+        if connection.protocol:
+            connection.protocol.writeMessage(msg)
+        elif not connection.session.forget(msg):
+            self.reply_err(messageid)
+            return
+        # Cancelling a subscription while disconnected just keeps
+        # it from being restored.
+        connection.session.record(msg)
+        self.reply_ok(messageid)
+
+    def pacingReport(self):
+        """
+        Returns the pacing report of each paced connection,
+        or of the only connection of a single connection pool.
+
+        """
+        reports = dict((c.name, c.scheduler.report()) for c in self._pool if c.scheduler)
+        if len(self._pool) == 1:
+            return reports.get(None)
+        return reports
+
+    def metricsReport(self):
+        gauges = {
+            'queued': sum(c.scheduler.depth for c in self._pool if c.scheduler),
+            'connected': len(self._pool.connected()),
+        }
+        if self._broadcast is not None:
+            gauges['broadcast'] = self._broadcast.stats()
+        conflation = dict((c.name or 'default', c.protocol.conflationStats())
+                          for c in self._pool if c.protocol is not None and c.protocol.conflationStats())
+        if conflation:
+            gauges['conflation'] = conflation
+        return self._metrics.report(**gauges)
+
+    def publishMetrics(self, zmq_broadcast, topics=False):
+        """
+        Publishes the metrics report as a PROXY_METRICS message
+        on the broadcast socket.
+
+        """
+        zmq_broadcast.send(encode((PROXY_METRICS, 1, json.dumps(self.metricsReport())), topics))
+
+    def reply_ok(self, messageid, *parts):
+        if messageid is not None:
+            if self._metrics is not None:
+                self._metrics.request_replied(messageid)
+            self.reply(messageid, ZMQ_OK_RESPONSE, *parts)
+
+    def reply_err(self, messageid):
+        if messageid is not None:
+            if self._correlator is not None:
+                self._correlator.discard(messageid)
+            if self._metrics is not None:
+                self._metrics.request_replied(messageid)
+            self.reply(messageid, ZMQ_ERR_RESPONSE)
@@ -17,20 +17,88 @@ class Config(object):
         'endpoint.broadcast',
     }
 
+    DEFAULTS = {
+        'ibtws.clientid' : 0,
+        'ibtws.connections' : None,
+        'reconnect.enabled' : True,
+        'reconnect.delay.initial' : 1.0,
+        'reconnect.delay.max' : 60,
+        'log.level' : 'INFO',
+        'log.summary.interval' : 10,
+        'broadcast.topics' : False,
+        'broadcast.encoding' : 'text',
+        'conflation.enabled' : False,
+        'conflation.interval' : 0,
+        'msglog.backend' : 'sqlite',
+        'msglog.batch.size' : 1000,
+        'msglog.batch.interval' : 0.25,
+        'msglog.queue.size' : 100000,
+        'msglog.wal' : False,
+        'msglog.synchronous' : None,
+        'msglog.segment.size' : 256 * 1024 * 1024,
+        'replay.delay' : 1.0,
+        'pacing.enabled' : False,
+        'pacing.rate' : 40,
+        'pacing.burst' : 10,
+        'pacing.queue.size' : 10000,
+        'pacing.marketdata.rate' : None,
+        'pacing.marketdata.burst' : None,
+        'pacing.historical.rate' : 0.09,
+        'pacing.historical.burst' : 5,
+        'multiplex.enabled' : False,
+        'multiplex.client.timeout' : 0,
+        'correlation.enabled' : False,
+        'orderids.enabled' : False,
+        'metrics.enabled' : False,
+        'metrics.sample' : 100,
+        'metrics.interval' : 0,
+        'snapshot.enabled' : False,
+        'depth.enabled' : False,
+        'depth.rows' : 10,
+        'depth.interval' : 0.1,
+        'depth.diffs' : False,
+        'depth.passthrough' : True,
+        'bars.enabled' : False,
+        'bars.intervals' : [1, 60],
+        'histcache.enabled' : False,
+        'histcache.path' : 'histcache.db',
+        'histcache.size' : 256 * 1024 * 1024,
+        'histcache.ttl' : 60,
+        'broadcast.hwm' : 100000,
+        'broadcast.sndbuf' : 0,
+        'broadcast.linger' : 100,
+        'broadcast.policy' : 'drop',
+        'broadcast.held.max' : 10000,
+        'command.hwm' : 100000,
+        'command.sndbuf' : 0,
+        'command.rcvbuf' : 0,
+        'command.linger' : 100,
+        'command.buffer.size' : 1024 * 1024,
+        'fanout.enabled' : False,
+        'fanout.endpoint' : 'ipc:///var/tmp/ibtws/fanout',
+        'fanout.endpoints' : [],
+        'fanout.stats.interval' : 10,
+        'engine' : 'twisted',
+        'engine.python' : 'python3',
+    }
+
     def __init__(self, path):
         log.info('Loading proxy config from {0}.'.format(path))
+        self.path = path
 
         if not os.path.exists(path):
             raise IOError('Config at path {0} not found.'.format(path))
 
-        config = yaml.load(file(path))
+        with open(path) as f:
+            config = yaml.safe_load(f)
 
         if 'ibzmq' not in config:
             raise ValueError('ibzmq key not found in yaml config.')
 
-        self._config = config['ibzmq']
+        self._config = dict(Config.DEFAULTS)
+        self._config.update(config['ibzmq'])
 
-        missing = Config.REQUIRED - set(self._config.keys())
+        missing = Config.REQUIRED - set(config['ibzmq'].keys())
         if missing:
             raise ValueError('Required config fields {0} not found.'.format(', '.join(missing)))
 
@@ -0,0 +1,79 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+from collections import OrderedDict
+
+from incoming import TICK_PRICE, TICK_SIZE, TICK_GENERIC, TICK_SNAPSHOT_END
+
+class Conflator(object):
+    """
+    Holds back TICK_PRICE, TICK_SIZE and TICK_GENERIC messages,
+    keeping only the latest per (message id, tickerId, tickType),
+    and publishes them every interval seconds or, with an interval
+    of zero, as soon as the reactor has processed the current
+    batch of incoming data.
+
+    Every other message is published immediately and in order,
+    so order messages are never conflated or delayed. A
+    TICK_SNAPSHOT_END first flushes all pending ticks so the
+    ticks of a snapshot precede its end marker.
+
+    """
+    CONFLATED = { TICK_PRICE, TICK_SIZE, TICK_GENERIC }
+    BARRIERS  = { TICK_SNAPSHOT_END }
+
+    def __init__(self, publish, interval=0, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self._publish = publish
+        self._interval = interval
+        self._clock = clock
+        self._pending = OrderedDict()
+        self._flush_call = None
+
+        self.received = 0
+        self.merged = 0
+        self.flushed = 0
+
+    def add(self, message):
+        msgid = message[0]
+        if msgid in self.CONFLATED:
+            key = (msgid, message[2], message[3])
+            self.received += 1
+            if key in self._pending:
+                self.merged += 1
+            self._pending[key] = message
+
+            if self._flush_call is None:
+                self._flush_call = self._clock.callLater(self._interval, self.flush)
+        else:
+            if msgid in self.BARRIERS:
+                self.flush()
+            self._publish(message)
+
+    def flush(self):
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+
+        pending, self._pending = self._pending, OrderedDict()
+        for message in pending.itervalues():
+            self._publish(message)
+        self.flushed += len(pending)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'merged': self.merged,
+            'flushed': self.flushed,
+            'pending': self.pending,
+        }
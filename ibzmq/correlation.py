@@ -0,0 +1,212 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Correlates the messages received from TWS with the tracked
+requests they answer, so the proxy can send each client the
+replies to its own requests on the command socket rather than
+have it pick them out of the broadcast.
+
+"""
+
+from framing import join_fields
+from incoming import ID_FIELD, ERR_MSG, ORDER_STATUS, MESSAGES_WITH_ID
+from incoming import CONTRACT_DATA_END, EXECUTION_DATA_END, HISTORICAL_DATA, FUNDAMENTAL_DATA, TICK_SNAPSHOT_END
+from outgoing import (PLACE_ORDER, CANCEL_ORDER,
+                      REQ_CONTRACT_DATA, REQ_EXECUTIONS,
+                      REQ_MKT_DATA, CANCEL_MKT_DATA,
+                      REQ_MKT_DEPTH, CANCEL_MKT_DEPTH,
+                      REQ_HISTORICAL_DATA, CANCEL_HISTORICAL_DATA,
+                      REQ_REAL_TIME_BARS, CANCEL_REAL_TIME_BARS,
+                      REQ_SCANNER_SUBSCRIPTION, CANCEL_SCANNER_SUBSCRIPTION,
+                      REQ_FUNDAMENTAL_DATA, CANCEL_FUNDAMENTAL_DATA,
+                      REQ_CALC_IMPLIED_VOLAT, CANCEL_CALC_IMPLIED_VOLAT,
+                      REQ_CALC_OPTION_PRICE, CANCEL_CALC_OPTION_PRICE)
+from pool import FINAL_ORDER_STATUSES
+
+import logging
+log = logging.getLogger(__name__)
+
+# Ids of tracked requests are allocated from here on so they do
+# not collide with the ids of untracked requests or of the
+# subscription multiplexer.
+TRACKED_ID_BASE = 1 << 25
+
+# Requests answered once, by the messages ending the answer.
+ENDS = {
+    REQ_CONTRACT_DATA:    { CONTRACT_DATA_END },
+    REQ_EXECUTIONS:       { EXECUTION_DATA_END },
+    REQ_HISTORICAL_DATA:  { HISTORICAL_DATA },
+    REQ_FUNDAMENTAL_DATA: { FUNDAMENTAL_DATA },
+}
+
+SNAPSHOT_ENDS = { TICK_SNAPSHOT_END }
+
+# Requests that can be cancelled, by the id of their cancel.
+# Those not ending by themselves are answered until cancelled.
+CANCELS = {
+    PLACE_ORDER:              CANCEL_ORDER,
+    REQ_MKT_DATA:             CANCEL_MKT_DATA,
+    REQ_MKT_DEPTH:            CANCEL_MKT_DEPTH,
+    REQ_HISTORICAL_DATA:      CANCEL_HISTORICAL_DATA,
+    REQ_REAL_TIME_BARS:       CANCEL_REAL_TIME_BARS,
+    REQ_SCANNER_SUBSCRIPTION: CANCEL_SCANNER_SUBSCRIPTION,
+    REQ_FUNDAMENTAL_DATA:     CANCEL_FUNDAMENTAL_DATA,
+    REQ_CALC_IMPLIED_VOLAT:   CANCEL_CALC_IMPLIED_VOLAT,
+    REQ_CALC_OPTION_PRICE:    CANCEL_CALC_OPTION_PRICE,
+}
+
+CANCEL_REQUESTS = dict((cancel, request) for request, cancel in CANCELS.items())
+
+CANCEL_VERSION = 1
+
+TRACKED = ENDS.viewkeys() | CANCELS.viewkeys()
+
+def is_warning(code):
+    """
+    Returns whether an error code is a warning that does not
+    end the request it refers to. An order's cancel (202) and
+    order messages (399) are followed by its order status.
+
+    """
+    return 2100 <= code < 2200 or code in (202, 399, 10167)
+
+class TrackedRequest(object):
+    def __init__(self, client, messageid, msgid, id, upstream, ends):
+        self.client = client
+        self.messageid = messageid
+        self.msgid = msgid
+        self.id = id
+        self.upstream = upstream
+        self.ends = ends
+
+class RequestCorrelator(object):
+    """
+    Gives the tracked requests of clients ids of their own on
+    the way to TWS and matches the messages received back to
+    them by that id, restoring the client's id. Requests are
+    tracked until the message ending their answer, such as
+    CONTRACT_DATA_END, an error, their cancel, or for orders a
+    final order status.
+
+    Orders keep their order id, which TWS requires to increase
+    per client id.
+
+    """
+    def __init__(self, first_id=TRACKED_ID_BASE):
+        self._next_id = first_id
+        self._by_upstream = {}
+        self._by_client = {}
+        self._by_messageid = {}
+
+    def outgoing(self, client, messageid, msg):
+        """
+        Returns the list of messages to write to TWS for
+        client's tracked request msg, whose replies are to be
+        sent with messageid. An empty list means there is
+        nothing to write, as for a cancel of a request that has
+        already ended.
+
+        """
+        fields = msg.split('\0')
+        msgid = int(fields[0])
+        if len(fields) <= ID_FIELD + 1:
+            raise ValueError('Request {0} has no id.'.format(msgid))
+        id = fields[ID_FIELD]
+
+        # Orders are cancelled whoever placed them, and remain
+        # tracked until TWS reports them cancelled.
+        if msgid == CANCEL_ORDER:
+            return [msg]
+
+        if msgid in CANCEL_REQUESTS:
+            request = self._by_client.get((client, CANCEL_REQUESTS[msgid], id))
+            if request is None:
+                return []
+            self._remove(request)
+            fields[ID_FIELD] = request.upstream
+            return ['\0'.join(fields)]
+
+        if msgid not in TRACKED:
+            raise ValueError('Requests of type {0} cannot be tracked.'.format(msgid))
+
+        messages = []
+        previous = self._by_client.get((client, msgid, id))
+        if previous is not None:
+            self._remove(previous)
+            # Reusing the id of an order modifies the order, while
+            # any other request replaces the previous one.
+            if msgid != PLACE_ORDER and msgid in CANCELS and previous.ends is not SNAPSHOT_ENDS:
+                messages.append(join_fields([CANCELS[msgid], CANCEL_VERSION, previous.upstream]))
+
+        if msgid == PLACE_ORDER:
+            upstream = id
+            if upstream in self._by_upstream:
+                self._remove(self._by_upstream[upstream])
+        else:
+            upstream = str(self._next_id)
+            self._next_id += 1
+
+        if msgid == REQ_MKT_DATA and fields[-2] == '1':
+            ends = SNAPSHOT_ENDS
+        else:
+            ends = ENDS.get(msgid)
+
+        request = TrackedRequest(client, messageid, msgid, id, upstream, ends)
+        self._by_upstream[upstream] = request
+        self._by_client[(client, msgid, id)] = request
+        self._by_messageid[messageid] = request
+
+        fields[ID_FIELD] = upstream
+        messages.append('\0'.join(fields))
+        return messages
+
+    def incoming(self, message):
+        """
+        Returns the (client, messageid, message) a message
+        received from TWS is to be sent on as, with the client's
+        id, or None if it answers no tracked request.
+
+        """
+        msgid = int(message[0])
+        if msgid not in MESSAGES_WITH_ID:
+            return None
+        request = self._by_upstream.get(str(message[ID_FIELD]))
+        if request is None:
+            return None
+
+        if self._finished(request, msgid, message):
+            self._remove(request)
+        return request.client, request.messageid, message[:ID_FIELD] + type(message)([request.id]) + message[ID_FIELD+1:]
+
+    def discard(self, messageid):
+        """
+        Stops tracking the request sent with messageid, if it
+        could not be written to TWS.
+
+        """
+        request = self._by_messageid.get(messageid)
+        if request is not None:
+            self._remove(request)
+
+    def _finished(self, request, msgid, message):
+        # An error ends any request, subscriptions and orders
+        # included, as TWS sends nothing more for it.
+        if msgid == ERR_MSG:
+            return not is_warning(int(message[3]))
+        if request.msgid == PLACE_ORDER:
+            return msgid == ORDER_STATUS and message[3] in FINAL_ORDER_STATUSES
+        if request.ends is None:
+            return False
+        return msgid in request.ends
+
+    def _remove(self, request):
+        del self._by_upstream[request.upstream]
+        del self._by_client[(request.client, request.msgid, request.id)]
+        self._by_messageid.pop(request.messageid, None)
+
+    def __len__(self):
+        return len(self._by_upstream)
@@ -0,0 +1,159 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Decodes the fields received from TWS into messages, whichever
+event loop runs the connection: the handshake and message
+states, and the table driven decoders with the parsing
+generators of MESSAGE_PARSERS as fallback.
+
+"""
+
+from statemachine import StateMachine, State
+from incoming import MESSAGE_PARSERS, MESSAGE_NAMES, FieldCount, Done
+from incoming import MESSAGE_FIELD_COUNTS, MESSAGE_DECODERS, decode
+
+import logging
+log = logging.getLogger(__name__)
+
+# States for TWS protocol state machine.
+Disconnected        = State('Disconnected')
+Connecting          = State('Connecting')
+WaitingForMessageID = State('WaitingForMessageID')
+WaitingForGenerator = State('WaitingForGenerator', 'generator fieldcount cumfieldcount')
+
+Connecting.fieldcount          = 2
+WaitingForMessageID.fieldcount = 2
+
+class MessageDecoder(StateMachine):
+    """
+    The state machine of a TWS connection. fieldsReceived
+    decodes the fields given into messages, passing each to
+    messageParsed, and buffers any incomplete message. The
+    handshake is completed by fieldsReceived_Connecting.
+
+    """
+    delimiter = '\0'
+
+    CLIENT_VERSION = 59
+
+    # Decode messages with the table driven decoders rather than
+    # stepping through the parsing generators field group by field group.
+    table_decoding = True
+
+    # Counts unknown message ids where set.
+    _metrics = None
+
+    states = { Disconnected,
+               Connecting,
+               WaitingForMessageID,
+               WaitingForGenerator }
+
+    transitions = {
+        Disconnected        : { Connecting },
+        Connecting          : { WaitingForMessageID, Disconnected },
+        WaitingForMessageID : { WaitingForGenerator, Disconnected },
+        WaitingForGenerator : { WaitingForGenerator, WaitingForMessageID, Disconnected },
+    }
+    initial_state = Disconnected()
+
+    def __init__(self):
+        super(MessageDecoder, self).__init__()
+        # Checked once rather than formatting a debug line per
+        # message only for it to be dropped.
+        self._debug = log.isEnabledFor(logging.DEBUG)
+        self._field_buffer = []
+
+    def fieldsReceived(self, fields):
+        """
+        Dispatches as many complete field groups as the
+        current state requires, buffering the remainder
+        until more data arrives.
+
+        """
+        offset, available = 0, len(fields)
+        while True:
+            if self.table_decoding and self.is_state(WaitingForMessageID):
+                end = self.decodeMessage(fields, offset, available)
+                if end is None:
+                    break
+            else:
+                end = offset + self.state.fieldcount
+                if end > available:
+                    break
+                self.fieldsReceived_dispatch(fields[offset:end])
+            offset = end
+        self._field_buffer = fields[offset:]
+
+    def decodeMessage(self, fields, offset, available):
+        """
+        Decodes the message starting at fields[offset] in a single
+        step, returning the offset following it or None if the
+        message is incomplete. Messages without a table driven
+        decoder fall back to their parsing generator.
+
+        """
+        if available - offset < 2:
+            return None
+
+        msgid = int(fields[offset])
+        if msgid not in MESSAGE_FIELD_COUNTS and msgid not in MESSAGE_DECODERS:
+            self.fieldsReceived_WaitingForMessageID(tuple(fields[offset:offset+2]))
+            return offset + 2
+
+        decoded = decode(fields, offset, available)
+        if decoded is None:
+            return None
+
+        message, end = decoded
+        self.messageParsed(message)
+        return end
+
+    def fieldsReceived_dispatch(self, fields):
+        state_handler = getattr(self, 'fieldsReceived_' + self.state_name)
+        state_handler(tuple(fields))
+
+    #### State specific handling of field receipt ####
+
+    def fieldsReceived_WaitingForMessageID(self, fields):
+        msgid, msgversion = map(int, fields)
+        if self._debug:
+            log.debug('Parsing: %s(%d) %d', MESSAGE_NAMES.get(msgid, 'Unknown'), msgid, msgversion)
+        parser = MESSAGE_PARSERS.get(msgid, None)
+
+        if parser:
+            generator = parser(msgid, msgversion)
+            action, fieldcount = next(generator)
+            assert action == FieldCount, 'Parsing generator must return a field count on first yield.'
+            self.transition(WaitingForGenerator(generator, fieldcount, 2))
+        else:
+            log.error('Unimplemented message ID: {0}'.format(msgid))
+            if self._metrics is not None:
+                self._metrics.unknown[msgid] += 1
+
+    def fieldsReceived_WaitingForGenerator(self, fields):
+        generator = self.state.generator
+        cumfieldcount = self.state.cumfieldcount + len(fields)
+
+        action, value = generator.send(fields)
+        if action == FieldCount:
+            self.transition(WaitingForGenerator(generator, value, cumfieldcount))
+        elif action == Done:
+            generator.close()
+
+            assert cumfieldcount == len(value), 'The number of consumed fields shall equal the length of the resulting message.'
+            self.transition(WaitingForMessageID())
+            self.messageParsed(value)
+        else:
+            raise Exception('Unrecognised parser action {0}.'.format(action))
+
+    def messageParsed(self, message):
+        """
+        Called with every message decoded, as a tuple of its
+        fields. Engines override it to publish the message.
+
+        """
+        raise NotImplementedError()
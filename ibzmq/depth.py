@@ -0,0 +1,230 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Builds order books from MARKET_DEPTH and MARKET_DEPTH_L2
+updates so the book is rebuilt once in the proxy rather than
+once per subscriber.
+
+Books are published as BOOK_SNAPSHOT messages,
+
+    BOOK_SNAPSHOT, version, tickerId,
+    bid count, (price, size, market maker) per bid,
+    ask count, (price, size, market maker) per ask
+
+with the best level first, or as BOOK_DIFF messages listing
+only the levels changed since the book was last published,
+
+    BOOK_DIFF, version, tickerId, count,
+    (side, position, price, size, market maker) per level
+
+where a size of zero marks a level that no longer exists.
+
+"""
+
+from array import array
+from collections import OrderedDict
+
+from incoming import MARKET_DEPTH, MARKET_DEPTH_L2, BOOK_SNAPSHOT, BOOK_DIFF
+
+import logging
+log = logging.getLogger(__name__)
+
+BOOK_VERSION = 1
+
+# Depth operations and sides.
+INSERT, UPDATE, DELETE = 0, 1, 2
+ASK, BID = 0, 1
+
+SIDES = (BID, ASK)
+
+REMOVED = (0.0, 0, '')
+
+class BookSide(object):
+    """
+    One side of a book, held in parallel price and size arrays
+    ordered best level first.
+
+    """
+    def __init__(self):
+        self.prices = array('d')
+        self.sizes = array('l')
+        self.makers = []
+
+    def __len__(self):
+        return len(self.prices)
+
+    def apply(self, operation, position, price, size, maker=''):
+        if operation == DELETE:
+            if position < len(self):
+                del self.prices[position]
+                del self.sizes[position]
+                del self.makers[position]
+        elif operation == UPDATE and position < len(self):
+            self.prices[position] = price
+            self.sizes[position] = size
+            self.makers[position] = maker
+        else:
+            # Inserts, and updates of a level not yet seen.
+            position = min(position, len(self))
+            self.prices.insert(position, price)
+            self.sizes.insert(position, size)
+            self.makers.insert(position, maker)
+
+    def levels(self, rows):
+        return zip(self.prices[:rows], self.sizes[:rows], self.makers[:rows])
+
+class Book(object):
+    def __init__(self):
+        self.sides = { BID: BookSide(), ASK: BookSide() }
+
+    def apply(self, operation, side, position, price, size, maker=''):
+        self.sides[side].apply(operation, position, price, size, maker)
+
+    def levels(self, rows):
+        return dict((side, self.sides[side].levels(rows)) for side in SIDES)
+
+def depth_update(message):
+    """
+    Returns the (tickerId, operation, side, position, price,
+    size, market maker) of a depth message.
+
+    """
+    if message[0] == MARKET_DEPTH:
+        _, _, id, position, operation, side, price, size = message
+        maker = ''
+    else:
+        _, _, id, position, maker, operation, side, price, size = message
+    return int(id), int(operation), int(side), int(position), float(price), int(size), maker
+
+def book_snapshot(id, levels):
+    fields = [BOOK_SNAPSHOT, BOOK_VERSION, id]
+    for side in SIDES:
+        fields.append(len(levels[side]))
+        for price, size, maker in levels[side]:
+            fields.extend((repr(price), size, maker))
+    return tuple(fields)
+
+def book_diff(id, previous, levels):
+    changes = []
+    for side in SIDES:
+        old, new = previous.get(side, ()), levels[side]
+        for position in xrange(max(len(old), len(new))):
+            level = new[position] if position < len(new) else REMOVED
+            if position >= len(old) or old[position] != level:
+                price, size, maker = level
+                changes.extend((side, position, repr(price), size, maker))
+    if not changes:
+        return None
+    return (BOOK_DIFF, BOOK_VERSION, id, len(changes) // 5) + tuple(changes)
+
+def parse_book(message):
+    """
+    Returns the tickerId and {side: [(price, size, market maker)]}
+    levels of a parsed BOOK_SNAPSHOT message, or the tickerId and
+    [(side, position, price, size, market maker)] changes of a
+    BOOK_DIFF message.
+
+    """
+    msgid, id, fields = int(message[0]), int(message[2]), message[3:]
+    if msgid == BOOK_DIFF:
+        count = int(fields[0])
+        return id, [(int(fields[i]), int(fields[i+1]), float(fields[i+2]), int(fields[i+3]), fields[i+4])
+                    for i in xrange(1, 1 + 5*count, 5)]
+
+    levels, pos = {}, 0
+    for side in SIDES:
+        count = int(fields[pos])
+        levels[side] = [(float(fields[i]), int(fields[i+1]), fields[i+2])
+                        for i in xrange(pos + 1, pos + 1 + 3*count, 3)]
+        pos += 1 + 3*count
+    return id, levels
+
+class DepthEngine(object):
+    """
+    Applies depth updates to a book per tickerId and publishes
+    the top rows levels of each changed book every interval
+    seconds, or with an interval of zero once the reactor has
+    processed the current batch of incoming data, as snapshots
+    or, if diffs is set, as diffs.
+
+    """
+    DEPTH_MESSAGES = { MARKET_DEPTH, MARKET_DEPTH_L2 }
+
+    def __init__(self, publish, rows=10, interval=0.1, diffs=False, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self._publish = publish
+        self._rows = rows
+        self._interval = interval
+        self._diffs = diffs
+        self._clock = clock
+        self._books = {}
+        self._published = {}
+        self._dirty = OrderedDict()
+        self._flush_call = None
+
+        self.updates = 0
+        self.published = 0
+
+    def add(self, message):
+        try:
+            id, operation, side, position, price, size, maker = depth_update(message)
+        except ValueError:
+            log.error('Malformed depth message {0}.'.format(repr(message)))
+            return
+
+        book = self._books.get(id)
+        if book is None:
+            book = self._books[id] = Book()
+        book.apply(operation, side, position, price, size, maker)
+        self.updates += 1
+
+        self._dirty[id] = True
+        if self._flush_call is None:
+            self._flush_call = self._clock.callLater(self._interval, self.flush)
+
+    def flush(self):
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+
+        dirty, self._dirty = self._dirty, OrderedDict()
+        for id in dirty:
+            levels = self._books[id].levels(self._rows)
+            if self._diffs:
+                message = book_diff(id, self._published.get(id, {}), levels)
+            else:
+                message = book_snapshot(id, levels)
+            self._published[id] = levels
+            if message is not None:
+                self._publish(message)
+                self.published += 1
+
+    def book(self, id):
+        """
+        Returns the current top rows levels of the book of
+        tickerId id by side.
+
+        """
+        book = self._books.get(id)
+        return book.levels(self._rows) if book else dict((side, []) for side in SIDES)
+
+    def reset(self, id=None):
+        """
+        Discards the book of tickerId id, or every book.
+
+        """
+        if id is None:
+            self._books.clear()
+            self._published.clear()
+            self._dirty.clear()
+        else:
+            self._books.pop(id, None)
+            self._published.pop(id, None)
+            self._dirty.pop(id, None)
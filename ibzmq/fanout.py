@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Fans the broadcast out over worker processes.
+
+With fanout.enabled the proxy process only frames and parses
+the messages from TWS and handles requests, publishing every
+message as text on the internal fanout.endpoint. A worker
+process per endpoint in fanout.endpoints subscribes to it, does
+the derived processing configured (bars, depth books,
+conflation, the binary encoding and topics) and publishes the
+result on its own endpoint, which subscribers connect to. The
+cost of serving subscribers is spread over the workers, and
+runs in parallel with parsing.
+
+The proxy starts the workers, restarting any that exit, by
+running this module with the config and the worker's index, and
+connects to TWS once every worker is subscribed, as messages
+published before are not received. The proxy's end of the pipe
+is an XPUB socket, on which it sees each worker subscribe.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+
+from functools import partial
+
+from twisted.internet import reactor, defer
+from twisted.internet.protocol import ProcessProtocol
+from twisted.internet.task import LoopingCall
+
+from zmq import constants
+from txzmq import ZmqFactory, ZmqEndpoint, ZmqEndpointType, ZmqSubConnection
+
+from incoming import PROXY_METRICS, CONNECTION_STATUS, FIELD_DELIMITER
+from broadcast import encode, message_frame, message_source
+from conflation import Conflator
+from depth import DepthEngine
+from bars import BarEngine
+from backpressure import BroadcastConnection, configure
+from config import Config
+
+import logging
+log = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+
+RESTART_DELAY = 1.0
+
+# Prefix of the topic a worker subscribes to once subscribed to
+# every message, telling the proxy it receives them. Messages on
+# the pipe never start with a NUL.
+READY_TOPIC = '\0READY\0'
+
+def ready_topic(index, pid):
+    return '{0}{1}\0{2}'.format(READY_TOPIC, index, pid)
+
+def derived_options(config):
+    """
+    Returns the options of the derived processing configured,
+    as taken by IBTWSProtocol and DerivedStage.
+
+    """
+    depth = None
+    if config['depth.enabled']:
+        depth = {
+            'rows': config['depth.rows'],
+            'interval': config['depth.interval'],
+            'diffs': config['depth.diffs'],
+        }
+    return {
+        'conflation': config['conflation.interval'] if config['conflation.enabled'] else None,
+        'depth': depth,
+        'depth_passthrough': config['depth.passthrough'],
+        'bars': { 'intervals': config['bars.intervals'] } if config['bars.enabled'] else None,
+    }
+
+class DerivedStage(object):
+    """
+    The processing a worker does in place of the proxy on the
+    messages of one TWS connection: bars, depth books and
+    conflation, in the order the proxy applies them.
+
+    """
+    def __init__(self, publish, conflation=None, depth=None, depth_passthrough=True, bars=None, clock=None):
+        self._publish = publish
+        self._conflator = Conflator(publish, conflation, clock=clock) if conflation is not None else None
+        self._depth = DepthEngine(publish, clock=clock, **depth) if depth is not None else None
+        self._depth_passthrough = depth_passthrough
+        self._bars = BarEngine(publish, clock=clock, **bars) if bars is not None else None
+
+    def conflationStats(self):
+        return self._conflator.stats() if self._conflator is not None else None
+
+    def add(self, message):
+        msgid = message[0]
+        # A stage outlives the proxy's connections to TWS, whose
+        # books and bars are stale once the connection is lost
+        # or back.
+        if msgid == CONNECTION_STATUS:
+            if self._depth is not None:
+                self._depth.reset()
+            if self._bars is not None:
+                self._bars.reset()
+        if self._bars is not None and msgid in BarEngine.TICK_MESSAGES:
+            self._bars.add(message)
+        if self._depth is not None and msgid in DepthEngine.DEPTH_MESSAGES:
+            self._depth.add(message)
+            if not self._depth_passthrough:
+                return
+        if self._conflator is not None:
+            self._conflator.add(message)
+        else:
+            self._publish(message)
+
+class FanoutWorker(object):
+    """
+    Runs the messages received from the proxy through a derived
+    stage per TWS connection and publishes the result, counting
+    the messages received and published.
+
+    """
+    def __init__(self, broadcast, index=0, topics=False, binary=False, clock=None, **options):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.index = index
+        self._broadcast = broadcast
+        self._topics = topics
+        self._binary = binary
+        self._clock = clock
+        self._options = options
+        self._stages = {}
+
+        self.received = 0
+        self.published = 0
+        self._reported = (clock.seconds(), 0, 0)
+
+    def add(self, frames):
+        """
+        Processes a message received on the fan-out pipe, given
+        as its frames.
+
+        """
+        self.received += 1
+        fields = message_frame(frames).split(FIELD_DELIMITER)
+        fields.pop()
+        try:
+            message = (int(fields[0]), int(fields[1])) + tuple(fields[2:])
+        except (ValueError, IndexError):
+            log.error('Malformed message {0} received from the proxy.'.format(repr(frames)))
+            return
+
+        source = message_source(frames)
+        stage = self._stages.get(source)
+        if stage is None:
+            stage = self._stages[source] = DerivedStage(partial(self.publish, source),
+                                                        clock=self._clock, **self._options)
+        stage.add(message)
+
+    def publish(self, source, fields):
+        self._broadcast.send(encode(fields, self._topics, source, self._binary))
+        self.published += 1
+
+    def stats(self):
+        """
+        Returns the worker's counters and its rates since the
+        stats were last taken.
+
+        """
+        now = self._clock.seconds()
+        then, received, published = self._reported
+        self._reported = (now, self.received, self.published)
+        elapsed = now - then
+        stats = {
+            'worker': self.index,
+            'received': self.received,
+            'published': self.published,
+            'interval': elapsed,
+            'received_rate': (self.received - received) / elapsed if elapsed else 0.0,
+            'published_rate': (self.published - published) / elapsed if elapsed else 0.0,
+        }
+        if isinstance(self._broadcast, BroadcastConnection):
+            stats['broadcast'] = self._broadcast.stats()
+        conflation = dict((source or 'default', stage.conflationStats())
+                          for source, stage in self._stages.iteritems() if stage.conflationStats())
+        if conflation:
+            stats['conflation'] = conflation
+        return stats
+
+    def publishStats(self):
+        """
+        Logs the worker's stats and publishes them as a
+        PROXY_METRICS message on its endpoint.
+
+        """
+        stats = self.stats()
+        log.info('worker=%d received=%d published=%d interval=%.1fs rate=%.0f/s', self.index,
+                 stats['received'], stats['published'], stats['interval'], stats['received_rate'])
+        self._broadcast.send(encode((PROXY_METRICS, 1, json.dumps(stats)), self._topics))
+
+class FanoutPipe(BroadcastConnection):
+    """
+    The proxy's end of the fan-out pipe: an XPUB socket, whatever
+    the broadcast policy, telling the WorkerProcess in workers of
+    each worker subscribing. Subscriptions reach the socket in the
+    order a worker makes them, so once its ready_topic arrives the
+    worker receives every message published.
+
+    """
+    socketType = constants.XPUB
+
+    def __init__(self, factory, endpoint=None, **options):
+        self.workers = {}
+        BroadcastConnection.__init__(self, factory, endpoint, **options)
+
+    def messageReceived(self, message):
+        subscription = message[0]
+        if subscription[:1] != '\x01' or not subscription.startswith(READY_TOPIC, 1):
+            return
+        index, pid = subscription[1 + len(READY_TOPIC):].split('\0')
+        worker = self.workers.get(int(index))
+        if worker is not None:
+            worker.subscribed(int(pid))
+
+class FanoutSubscriber(ZmqSubConnection):
+    def __init__(self, factory, worker):
+        self.worker = worker
+        ZmqSubConnection.__init__(self, factory)
+        self.subscribe('')
+
+    def messageReceived(self, message):
+        self.worker.add(message)
+
+class WorkerProcess(ProcessProtocol):
+    """
+    Runs a worker process, restarting it RESTART_DELAY seconds
+    after it exits until stopped. ready fires once the worker
+    is first subscribed to the pipe.
+
+    """
+    def __init__(self, config_path, index):
+        self.config_path = config_path
+        self.index = index
+        self.stopping = False
+        self.ready = defer.Deferred()
+
+    def start(self):
+        args = [sys.executable, WORKER_SCRIPT, self.config_path, str(self.index)]
+        reactor.spawnProcess(self, sys.executable, args, env=os.environ, childFDs={ 0: 'w', 1: 1, 2: 2 })
+
+    def connectionMade(self):
+        log.info('Started fan-out worker {0}, pid {1}.'.format(self.index, self.transport.pid))
+
+    def subscribed(self, pid):
+        """
+        Called by the pipe once the worker process pid is
+        subscribed.
+
+        """
+        if self.transport is None or self.transport.pid != pid:
+            return
+        if not self.ready.called:
+            self.ready.callback(self)
+        else:
+            log.info('Fan-out worker {0} subscribed again, pid {1}.'.format(self.index, pid))
+
+    def processEnded(self, reason):
+        if self.stopping:
+            return
+        log.error('Fan-out worker {0} exited: {1} Restarting.'.format(self.index, reason.getErrorMessage()))
+        reactor.callLater(RESTART_DELAY, self.start)
+
+    def stop(self):
+        self.stopping = True
+        if self.transport is not None and self.transport.pid is not None:
+            self.transport.signalProcess('TERM')
+
+def start_workers(config, pipe):
+    """
+    Starts a worker process per endpoint of fanout.endpoints,
+    stopped with the reactor. Returns a Deferred firing once
+    every worker is subscribed to pipe, a FanoutPipe.
+
+    """
+    workers = [WorkerProcess(config.path, index) for index in xrange(len(config['fanout.endpoints']))]
+    for worker in workers:
+        pipe.workers[worker.index] = worker
+        worker.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', worker.stop)
+    return defer.gatherResults([worker.ready for worker in workers])
+
+def main(config, index):
+    endpoint = config['fanout.endpoints'][index]
+    factory = ZmqFactory()
+    broadcast = BroadcastConnection(factory, policy=config['broadcast.policy'],
+                                    held_max=config['broadcast.held.max'])
+    configure(broadcast,
+              hwm=config['broadcast.hwm'],
+              sndbuf=config['broadcast.sndbuf'],
+              linger=config['broadcast.linger'])
+    broadcast.addEndpoints([ZmqEndpoint(ZmqEndpointType.bind, endpoint)])
+    worker = FanoutWorker(broadcast, index,
+                          topics=config['broadcast.topics'],
+                          binary=config['broadcast.encoding'] == 'binary',
+                          **derived_options(config))
+    pipe = FanoutSubscriber(factory, worker)
+    configure(pipe, hwm=config['broadcast.hwm'])
+    pipe.addEndpoints([ZmqEndpoint(ZmqEndpointType.connect, config['fanout.endpoint'])])
+    # After subscribing to everything, so the proxy sees it last.
+    pipe.subscribe(ready_topic(index, os.getpid()))
+    if config['fanout.stats.interval']:
+        LoopingCall(worker.publishStats).start(config['fanout.stats.interval'], now=False)
+
+    log.info('Fan-out worker {0} publishing on {1}.'.format(index, endpoint))
+    reactor.run()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    if len(sys.argv) != 3:
+        print('Usage: {0} config.yaml index'.format(sys.argv[0]))
+        sys.exit(1)
+
+    config = Config(sys.argv[1])
+    logging.getLogger().setLevel(config['log.level'])
+    main(config, int(sys.argv[2]))
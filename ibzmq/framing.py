@@ -0,0 +1,45 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+from incoming import FIELD_DELIMITER
+
+class FieldSplitter(object):
+    """
+    Splits a stream of delimited fields into complete fields
+    one chunk at a time, carrying any partial trailing field
+    over to the next chunk.
+
+    """
+    def __init__(self, delimiter=FIELD_DELIMITER):
+        self.delimiter = delimiter
+        self._partial = ''
+
+    def split(self, data):
+        """
+        Returns a list of the complete fields terminated
+        within data.
+
+        """
+        if self._partial:
+            data = self._partial + data
+        fields = data.split(self.delimiter)
+        self._partial = fields.pop()
+        return fields
+
+    @property
+    def partial(self):
+        return self._partial
+
+    def reset(self):
+        self._partial = ''
+
+def join_fields(fields, delimiter=FIELD_DELIMITER):
+    """
+    Encodes a sequence of fields into their wire
+    representation.
+
+    """
+    return delimiter.join(map(str, fields)) + delimiter
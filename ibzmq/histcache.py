@@ -0,0 +1,205 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+An on-disk cache of HISTORICAL_DATA results, keyed by the
+contract and bar parameters of the REQ_HISTORICAL_DATA request
+that produced them, so repeated requests are answered without
+going to TWS or spending historical data pacing allowance.
+
+"""
+
+import time
+import sqlite3
+import hashlib
+
+from framing import join_fields
+from incoming import ID_FIELD, HISTORICAL_DATA, ERR_MSG
+from outgoing import REQ_HISTORICAL_DATA, CANCEL_HISTORICAL_DATA
+
+import logging
+log = logging.getLogger(__name__)
+
+END_DATE_TIME_FORMAT = '%Y%m%d %H:%M:%S'
+
+REQ_HISTORICAL_DATA_PREFIX = '{0}\0'.format(REQ_HISTORICAL_DATA)
+
+def create_schema(db):
+    if not db.execute('SELECT * FROM sqlite_master WHERE name="historical"').fetchall():
+        log.info('historical table not found: creating.')
+        db.execute('CREATE TABLE historical (key TEXT PRIMARY KEY, content BLOB, size INTEGER, expires REAL, used REAL)')
+        db.commit()
+
+def request_key(fields):
+    """
+    Returns the cache key of the fields of a REQ_HISTORICAL_DATA
+    request: everything following the request id.
+
+    """
+    return hashlib.sha1(join_fields(fields[ID_FIELD+1:])).hexdigest()
+
+def end_date_time(fields):
+    # Version 6 requests carry the contract id ahead of the symbol.
+    return fields[14 if int(fields[1]) < 6 else 15]
+
+def is_forming(fields, now):
+    """
+    Returns whether the bars of a request may still change:
+    those ending now, or at a time not yet passed.
+
+    """
+    end = end_date_time(fields)
+    if not end:
+        return True
+    try:
+        return time.mktime(time.strptime(end[:17], END_DATE_TIME_FORMAT)) > now
+    except ValueError:
+        return True
+
+class HistoricalDataCache(object):
+    """
+    Stores the HISTORICAL_DATA result of each request made
+    through it in the sqlite database at path, evicting the
+    least recently used results once their total size exceeds
+    max_size bytes. Results of requests whose bars may still be
+    forming expire after ttl seconds.
+
+    Hits only note the time a result was used, which is written
+    with the next result stored or on closing, so answering from
+    the cache does not wait on a commit.
+
+    """
+    def __init__(self, path, max_size=256 * 1024 * 1024, ttl=60, timer=time.time):
+        self._db = sqlite3.connect(path)
+        create_schema(self._db)
+        self._max_size = max_size
+        self._ttl = ttl
+        self._timer = timer
+        self._pending = {}
+        self._sources = {}
+        self._used = {}
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM historical').fetchone()[0]
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def request(self, msg):
+        """
+        Returns the cached result of a REQ_HISTORICAL_DATA request
+        msg, under the request's id, or None if it must be sent to
+        TWS, in which case its result will be cached when received.
+
+        """
+        fields = msg.split('\0')[:-1]
+        msgid = int(fields[0])
+        if msgid == CANCEL_HISTORICAL_DATA:
+            self._pending.pop(fields[ID_FIELD], None)
+            self._sources.pop(fields[ID_FIELD], None)
+            return None
+        elif msgid != REQ_HISTORICAL_DATA:
+            return None
+
+        now = self._timer()
+        key = request_key(fields)
+        row = self._db.execute('SELECT content, expires FROM historical WHERE key=?', (key,)).fetchone()
+        if row is not None:
+            content, expires = row
+            if expires is None or expires > now:
+                self.hits += 1
+                self._used[key] = now
+                message = str(content).split('\0')[:-1]
+                return (HISTORICAL_DATA, int(message[1]), fields[ID_FIELD]) + tuple(message[ID_FIELD+1:])
+            self._delete(key)
+
+        self.misses += 1
+        expires = now + self._ttl if is_forming(fields, now) else None
+        self._pending[fields[ID_FIELD]] = (key, expires)
+        return None
+
+    def routed(self, msg, source):
+        """
+        Notes the connection a request was written to, so that
+        it is forgotten only if that connection is lost.
+
+        """
+        if msg.startswith(REQ_HISTORICAL_DATA_PREFIX):
+            id = msg.split('\0', ID_FIELD + 1)[ID_FIELD]
+            if id in self._pending:
+                self._sources[id] = source
+
+    def received(self, message):
+        """
+        Caches message if it is the result of a pending request.
+
+        """
+        msgid = message[0]
+        if msgid not in (HISTORICAL_DATA, ERR_MSG):
+            return
+
+        id = str(message[ID_FIELD])
+        self._sources.pop(id, None)
+        pending = self._pending.pop(id, None)
+        if pending is None or msgid == ERR_MSG:
+            return
+
+        key, expires = pending
+        content = join_fields(message)
+        self._delete(key)
+        self._db.execute('INSERT INTO historical (key, content, size, expires, used) VALUES (?,?,?,?,?)',
+                         (key, sqlite3.Binary(content), len(content), expires, self._timer()))
+        self._size += len(content)
+        self._write_used()
+        self._evict()
+        self._db.commit()
+
+    def clear_pending(self, source):
+        """
+        Forgets the requests awaiting results from the connection
+        source, which will not arrive once it is lost.
+
+        """
+        for id in [id for id, s in self._sources.iteritems() if s == source]:
+            del self._sources[id]
+            del self._pending[id]
+
+    def _write_used(self):
+        if self._used:
+            self._db.executemany('UPDATE historical SET used=? WHERE key=?',
+                                 [(used, key) for key, used in self._used.iteritems()])
+            self._used.clear()
+
+    def _delete(self, key):
+        self._used.pop(key, None)
+        row = self._db.execute('SELECT size FROM historical WHERE key=?', (key,)).fetchone()
+        if row is not None:
+            self._db.execute('DELETE FROM historical WHERE key=?', (key,))
+            self._size -= row[0]
+
+    def _evict(self):
+        while self._size > self._max_size:
+            key, size = self._db.execute('SELECT key, size FROM historical ORDER BY used LIMIT 1').fetchone()
+            self._db.execute('DELETE FROM historical WHERE key=?', (key,))
+            self._size -= size
+            self.evictions += 1
+
+    @property
+    def size(self):
+        return self._size
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'pending': len(self._pending),
+            'size': self._size,
+        }
+
+    def close(self):
+        self._write_used()
+        self._db.commit()
+        self._db.close()
@@ -43,6 +43,30 @@ TICK_SNAPSHOT_END        = 57
 MARKET_DATA_TYPE         = 58
 COMMISSION_REPORT        = 59
 
+# Ids of messages generated by the proxy itself, numbered
+# clear of the TWS message ids.
+BOOK_SNAPSHOT            = 1001
+BOOK_DIFF                = 1002
+CONNECTION_STATUS        = 1003
+PROXY_METRICS            = 1004
+BAR                      = 1005
+
+# Messages whose first field following the version is the
+# ticker, request or order id the message relates to.
+ID_FIELD = 2
+
+MESSAGES_WITH_ID = {
+    TICK_PRICE, TICK_SIZE, TICK_OPTION_COMPUTATION,
+    TICK_GENERIC, TICK_STRING, TICK_EFP, TICK_SNAPSHOT_END,
+    MARKET_DATA_TYPE, MARKET_DEPTH, MARKET_DEPTH_L2,
+    ORDER_STATUS, ERR_MSG, OPEN_ORDER,
+    CONTRACT_DATA, CONTRACT_DATA_END, BOND_CONTRACT_DATA,
+    EXECUTION_DATA, EXECUTION_DATA_END,
+    HISTORICAL_DATA, SCANNER_DATA, REAL_TIME_BARS,
+    FUNDAMENTAL_DATA, DELTA_NEUTRAL_VALIDATION,
+    BOOK_SNAPSHOT, BOOK_DIFF, BAR,
+}
+
 FieldCount = 'FieldCount'
 Done       = 'Done'
 
@@ -52,12 +76,14 @@ def fixed(n):
     def parser(msgid, msgversion):
         fields = yield FieldCount, n
         yield Done, (msgid, msgversion) + fields
+    parser.fieldcount = n
     return parser
 
 def empty():
     def parser(msgid, msgversion):
         yield FieldCount, 0
         yield Done, (msgid, msgversion)
+    parser.fieldcount = 0
     return parser
 
 def scannerdata(msgid, msgversion):
@@ -179,6 +205,166 @@ MESSAGE_PARSERS = {
     COMMISSION_REPORT:        fixed(6),
 }
 
+# Field names and types of the messages broadcast natively
+# packed in the typed binary encoding, following the message id
+# and version: 'i' 32 and 'q' 64 bit integers and 'd' doubles.
+MESSAGE_SCHEMAS = {
+    TICK_PRICE:              (('tickerId', 'i'), ('tickType', 'i'), ('price', 'd'),
+                              ('size', 'q'), ('canAutoExecute', 'i')),
+    TICK_SIZE:               (('tickerId', 'i'), ('tickType', 'i'), ('size', 'q')),
+    TICK_GENERIC:            (('tickerId', 'i'), ('tickType', 'i'), ('value', 'd')),
+    TICK_OPTION_COMPUTATION: (('tickerId', 'i'), ('tickType', 'i'), ('impliedVol', 'd'),
+                              ('delta', 'd'), ('optPrice', 'd'), ('pvDividend', 'd'),
+                              ('gamma', 'd'), ('vega', 'd'), ('theta', 'd'), ('undPrice', 'd')),
+    MARKET_DEPTH:            (('tickerId', 'i'), ('position', 'i'), ('operation', 'i'),
+                              ('side', 'i'), ('price', 'd'), ('size', 'q')),
+    REAL_TIME_BARS:          (('reqId', 'i'), ('time', 'q'), ('open', 'd'), ('high', 'd'),
+                              ('low', 'd'), ('close', 'd'), ('volume', 'q'), ('wap', 'd'),
+                              ('count', 'i')),
+    BAR:                     (('tickerId', 'i'), ('interval', 'i'), ('time', 'q'), ('open', 'd'),
+                              ('high', 'd'), ('low', 'd'), ('close', 'd'), ('volume', 'q'),
+                              ('count', 'i')),
+}
+
+def count(field):
+    return int(field) if field else 0
+
+def group(n, extra=None):
+    """
+    Decoding step consuming n fields followed by
+    extra(fields) further fields.
+
+    """
+    def step(fields, pos, available):
+        end = pos + n
+        if end > available:
+            return None
+        if extra:
+            end += extra(fields[pos:end])
+            if end > available:
+                return None
+        return end
+    return step
+
+def when(n, predicate, *steps):
+    """
+    Decoding step consuming n fields followed by steps
+    if predicate(fields) holds.
+
+    """
+    def step(fields, pos, available):
+        end = pos + n
+        if end > available:
+            return None
+        if predicate(fields[pos:end]):
+            for substep in steps:
+                end = substep(fields, end, available)
+                if end is None:
+                    return None
+        return end
+    return step
+
+class Decoder(object):
+    """
+    Reusable decoder for a variable length message,
+    equivalent to one of the parsing generators but
+    operating directly on a flat list of fields.
+
+    """
+    def __init__(self, *steps, **kwargs):
+        self.steps = steps
+        self.version = kwargs.get('version')
+
+    def end(self, fields, start, available, msgversion):
+        """
+        Returns the index following the last field of the
+        message body starting at fields[start], or None if
+        fewer than available fields hold the complete body.
+
+        """
+        if self.version is not None:
+            assert msgversion == self.version, 'Only tested with version {0} of this message.'.format(self.version)
+
+        pos = start
+        for step in self.steps:
+            pos = step(fields, pos, available)
+            if pos is None:
+                return None
+        return pos
+
+# Field counts of fixed length messages.
+MESSAGE_FIELD_COUNTS = dict((msgid, parser.fieldcount)
+                            for msgid, parser in MESSAGE_PARSERS.items()
+                            if hasattr(parser, 'fieldcount'))
+
+# Decoders of variable length messages.
+MESSAGE_DECODERS = {
+    OPEN_ORDER: Decoder(
+        group(58),
+        group(2, lambda g: 4 if g[0] else 0),
+        group(6),
+        group(2, lambda g: 8*count(g[1])),
+        group(1, lambda g: count(g[0])),
+        group(1, lambda g: 2*count(g[0])),
+        group(3, lambda g: 7 if g[2] not in ('', '0.0', IB_MAX_DOUBLE) else 0),
+        group(1, lambda g: 1 if g[0] else 0),
+        group(4),
+        group(1, lambda g: 3 if count(g[0]) else 0),
+        when(1, lambda g: g[0],
+             group(1, lambda g: 2*int(g[0]) if g[0] else 0)),
+        group(10),
+        version=30),
+    CONTRACT_DATA:      Decoder(group(29), group(1, lambda g: 2*count(g[0]))),
+    HISTORICAL_DATA:    Decoder(group(4, lambda g: 9*count(g[3]))),
+    BOND_CONTRACT_DATA: Decoder(group(30, lambda g: 2*count(g[29]))),
+    SCANNER_DATA:       Decoder(group(2, lambda g: 16*count(g[1]))),
+}
+
+def decode(fields, offset=0, available=None):
+    """
+    Decodes the message starting at fields[offset] using the
+    table driven decoders. Returns a (message, end) tuple, where
+    end is the index following the message, or None if the
+    message is incomplete. Raises KeyError for unknown message ids.
+
+    """
+    if available is None:
+        available = len(fields)
+    if available - offset < 2:
+        return None
+
+    msgid, msgversion = int(fields[offset]), int(fields[offset+1])
+    start = offset + 2
+    if msgid in MESSAGE_FIELD_COUNTS:
+        end = start + MESSAGE_FIELD_COUNTS[msgid]
+        if end > available:
+            return None
+    else:
+        end = MESSAGE_DECODERS[msgid].end(fields, start, available, msgversion)
+        if end is None:
+            return None
+    return (msgid, msgversion) + tuple(fields[start:end]), end
+
+def parse(fields):
+    """
+    Parses a single complete message with its reference
+    parsing generator from MESSAGE_PARSERS.
+
+    """
+    msgid, msgversion = int(fields[0]), int(fields[1])
+    generator = MESSAGE_PARSERS[msgid](msgid, msgversion)
+    pos = 2
+    action, value = next(generator)
+    while action == FieldCount:
+        requested = tuple(fields[pos:pos+value])
+        assert len(requested) == value, 'Message is incomplete.'
+        pos += value
+        action, value = generator.send(requested)
+    generator.close()
+
+    assert pos == len(fields), 'Message has trailing fields.'
+    return value
+
 MESSAGE_NAMES = {
     TICK_PRICE:               "TickPrice",
     TICK_SIZE:                "TickSize",
@@ -215,4 +401,9 @@ MESSAGE_NAMES = {
     TICK_SNAPSHOT_END:        "TickSnapshotEnd",
     MARKET_DATA_TYPE:         "MarketDataType",
     COMMISSION_REPORT:        "CommissionReport",
+    BOOK_SNAPSHOT:            "BookSnapshot",
+    BOOK_DIFF:                "BookDiff",
+    CONNECTION_STATUS:        "ConnectionStatus",
+    PROXY_METRICS:            "ProxyMetrics",
+    BAR:                      "Bar",
 }
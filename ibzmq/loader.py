@@ -0,0 +1,240 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Bulk loads the messages of one type from a message log, a
+sqlite database or a capture directory, into NumPy structured
+arrays for analysis. Messages are decoded a chunk at a time
+with whole array conversions rather than field by field.
+
+Only message types with a schema in MESSAGE_SCHEMAS can be
+loaded. Arrays have the log time in seconds since the epoch,
+as logged, and the message version followed by the schema's
+fields.
+
+load_chunks yields arrays of at most chunk_size messages, so
+memory is bounded whatever the size of the log, and
+write_columns streams them into a directory of one raw file per
+column, which read_columns maps back without reading it.
+
+"""
+
+import os
+import json
+import sqlite3
+
+from incoming import MESSAGE_SCHEMAS, MESSAGES_WITH_ID, FIELD_DELIMITER
+from binary import NUMPY_TYPES
+from msglog import timestamp
+from capture import CaptureReader
+
+import logging
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 100000
+
+COLUMNS_METADATA = 'columns.json'
+
+def dtype(msgid):
+    """
+    Returns the NumPy dtype of loaded messages of type msgid.
+
+    """
+    import numpy
+    if msgid not in MESSAGE_SCHEMAS:
+        raise ValueError('Messages of type {0} have no schema to load them with.'.format(msgid))
+    fields = [('logged', '<f8'), ('version', '<u2')]
+    fields += [(name, NUMPY_TYPES[type]) for name, type in MESSAGE_SCHEMAS[msgid]]
+    return numpy.dtype(fields)
+
+def decode(contents, times, msgid):
+    """
+    Decodes the text encoded messages contents of type msgid,
+    logged at times, into a structured array. Messages that do
+    not have the schema's number of fields, such as those of
+    older versions, are left out. Empty integer fields decode
+    as 0 and empty doubles as NaN.
+
+    """
+    import numpy
+    schema = MESSAGE_SCHEMAS[msgid]
+    width = len(schema) + 2
+
+    matching = [content.count(FIELD_DELIMITER) == width for content in contents]
+    if not all(matching):
+        contents = [content for content, match in zip(contents, matching) if match]
+        times = numpy.asarray(times)[numpy.array(matching, dtype=bool)]
+
+    array = numpy.empty(len(contents), dtype=dtype(msgid))
+    if not contents:
+        return array
+
+    # Every message ends with a delimiter, so splitting them
+    # joined leaves one empty field after the last.
+    fields = ''.join(contents).split(FIELD_DELIMITER)
+    fields.pop()
+
+    array['logged'] = times
+    array['version'] = _parse(fields[1::width], numpy.uint16, '0')
+    for column, (name, type) in enumerate(schema, 2):
+        if type == 'd':
+            array[name] = _parse(fields[column::width], numpy.float64, 'nan')
+        else:
+            array[name] = _parse(fields[column::width], NUMPY_TYPES[type], '0')
+    return array
+
+def _parse(values, type, empty):
+    """
+    Parses a column of numbers given as strings in one call to
+    NumPy's C parser, with empty strings read as empty.
+
+    """
+    import numpy
+    if '' in values:
+        values = [value or empty for value in values]
+    array = numpy.fromstring(' '.join(values), dtype=type, sep=' ')
+    if len(array) != len(values):
+        raise ValueError('Malformed field in column of {0} values.'.format(len(values)))
+    return array
+
+def index_messages(db):
+    """
+    Indexes a sqlite message log by type and time, so loading
+    a time range of one type does not scan the whole log.
+
+    """
+    db.execute('CREATE INDEX IF NOT EXISTS messages_type_time ON messages (type, time)')
+    db.commit()
+
+def _sqlite_chunks(database, msgid, start, end, chunk_size):
+    query = 'SELECT CAST(strftime("%s", time) AS INTEGER), content FROM messages WHERE type=?'
+    params = [msgid]
+    if start is not None:
+        query += ' AND time>=?'
+        params.append(timestamp(start))
+    if end is not None:
+        query += ' AND time<?'
+        params.append(timestamp(end))
+    query += ' ORDER BY time, id'
+
+    db = sqlite3.connect(database)
+    try:
+        cursor = db.execute(query, params)
+        while 1:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [t for t, _ in rows], [str(content) for _, content in rows]
+    finally:
+        db.close()
+
+def _capture_chunks(directory, msgid, start, end, ids, chunk_size):
+    reader = CaptureReader(directory)
+    try:
+        for segment in reader.segments:
+            if not segment.count:
+                continue
+            entries = segment.entries()
+            positions = segment.positions(int(start * 1e9) if start is not None else None,
+                                          int(end * 1e9) if end is not None else None,
+                                          [msgid], ids)
+
+            for i in xrange(0, len(positions), chunk_size):
+                chunk = positions[i:i+chunk_size]
+                yield entries['time'][chunk] / 1e9, segment.contents(chunk)
+    finally:
+        reader.close()
+
+def load_chunks(source, msgid, start=None, end=None, ids=None, chunk_size=CHUNK_SIZE):
+    """
+    Yields structured arrays of at most chunk_size messages of
+    type msgid from the message log source, logged in [start,
+    end) in seconds since the epoch and, if given, with one of
+    the ticker or request ids in ids. sqlite logs have times to
+    the second.
+
+    """
+    import numpy
+    dtype(msgid)
+    if ids is not None:
+        if msgid not in MESSAGES_WITH_ID:
+            raise ValueError('Messages of type {0} have no id to select them by.'.format(msgid))
+        ids = numpy.array(sorted(set(int(id) for id in ids)), dtype=numpy.int64)
+
+    capture = os.path.isdir(source)
+    if capture:
+        chunks = _capture_chunks(source, msgid, start, end, ids, chunk_size)
+    elif os.path.exists(source):
+        chunks = _sqlite_chunks(source, msgid, start, end, chunk_size)
+    else:
+        raise IOError('Message log {0} not found.'.format(source))
+
+    skipped = 0
+    for times, contents in chunks:
+        array = decode(contents, times, msgid)
+        skipped += len(contents) - len(array)
+        # Ids are selected by the capture index, but have to be
+        # decoded from sqlite logs.
+        if ids is not None and not capture:
+            array = array[numpy.in1d(array[MESSAGE_SCHEMAS[msgid][0][0]], ids)]
+        if len(array):
+            yield array
+
+    if skipped:
+        log.warning('Skipped {0} messages of type {1} not matching its schema.'.format(skipped, msgid))
+
+def load(source, msgid, start=None, end=None, ids=None, chunk_size=CHUNK_SIZE):
+    """
+    Returns the messages selected as by load_chunks as one
+    structured array.
+
+    """
+    import numpy
+    chunks = list(load_chunks(source, msgid, start, end, ids, chunk_size))
+    if not chunks:
+        return numpy.empty(0, dtype=dtype(msgid))
+    return numpy.concatenate(chunks)
+
+def write_columns(chunks, directory):
+    """
+    Appends each column of the structured arrays chunks to a
+    raw little endian file of its own in directory, and writes
+    their names and types to columns.json. Returns the number
+    of rows written.
+
+    """
+    os.makedirs(directory)
+    files, columns, count = None, None, 0
+    try:
+        for chunk in chunks:
+            if files is None:
+                columns = [(name, chunk.dtype[name].str) for name in chunk.dtype.names]
+                files = [open(os.path.join(directory, name), 'wb') for name, _ in columns]
+            for f, (name, _) in zip(files, columns):
+                chunk[name].tofile(f)
+            count += len(chunk)
+    finally:
+        for f in files or ():
+            f.close()
+
+    with open(os.path.join(directory, COLUMNS_METADATA), 'w') as f:
+        json.dump({'count': count, 'columns': columns or []}, f)
+    return count
+
+def read_columns(directory):
+    """
+    Returns a dict of the columns written by write_columns,
+    each memory mapped read only.
+
+    """
+    import numpy
+    with open(os.path.join(directory, COLUMNS_METADATA)) as f:
+        metadata = json.load(f)
+    if not metadata['count']:
+        return dict((str(name), numpy.empty(0, dtype=type)) for name, type in metadata['columns'])
+    return dict((str(name), numpy.memmap(os.path.join(directory, name), dtype=type, mode='r',
+                                         shape=(metadata['count'],)))
+                for name, type in metadata['columns'])
@@ -0,0 +1,60 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Logs rate limited summaries of the messages parsed, in place of
+a log line per message.
+
+"""
+
+from collections import Counter
+
+from incoming import MESSAGE_NAMES
+
+import logging
+log = logging.getLogger(__name__)
+
+class MessageSummary(object):
+    """
+    Counts the messages parsed by type and logs the counts at
+    INFO at most once every interval seconds, as key=value pairs
+    led by the total and rate, for example:
+
+    parsed=5120 interval=10.0s rate=512/s TickPrice=3072 TickSize=2048
+
+    Nothing is logged while no messages arrive.
+
+    """
+    def __init__(self, interval=10, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self._interval = interval
+        self._clock = clock
+        self._counts = Counter()
+        self._started = None
+        self._call = None
+
+    def add(self, msgid):
+        self._counts[msgid] += 1
+        if self._call is None:
+            self._started = self._clock.seconds()
+            self._call = self._clock.callLater(self._interval, self.flush)
+
+    def flush(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+        counts, self._counts = self._counts, Counter()
+        if not counts:
+            return
+        total = sum(counts.values())
+        elapsed = self._clock.seconds() - self._started
+        log.info('parsed=%d interval=%.1fs rate=%.0f/s %s', total, elapsed,
+                 total / elapsed if elapsed else 0.0,
+                 ' '.join('{0}={1}'.format(MESSAGE_NAMES.get(msgid, msgid), count)
+                          for msgid, count in counts.most_common()))
@@ -0,0 +1,151 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Counters and latency histograms of the proxy's hot path, cheap
+enough to keep on in production: counting is a few integer
+additions per message and only one in every sample messages
+is timed.
+
+"""
+
+import time
+
+from bisect import bisect_left
+from collections import Counter
+
+from incoming import MESSAGE_NAMES
+from stats import PERCENTILES
+
+# Upper bounds of the histogram buckets, doubling from 1us to
+# about 8s. Durations past the last bound fall in an overflow
+# bucket.
+BUCKET_BOUNDS = tuple(1e-6 * 2 ** i for i in xrange(24))
+
+class Histogram(object):
+    """
+    Counts durations in seconds into fixed, exponentially sized
+    buckets, so recording one costs a bisect and percentiles
+    are estimated to within a factor of two. Callers time only
+    the events for which sample() is True, one in every sample.
+
+    """
+    def __init__(self, sample=1, bounds=BUCKET_BOUNDS):
+        if sample < 1:
+            raise ValueError('Histogram sample interval must be at least 1.')
+
+        self.sample_every = sample
+        self._countdown = sample
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def sample(self):
+        self._countdown -= 1
+        if self._countdown:
+            return False
+        self._countdown = self.sample_every
+        return True
+
+    def add(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        Returns the upper bound of the bucket holding the p-th
+        percentile, or the maximum if it overflowed.
+
+        """
+        if not self.count:
+            return None
+        rank = int(round(p / 100.0 * (self.count - 1)))
+        seen = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            seen += count
+            if seen > rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self, percentiles=PERCENTILES):
+        summary = {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max if self.count else None,
+            'sample': self.sample_every,
+        }
+        for p in percentiles:
+            summary['p{0:g}'.format(p)] = self.percentile(p)
+        return summary
+
+class Metrics(object):
+    """
+    The proxy's counters, kept as plain attributes the protocol
+    and command connection add to directly, and histograms of:
+
+    parse   - time from the arrival of a message's first field
+              to its decoding completing
+    publish - time to send a message on the broadcast socket
+    reply   - time from receiving a request on the command
+              socket to acknowledging it, including any time
+              queued for pacing
+
+    Parse and publish times are sampled once every sample
+    messages; every request is timed.
+
+    """
+    def __init__(self, sample=100, timer=time.time):
+        self.timer = timer
+        self._requests = {}
+        self.started = timer()
+
+        self.bytes_received = 0
+        self.fields_received = 0
+        self.messages = Counter()
+        self.unknown = Counter()
+        self.published = 0
+        self.requests = 0
+
+        self.parse = Histogram(sample)
+        self.publish = Histogram(sample)
+        self.reply = Histogram()
+
+    def request_received(self, messageid):
+        self.requests += 1
+        self._requests[messageid] = self.timer()
+
+    def request_replied(self, messageid):
+        received = self._requests.pop(messageid, None)
+        if received is not None:
+            self.reply.add(self.timer() - received)
+
+    def report(self, **gauges):
+        """
+        Returns the counters, histogram summaries and any gauges
+        given as a dict ready for JSON encoding.
+
+        """
+        report = {
+            'uptime': self.timer() - self.started,
+            'bytes_received': self.bytes_received,
+            'fields_received': self.fields_received,
+            'messages': dict((MESSAGE_NAMES.get(msgid, str(msgid)), count)
+                             for msgid, count in self.messages.iteritems()),
+            'unknown': dict((str(msgid), count) for msgid, count in self.unknown.iteritems()),
+            'published': self.published,
+            'requests': self.requests,
+            'requests_pending': len(self._requests),
+            'parse': self.parse.summary(),
+            'publish': self.publish.summary(),
+            'reply': self.reply.summary(),
+        }
+        report.update(gauges)
+        return report
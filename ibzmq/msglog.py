@@ -0,0 +1,171 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+The sqlite message log written by bin/msglog.py.
+
+"""
+
+import time
+import sqlite3
+import calendar
+import threading
+
+from Queue import Queue, Empty, Full
+
+import logging
+log = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+SYNCHRONOUS_MODES = { 'OFF', 'NORMAL', 'FULL' }
+
+def create_schema(db):
+    if not db.execute('SELECT * FROM sqlite_master WHERE name="messages"').fetchall():
+        log.info('messages table not found: creating.')
+        db.execute('CREATE TABLE messages (id INTEGER PRIMARY KEY, time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, type INTEGER, content BLOB)')
+        db.commit()
+
+def insert_message(db, type, content):
+    db.execute('INSERT INTO messages (type, content) VALUES (?,?)', (type, sqlite3.Binary(content)))
+    db.commit()
+
+def insert_messages(db, messages):
+    """
+    Inserts (time, type, content) tuples in a single
+    transaction, where time is in seconds since the epoch.
+
+    """
+    db.executemany('INSERT INTO messages (time, type, content) VALUES (?,?,?)',
+                   ((timestamp(t), type, sqlite3.Binary(content)) for t, type, content in messages))
+    db.commit()
+
+def read_messages(db):
+    """
+    Yields the (time, type, content) tuples of all logged
+    messages in insertion order, where time is in seconds
+    since the epoch.
+
+    """
+    for t, type, content in db.execute('SELECT time, type, content FROM messages ORDER BY id'):
+        yield parse_timestamp(t), type, str(content)
+
+def timestamp(t):
+    """
+    Formats t, in seconds since the epoch, like sqlite's
+    CURRENT_TIMESTAMP.
+
+    """
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(t))
+
+def parse_timestamp(s):
+    return calendar.timegm(time.strptime(s, TIMESTAMP_FORMAT))
+
+def connect(database, wal=False, synchronous=None):
+    db = sqlite3.connect(database)
+    if wal:
+        db.execute('PRAGMA journal_mode=WAL')
+    if synchronous is not None:
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError('Unknown sqlite synchronous mode {0}.'.format(synchronous))
+        db.execute('PRAGMA synchronous={0}'.format(synchronous))
+    create_schema(db)
+    return db
+
+_STOP = object()
+
+class BatchWriter(threading.Thread):
+    """
+    Writes messages to a sqlite message log from a background
+    thread, committing a batch every batch_size messages or
+    batch_interval seconds, whichever comes first.
+
+    Messages are handed over through a queue bounded at
+    queue_size messages. write() never blocks: while the queue
+    is full messages are dropped and counted in dropped.
+
+    """
+    def __init__(self, database, batch_size=1000, batch_interval=0.25,
+                 queue_size=100000, wal=False, synchronous=None):
+        super(BatchWriter, self).__init__(name='BatchWriter')
+        self.daemon = True
+
+        self._database = database
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval
+        self._wal = wal
+        self._synchronous = synchronous
+        self._queue = Queue(queue_size)
+        self._error = None
+        self._dropping = False
+
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+
+    def write(self, type, content, t=None):
+        if not self.is_alive():
+            raise RuntimeError('BatchWriter is not running.', self._error)
+        try:
+            self._queue.put_nowait((time.time() if t is None else t, type, content))
+        except Full:
+            if not self._dropping:
+                self._dropping = True
+                log.warning('Message log queue full: dropping messages.')
+            self.dropped += 1
+            return
+        if self._dropping:
+            self._dropping = False
+            log.info('Message log caught up. Dropped so far: {0}'.format(self.dropped))
+
+    def close(self):
+        """
+        Writes all pending messages and waits for the
+        writer thread to finish.
+
+        """
+        if self.is_alive():
+            self._queue.put(_STOP)
+            self.join()
+
+    def run(self):
+        try:
+            self._run(connect(self._database, self._wal, self._synchronous))
+        except Exception as e:
+            log.exception('BatchWriter failed.')
+            self._error = e
+
+    def _run(self, db):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            try:
+                message = self._queue.get(timeout=timeout)
+            except Empty:
+                message = None
+
+            if message is _STOP:
+                break
+
+            if message is not None:
+                batch.append(message)
+                if deadline is None:
+                    deadline = time.time() + self._batch_interval
+
+            if len(batch) >= self._batch_size or (batch and time.time() >= deadline):
+                self._commit(db, batch)
+                batch, deadline = [], None
+
+        if batch:
+            self._commit(db, batch)
+        db.close()
+
+    def _commit(self, db, batch):
+        insert_messages(db, batch)
+        self.written += len(batch)
+        self.batches += 1
@@ -0,0 +1,253 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Shares market data, market depth and real time bar subscriptions
+between clients so each contract uses a single IB market data
+line however many clients subscribe to it.
+
+"""
+
+from framing import join_fields
+from snapshot import SnapshotCache
+from incoming import (ID_FIELD, ERR_MSG,
+                      TICK_PRICE, TICK_SIZE, TICK_OPTION_COMPUTATION,
+                      TICK_GENERIC, TICK_STRING, TICK_EFP, TICK_SNAPSHOT_END,
+                      MARKET_DATA_TYPE, DELTA_NEUTRAL_VALIDATION,
+                      MARKET_DEPTH, MARKET_DEPTH_L2, REAL_TIME_BARS)
+from outgoing import (REQ_MKT_DATA, CANCEL_MKT_DATA,
+                      REQ_MKT_DEPTH, CANCEL_MKT_DEPTH,
+                      REQ_REAL_TIME_BARS, CANCEL_REAL_TIME_BARS)
+
+import logging
+log = logging.getLogger(__name__)
+
+# Upstream ids are allocated from here on so they do not
+# collide with the ids of requests passed through as is.
+UPSTREAM_ID_BASE = 1 << 24
+
+REQUESTS = {
+    REQ_MKT_DATA:       CANCEL_MKT_DATA,
+    REQ_MKT_DEPTH:      CANCEL_MKT_DEPTH,
+    REQ_REAL_TIME_BARS: CANCEL_REAL_TIME_BARS,
+}
+
+CANCELS = dict((cancel, request) for request, cancel in REQUESTS.items())
+
+CANCEL_VERSION = 1
+
+# Incoming messages carrying the ticker id of a subscription.
+SUBSCRIPTION_MESSAGES = {
+    TICK_PRICE, TICK_SIZE, TICK_OPTION_COMPUTATION, TICK_GENERIC,
+    TICK_STRING, TICK_EFP, TICK_SNAPSHOT_END, MARKET_DATA_TYPE,
+    DELTA_NEUTRAL_VALIDATION, MARKET_DEPTH, MARKET_DEPTH_L2,
+    REAL_TIME_BARS, ERR_MSG,
+}
+
+def with_id(fields, id):
+    return fields[:ID_FIELD] + type(fields)([id]) + fields[ID_FIELD+1:]
+
+def is_snapshot(fields):
+    return int(fields[0]) == REQ_MKT_DATA and fields[-1] == '1'
+
+class Subscription(object):
+    def __init__(self, upstream, key, request):
+        self.upstream = upstream
+        self.key = key
+        self.request = request
+        self.subscribers = []
+        # Sent to clients joining once the subscription is
+        # established, which TWS would otherwise not tell.
+        self.last = SnapshotCache()
+
+class SubscriptionMultiplexer(object):
+    """
+    Rewrites subscription requests and cancels from clients into
+    at most one upstream subscription per (request type, contract
+    and parameters), and fans incoming messages of an upstream
+    subscription out to its subscribers under their own ids.
+
+    Snapshot market data requests are passed through unchanged.
+
+    Messages are published under the subscribers' ticker ids,
+    so clients may share an id only for the same subscription;
+    a request reusing another client's id for a different one
+    is refused with a ValueError.
+
+    With a timeout, the subscriptions of clients not heard from
+    for that many seconds are released by expire().
+
+    """
+    def __init__(self, first_id=UPSTREAM_ID_BASE, timeout=None, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self._next_id = first_id
+        self._timeout = timeout
+        self._clock = clock
+        self._by_key = {}
+        self._by_upstream = {}
+        self._by_subscriber = {}
+        self._by_id = {}
+        self._seen = {}
+
+    def outgoing(self, client, msg):
+        """
+        Returns the list of messages to write to TWS in place of
+        client's msg, empty if nothing needs to be written.
+
+        """
+        self.seen(client)
+        fields = msg.split('\0')[:-1]
+        msgid = int(fields[0])
+        if msgid in CANCELS:
+            return self._unsubscribe(client, CANCELS[msgid], fields[ID_FIELD])
+        elif msgid in REQUESTS and not is_snapshot(fields):
+            return self._subscribe(client, msgid, fields)
+        return [msg]
+
+    def replay(self, client, msg):
+        """
+        Returns the last market data of the upstream subscription
+        client's request msg joined, under the client's ticker id,
+        empty if msg is not a subscription or nothing was received.
+
+        """
+        fields = msg.split('\0')[:-1]
+        msgid = int(fields[0])
+        if msgid not in REQUESTS or is_snapshot(fields):
+            return []
+        id = fields[ID_FIELD]
+        subscription = self._by_subscriber.get((client, msgid, id))
+        if subscription is None:
+            return []
+        return [with_id(message, id) for message in subscription.last.messages()]
+
+    def _subscribe(self, client, msgid, fields):
+        id = fields[ID_FIELD]
+        key = (msgid,) + tuple(fields[ID_FIELD+1:])
+
+        current = self._by_id.get((msgid, id))
+        if current is not None and current.key != key and \
+           any(c != client for c, i in current.subscribers if i == id):
+            raise ValueError('Ticker id {0} is subscribed to by another client.'.format(id))
+
+        # A client reusing a ticker id replaces its subscription.
+        cancel = self._unsubscribe(client, msgid, id)
+
+        subscription = self._by_key.get(key)
+        request = []
+        if subscription is None:
+            upstream = self._next_id
+            self._next_id += 1
+            request = [join_fields(with_id(fields, upstream))]
+            subscription = Subscription(upstream, key, request[0])
+            self._by_key[key] = subscription
+            self._by_upstream[upstream] = subscription
+            log.info('Subscribing upstream {0} for client ticker id {1}.'.format(upstream, id))
+        else:
+            log.info('Sharing upstream {0} with client ticker id {1}.'.format(subscription.upstream, id))
+
+        subscription.subscribers.append((client, id))
+        self._by_subscriber[(client, msgid, id)] = subscription
+        self._by_id[(msgid, id)] = subscription
+        return cancel + request
+
+    def _unsubscribe(self, client, msgid, id):
+        subscription = self._by_subscriber.pop((client, msgid, id), None)
+        if subscription is None:
+            return []
+
+        subscription.subscribers.remove((client, id))
+        if not any(i == id for _, i in subscription.subscribers):
+            del self._by_id[(msgid, id)]
+        if subscription.subscribers:
+            return []
+
+        log.info('Cancelling upstream {0}.'.format(subscription.upstream))
+        del self._by_key[subscription.key]
+        del self._by_upstream[subscription.upstream]
+        return [join_fields([REQUESTS[msgid], CANCEL_VERSION, subscription.upstream])]
+
+    def seen(self, client):
+        """
+        Notes a request from client, keeping its subscriptions
+        from expiring.
+
+        """
+        if self._timeout:
+            self._seen[client] = self._clock.seconds()
+
+    def release(self, client):
+        """
+        Releases every subscription of client, returning the
+        cancels to write to TWS for those no one else shares.
+
+        """
+        self._seen.pop(client, None)
+        keys = [key for key in self._by_subscriber if key[0] == client]
+        if keys:
+            log.info('Releasing {0} subscriptions of client {1!r}.'.format(len(keys), client))
+        cancels = []
+        for _, msgid, id in keys:
+            cancels += self._unsubscribe(client, msgid, id)
+        return cancels
+
+    def expire(self):
+        """
+        Releases the subscriptions of the clients not heard
+        from within the timeout, returning the cancels to write.
+
+        """
+        if not self._timeout:
+            return []
+        cutoff = self._clock.seconds() - self._timeout
+        cancels = []
+        for client in [client for client, seen in self._seen.iteritems() if seen < cutoff]:
+            log.warning('Client {0!r} not heard from in {1} seconds.'.format(client, self._timeout))
+            cancels += self.release(client)
+        return cancels
+
+    def incoming(self, message):
+        """
+        Returns the messages to publish for an incoming message,
+        one per subscriber for messages of shared subscriptions.
+
+        """
+        if int(message[0]) in SUBSCRIPTION_MESSAGES:
+            try:
+                subscription = self._by_upstream.get(int(message[ID_FIELD]))
+            except ValueError:
+                subscription = None
+            if subscription is not None:
+                subscription.last.update(message)
+                return [with_id(message, id) for _, id in subscription.subscribers]
+        return [message]
+
+    def subscriptions(self):
+        """
+        Returns the upstream subscription requests currently
+        active, keyed by upstream id.
+
+        """
+        return dict((s.upstream, s.request) for s in self._by_upstream.itervalues())
+
+    def clear_last(self):
+        """
+        Forgets the last market data of every subscription,
+        stale once the connection to TWS is lost.
+
+        """
+        for subscription in self._by_upstream.itervalues():
+            subscription.last.clear()
+
+    @property
+    def upstream_count(self):
+        return len(self._by_upstream)
+
+    @property
+    def subscriber_count(self):
+        return len(self._by_subscriber)
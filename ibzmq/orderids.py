@@ -0,0 +1,70 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Hands out order ids from the proxy so clients placing orders do
+not each have to ask TWS for the next valid id, and cannot be
+given the same one.
+
+"""
+
+from incoming import ID_FIELD, NEXT_VALID_ID
+from outgoing import PLACE_ORDER
+
+import logging
+log = logging.getLogger(__name__)
+
+# Largest block of ids handed out at once.
+MAX_BLOCK = 10000
+
+class OrderIdAllocator(object):
+    """
+    Tracks the next valid order id, from the NEXT_VALID_ID
+    messages TWS sends on connection and in reply to REQ_IDS and
+    from the orders placed through the proxy, and allocates
+    blocks of ids after it.
+
+    A single sequence serves every connection of a pool: each
+    client id only requires its order ids to increase.
+
+    """
+    def __init__(self):
+        self.next_id = None
+        self.allocated = 0
+
+    def received(self, message):
+        if message[0] == NEXT_VALID_ID:
+            self.advance(int(message[ID_FIELD]))
+
+    def placed(self, msg):
+        """
+        Advances past the id of an order placed by a client,
+        whether or not it was allocated by the proxy.
+
+        """
+        fields = msg.split('\0', ID_FIELD + 1)
+        if int(fields[0]) == PLACE_ORDER:
+            self.advance(int(fields[ID_FIELD]) + 1)
+
+    def advance(self, next_id):
+        if self.next_id is None or next_id > self.next_id:
+            self.next_id = next_id
+
+    def allocate(self, count=1):
+        """
+        Returns the first of count consecutive order ids not
+        handed out before.
+
+        """
+        if self.next_id is None:
+            raise ValueError('No valid order id received from TWS yet.')
+        if not 0 < count <= MAX_BLOCK:
+            raise ValueError('Cannot allocate a block of {0} order ids.'.format(count))
+
+        first = self.next_id
+        self.next_id += count
+        self.allocated += count
+        return first
@@ -0,0 +1,206 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Paces requests written to TWS so bursts from many clients stay
+within IB's message rate and historical data pacing limits.
+
+"""
+
+from collections import deque
+
+from outgoing import (PLACE_ORDER, CANCEL_ORDER, REQ_GLOBAL_CANCEL, EXERCISE_OPTIONS,
+                      CANCEL_MKT_DATA, CANCEL_MKT_DEPTH, CANCEL_NEWS_BULLETINS,
+                      CANCEL_SCANNER_SUBSCRIPTION, CANCEL_HISTORICAL_DATA,
+                      CANCEL_REAL_TIME_BARS, CANCEL_FUNDAMENTAL_DATA,
+                      CANCEL_CALC_IMPLIED_VOLAT, CANCEL_CALC_OPTION_PRICE,
+                      REQ_MKT_DATA, REQ_MKT_DEPTH, REQ_REAL_TIME_BARS,
+                      REQ_SCANNER_SUBSCRIPTION, REQ_HISTORICAL_DATA)
+
+# Request lanes in priority order.
+ORDERS      = 'orders'
+CANCELS     = 'cancels'
+GENERAL     = 'general'
+MARKET_DATA = 'marketdata'
+HISTORICAL  = 'historical'
+
+LANES = (ORDERS, CANCELS, GENERAL, MARKET_DATA, HISTORICAL)
+
+REQUEST_LANES = {
+    PLACE_ORDER:                 ORDERS,
+    CANCEL_ORDER:                ORDERS,
+    REQ_GLOBAL_CANCEL:           ORDERS,
+    EXERCISE_OPTIONS:            ORDERS,
+    CANCEL_MKT_DATA:             CANCELS,
+    CANCEL_MKT_DEPTH:            CANCELS,
+    CANCEL_NEWS_BULLETINS:       CANCELS,
+    CANCEL_SCANNER_SUBSCRIPTION: CANCELS,
+    CANCEL_HISTORICAL_DATA:      CANCELS,
+    CANCEL_REAL_TIME_BARS:       CANCELS,
+    CANCEL_FUNDAMENTAL_DATA:     CANCELS,
+    CANCEL_CALC_IMPLIED_VOLAT:   CANCELS,
+    CANCEL_CALC_OPTION_PRICE:    CANCELS,
+    REQ_MKT_DATA:                MARKET_DATA,
+    REQ_MKT_DEPTH:               MARKET_DATA,
+    REQ_REAL_TIME_BARS:          MARKET_DATA,
+    REQ_SCANNER_SUBSCRIPTION:    MARKET_DATA,
+    REQ_HISTORICAL_DATA:         HISTORICAL,
+}
+
+def request_id(msg):
+    """
+    Returns the leading message id of an outgoing message.
+
+    """
+    return int(msg.split('\0', 1)[0])
+
+def request_lane(msg):
+    return REQUEST_LANES.get(request_id(msg), GENERAL)
+
+class TokenBucket(object):
+    """
+    Allows burst messages at once, refilling at rate
+    messages per second.
+
+    """
+    def __init__(self, rate, burst, clock):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock.seconds()
+
+    def _refill(self):
+        now = self._clock.seconds()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self):
+        """
+        Returns the number of seconds until a token is
+        available.
+
+        """
+        self._refill()
+        # Tolerate rounding error in the refill so a token due
+        # now is never rescheduled at the same instant.
+        if self._tokens >= 1 - 1e-9:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self._tokens -= 1
+
+class LaneStats(object):
+    def __init__(self):
+        self.sent = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+class Scheduler(object):
+    """
+    Queues outgoing requests in priority lanes and sends them
+    through send(messageid, msg) as the global token bucket,
+    and the lane's own bucket if it has one, allow. Order
+    placement and cancels are sent ahead of everything else and
+    a lane waiting on its own bucket does not hold up the lanes
+    behind it.
+
+    """
+    def __init__(self, send, rate=40, burst=10, lane_limits=None, queue_size=10000, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self._send = send
+        self._clock = clock
+        self._queue_size = queue_size
+        self._global = TokenBucket(rate, burst, clock)
+        self._buckets = dict((lane, TokenBucket(lane_rate, lane_burst, clock))
+                             for lane, (lane_rate, lane_burst) in (lane_limits or {}).items())
+        self._queues = dict((lane, deque()) for lane in LANES)
+        self._call = None
+
+        self.stats = dict((lane, LaneStats()) for lane in LANES)
+        self.rejected = 0
+
+    @property
+    def depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, messageid, msg):
+        """
+        Queues msg for sending, returning False if the
+        queue is full.
+
+        """
+        if self.depth >= self._queue_size:
+            self.rejected += 1
+            return False
+
+        self._queues[request_lane(msg)].append((self._clock.seconds(), messageid, msg))
+        self._dispatch()
+        return True
+
+    def _dispatch(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+        while True:
+            waiting = [lane for lane in LANES if self._queues[lane]]
+            if not waiting:
+                return
+
+            delay = self._global.delay()
+            if delay:
+                self._schedule(delay)
+                return
+
+            delays = []
+            for lane in waiting:
+                bucket = self._buckets.get(lane)
+                lane_delay = bucket.delay() if bucket else 0
+                if not lane_delay:
+                    self._sendNext(lane)
+                    break
+                delays.append(lane_delay)
+            else:
+                self._schedule(min(delays))
+                return
+
+    def _sendNext(self, lane):
+        queued, messageid, msg = self._queues[lane].popleft()
+        self._global.take()
+        if lane in self._buckets:
+            self._buckets[lane].take()
+
+        wait = self._clock.seconds() - queued
+        stats = self.stats[lane]
+        stats.sent += 1
+        stats.wait_total += wait
+        stats.wait_max = max(stats.wait_max, wait)
+
+        self._send(messageid, msg)
+
+    def _schedule(self, delay):
+        self._call = self._clock.callLater(delay, self._dispatch)
+
+    def report(self):
+        """
+        Returns the queue depth and wait times of each lane.
+
+        """
+        report = {'rejected': self.rejected}
+        for lane in LANES:
+            stats = self.stats[lane]
+            report[lane] = {
+                'depth': len(self._queues[lane]),
+                'sent': stats.sent,
+                'wait_mean': stats.wait_total / stats.sent if stats.sent else 0.0,
+                'wait_max': stats.wait_max,
+            }
+        return report
@@ -0,0 +1,226 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Routes requests over a pool of TWS connections, each with its
+own client id and pacing budget, by request lane, for example
+orders on a dedicated connection and market data and historical
+requests spread over the others.
+
+"""
+
+from incoming import ID_FIELD, HISTORICAL_DATA, ORDER_STATUS
+from outgoing import (PLACE_ORDER, CANCEL_ORDER,
+                      REQ_MKT_DATA, CANCEL_MKT_DATA,
+                      REQ_MKT_DEPTH, CANCEL_MKT_DEPTH,
+                      REQ_HISTORICAL_DATA, CANCEL_HISTORICAL_DATA,
+                      REQ_REAL_TIME_BARS, CANCEL_REAL_TIME_BARS,
+                      REQ_SCANNER_SUBSCRIPTION, CANCEL_SCANNER_SUBSCRIPTION,
+                      REQ_FUNDAMENTAL_DATA, CANCEL_FUNDAMENTAL_DATA,
+                      REQ_CALC_IMPLIED_VOLAT, CANCEL_CALC_IMPLIED_VOLAT,
+                      REQ_CALC_OPTION_PRICE, CANCEL_CALC_OPTION_PRICE)
+from pacing import LANES, request_lane
+from session import Session, SUBSCRIPTIONS
+
+import logging
+log = logging.getLogger(__name__)
+
+# Requests whose id later requests refer to, by the id of the
+# cancel ending them. Both must go over the same connection.
+STICKY = {
+    PLACE_ORDER:                 CANCEL_ORDER,
+    REQ_MKT_DATA:                CANCEL_MKT_DATA,
+    REQ_MKT_DEPTH:               CANCEL_MKT_DEPTH,
+    REQ_HISTORICAL_DATA:         CANCEL_HISTORICAL_DATA,
+    REQ_REAL_TIME_BARS:          CANCEL_REAL_TIME_BARS,
+    REQ_SCANNER_SUBSCRIPTION:    CANCEL_SCANNER_SUBSCRIPTION,
+    REQ_FUNDAMENTAL_DATA:        CANCEL_FUNDAMENTAL_DATA,
+    REQ_CALC_IMPLIED_VOLAT:      CANCEL_CALC_IMPLIED_VOLAT,
+    REQ_CALC_OPTION_PRICE:       CANCEL_CALC_OPTION_PRICE,
+}
+
+STICKY_CANCELS = dict((cancel, request) for request, cancel in STICKY.items())
+
+# Requests that outlive a reconnection: orders stay open and
+# subscriptions are restored on the same connection.
+PERSISTENT = { PLACE_ORDER } | set(SUBSCRIPTIONS)
+
+# Order statuses after which an order can no longer be
+# modified or cancelled.
+FINAL_ORDER_STATUSES = { 'Filled', 'Cancelled', 'ApiCancelled', 'Inactive' }
+
+class Connection(object):
+    """
+    A TWS connection of the pool, serving the requests of
+    lanes. The protocol is set while it is connected and the
+    session records the subscriptions made over it.
+
+    """
+    def __init__(self, name, host, port, clientid=0, lanes=LANES):
+        unknown = set(lanes) - set(LANES)
+        if unknown:
+            raise ValueError('Unknown request lanes {0} for connection {1}.'.format(', '.join(unknown), name))
+
+        self.name = name
+        self.host = host
+        self.port = port
+        self.clientid = clientid
+        self.lanes = tuple(lanes)
+        self.protocol = None
+        self.scheduler = None
+        self.session = Session()
+        self.connections = 0
+        self.routed = 0
+        self.active = 0
+
+    @property
+    def connected(self):
+        return self.protocol is not None
+
+class ConnectionPool(object):
+    """
+    Picks the connection each request is written to. Requests
+    and cancels referring to an earlier request's id go over
+    that request's connection, others over the connected
+    connection serving their lane with the fewest active
+    requests.
+
+    """
+    def __init__(self, connections):
+        if not connections:
+            raise ValueError('A connection pool needs at least one connection.')
+
+        self.connections = list(connections)
+        self._by_name = dict((c.name, c) for c in self.connections)
+        if len(self._by_name) != len(self.connections):
+            raise ValueError('Connection names must be unique.')
+        # TWS drops the earlier connection of a client id
+        # connecting twice.
+        clients = set()
+        for c in self.connections:
+            client = (c.host, c.port, c.clientid)
+            if client in clients:
+                raise ValueError('Client id {0} is used twice on {1}:{2}.'.format(c.clientid, c.host, c.port))
+            clients.add(client)
+        self._sticky = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Builds the pool of ibtws.connections, or a pool of the
+        single connection to ibtws.host and ibtws.port if no
+        connections are listed. Connections without a client id
+        take ibtws.clientid plus their position in the list.
+
+        """
+        connections = config['ibtws.connections']
+        if not connections:
+            return cls([Connection(None, config['ibtws.host'], config['ibtws.port'], config['ibtws.clientid'])])
+
+        return cls([Connection(c['name'], c.get('host', config['ibtws.host']), c.get('port', config['ibtws.port']),
+                               c.get('clientid', config['ibtws.clientid'] + i), c.get('lanes', LANES))
+                    for i, c in enumerate(connections)])
+
+    def __iter__(self):
+        return iter(self.connections)
+
+    def __len__(self):
+        return len(self.connections)
+
+    def attach(self, protocol):
+        """
+        Marks the connection named protocol.source as connected
+        through protocol, returning the connection.
+
+        """
+        connection = self._by_name[protocol.source]
+        connection.protocol = protocol
+        connection.connections += 1
+        log.info('Connection {0} attached.'.format(connection.name or 'default'))
+        return connection
+
+    def detach(self, protocol):
+        connection = self._by_name[protocol.source]
+        if connection.protocol is protocol:
+            connection.protocol = None
+            for key in [key for key, c in self._sticky.items()
+                        if c is connection and key[0] not in PERSISTENT]:
+                del self._sticky[key]
+                connection.active -= 1
+
+    def connected(self):
+        return [c for c in self.connections if c.connected]
+
+    def any_protocol(self):
+        """
+        Returns a connected connection's protocol, or None.
+
+        """
+        for connection in self.connections:
+            if connection.connected:
+                return connection.protocol
+        return None
+
+    def route(self, msg):
+        """
+        Returns the connection msg is to be written to, or None
+        if no connection able to serve it is connected.
+
+        """
+        fields = msg.split('\0', ID_FIELD + 1)
+        msgid = int(fields[0])
+        id = fields[ID_FIELD] if len(fields) > ID_FIELD else None
+
+        if msgid in STICKY_CANCELS:
+            connection = self._sticky.pop((STICKY_CANCELS[msgid], id), None)
+            if connection is not None:
+                connection.active -= 1
+        else:
+            connection = self._sticky.get((msgid, id))
+
+        if connection is None:
+            lane = request_lane(msg)
+            candidates = [c for c in self.connections if c.connected and lane in c.lanes]
+            if not candidates:
+                return None
+            connection = min(candidates, key=lambda c: c.active)
+            if msgid in STICKY:
+                self._sticky[(msgid, id)] = connection
+                connection.active += 1
+
+        connection.routed += 1
+        return connection
+
+    def completed(self, source, message):
+        """
+        Releases the connection of the request a message
+        received on connection source completes: a historical
+        data request or a filled or cancelled order.
+
+        """
+        msgid = message[0]
+        if msgid == HISTORICAL_DATA:
+            key = (REQ_HISTORICAL_DATA, str(message[ID_FIELD]))
+        elif msgid == ORDER_STATUS and message[3] in FINAL_ORDER_STATUSES:
+            key = (PLACE_ORDER, str(message[ID_FIELD]))
+        else:
+            return
+
+        connection = self._sticky.get(key)
+        if connection is not None and connection.name == source:
+            del self._sticky[key]
+            connection.active -= 1
+
+    def report(self):
+        return dict((c.name or 'default', {
+            'connected': c.connected,
+            'clientid': c.clientid,
+            'lanes': c.lanes,
+            'connections': c.connections,
+            'routed': c.routed,
+            'active': c.active,
+            'subscriptions': len(c.session),
+        }) for c in self.connections)
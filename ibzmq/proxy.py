@@ -8,79 +8,117 @@
 
 from __future__ import print_function
 
+import os
 import sys
-
-from twisted.internet.protocol import Factory
-from twisted.protocols.basic import LineOnlyReceiver
-from twisted.internet import reactor
-from twisted.internet.endpoints import TCP4ClientEndpoint
-
-from txzmq import ZmqFactory, ZmqEndpoint, ZmqREPConnection, ZmqEndpointType, ZmqPubConnection
-
-from statemachine import StateMachine, State
-from incoming import MESSAGE_PARSERS, MESSAGE_NAMES, FieldCount, Done
+import time
+
+from functools import partial
+
+from twisted.internet.protocol import ReconnectingClientFactory, Protocol
+from twisted.internet import reactor, defer
+from twisted.internet.task import LoopingCall
+from twisted.python.log import callWithLogger
+
+from txzmq import ZmqFactory, ZmqEndpoint, ZmqREPConnection, ZmqEndpointType
+from zmq import constants, ZMQError
+
+from decoder import MessageDecoder, Disconnected, Connecting, WaitingForMessageID
+from incoming import MESSAGE_NAMES, CONNECTION_STATUS
+from outgoing import CANCEL_MKT_DATA, CANCEL_MKT_DEPTH
+from framing import FieldSplitter
+from broadcast import encode
+from conflation import Conflator
+from pacing import Scheduler, HISTORICAL, MARKET_DATA
+from multiplex import SubscriptionMultiplexer
+from snapshot import SnapshotCache
+from depth import DepthEngine
+from bars import BarEngine
+from histcache import HistoricalDataCache
+from pool import ConnectionPool
+from correlation import RequestCorrelator
+from orderids import OrderIdAllocator
+from metrics import Metrics
+from logsummary import MessageSummary
+from fanout import FanoutPipe, derived_options, start_workers
+from backpressure import BroadcastConnection, RequestProducer, configure
+from commands import CommandHandler, ENCODINGS, CONNECTED, DISCONNECTED
 from config import Config
 
-from inspect import isgeneratorfunction
-
 import logging
 log = logging.getLogger(__name__)
 
-# States for TWS protocol state machine.
-Disconnected        = State('Disconnected')
-Connecting          = State('Connecting')
-WaitingForMessageID = State('WaitingForMessageID')
-WaitingForGenerator = State('WaitingForGenerator', 'generator fieldcount cumfieldcount')
-
-Connecting.fieldcount          = 2
-WaitingForMessageID.fieldcount = 2
-
-class IBTWSProtocol(StateMachine, LineOnlyReceiver):
-    delimiter = '\0'
-
-    CLIENT_VERSION = 59
-
-    states = { Disconnected,
-               Connecting,
-               WaitingForMessageID,
-               WaitingForGenerator }
-
-    transitions = {
-        Disconnected        : { Connecting },
-        Connecting          : { WaitingForMessageID },
-        WaitingForMessageID : { WaitingForGenerator },
-        WaitingForGenerator : { WaitingForGenerator, WaitingForMessageID },
-    }
-    initial_state = Disconnected()
-    
-    def __init__(self, zmq_requests, zmq_broadcast, clientid=0):
+class IBTWSProtocol(MessageDecoder, Protocol):
+    # Set by the factory, which resets its reconnection backoff
+    # once the handshake completes.
+    factory = None
+
+    def __init__(self, zmq_requests, zmq_broadcast, clientid=0, topics=False,
+                 conflation=None, multiplexer=None, snapshot=None, depth=None,
+                 depth_passthrough=True, histcache=None, source=None, pool=None, binary=False,
+                 correlator=None, orderids=None, metrics=None, summary=None, bars=None,
+                 write_buffer=None):
         super(IBTWSProtocol, self).__init__()
 
         self._clientid = clientid
-        self._field_buffer = []
+        self._binary = binary
+        self._pool = pool
+        self._topics = topics
+        self._multiplexer = multiplexer
+        self._correlator = correlator
+        self._orderids = orderids
+        self._metrics = metrics
+        self._summary = summary
+        self._chunk_time = self._message_time = None
+        self._snapshot = snapshot
+        self._conflator = Conflator(self.publishFields, conflation) if conflation is not None else None
+        self._depth = DepthEngine(self.publishFields, **depth) if depth is not None else None
+        self._depth_passthrough = depth_passthrough
+        self._bars = BarEngine(self.publishFields, **bars) if bars is not None else None
+        self._histcache = histcache
+        self._write_buffer = write_buffer
+        self._splitter = FieldSplitter(self.delimiter)
         self._zmq_requests = zmq_requests
         self._zmq_broadcast = zmq_broadcast
 
+        self.source = source
         self.serverVersion = None
         self.connectionTime = None
 
     def connectionMade(self):
+        # Stop taking requests while TWS reads them slower than
+        # they arrive, rather than buffer them without bound.
+        if self._write_buffer is not None:
+            self.transport.bufferSize = self._write_buffer
+            self.transport.registerProducer(RequestProducer(self._zmq_requests, self.source), True)
         self.writeField(self.CLIENT_VERSION)
         self.transition(Connecting())
 
-    def lineReceived(self, field):
-        self._field_buffer.append(field)
-
-        if len(self._field_buffer) == self.state.fieldcount:
-            self.fieldsReceived_dispatch(tuple(self._field_buffer))
-            self._field_buffer = []
-
-            if not self.state.fieldcount:
-                self.fieldsReceived_dispatch(())
-
-    def fieldsReceived_dispatch(self, fields):
-        state_handler = getattr(self, 'fieldsReceived_' + self.state_name)
-        state_handler(tuple(fields))
+    def connectionLost(self, reason):
+        log.error('Connection {0} to TWS lost: {1}'.format(self.source or 'default', reason.getErrorMessage()))
+        if not self.is_state(Disconnected):
+            self.transition(Disconnected())
+        if self._depth:
+            self._depth.reset()
+        if self._bars is not None:
+            self._bars.reset()
+        if self.serverVersion is not None:
+            self._zmq_requests.lostTWSProtocol(self)
+            self.publishStatus(DISCONNECTED)
+
+    def dataReceived(self, data):
+        if self._metrics is not None:
+            self._chunk_time = self._metrics.timer()
+            # A message starts in this chunk unless one is
+            # already partly received.
+            if not self._field_buffer and not self._splitter.partial:
+                self._message_time = self._chunk_time
+            self._metrics.bytes_received += len(data)
+        fields = self._splitter.split(data)
+        if self._metrics is not None:
+            self._metrics.fields_received += len(fields)
+        if self._field_buffer:
+            fields = self._field_buffer + fields
+        self.fieldsReceived(fields)
 
     #### State specific handling of field receipt ####
 
@@ -89,56 +127,119 @@ class IBTWSProtocol(StateMachine, LineOnlyReceiver):
         self.connectionTime = fields[1]
 
         log.info("Connected. Server Version: {0} Connection Time: {1}".format(self.serverVersion, self.connectionTime))
-        self._zmq_requests.setTWSProtocol(self)
+        if self.factory:
+            self.factory.resetDelay()
 
         self.transition(WaitingForMessageID())
 
         self.writeField(self._clientid)
 
-    def fieldsReceived_WaitingForMessageID(self, fields):
-        msgid, msgversion = map(int, fields)
-        msgname = MESSAGE_NAMES.get(msgid, 'Unknown')
-        log.debug('Parsing: {0}({1}) {2}'.format(msgname, msgid, msgversion))
-        parser = MESSAGE_PARSERS.get(msgid, None)
-
-        if parser:
-            generator = parser(msgid, msgversion)
-            action, fieldcount = generator.next()
-            assert action == FieldCount, 'Parsing generator must return a field count on first yield.'
-            self.transition(WaitingForGenerator(generator, fieldcount, 2))
-        else:
-            log.error('Unimplemented message ID: {0}'.format(msgid))
-
-    def fieldsReceived_WaitingForGenerator(self, fields):
-        generator = self.state.generator
-        cumfieldcount = self.state.cumfieldcount + len(fields)
-
-        action, value = generator.send(fields)
-        if action == FieldCount:
-            self.transition(WaitingForGenerator(generator, value, cumfieldcount))
-        elif action == Done:
-            generator.close()
-
-            msgid = int(value[0])
-            msgname = MESSAGE_NAMES.get(msgid, 'Unknown')
-            log.info('Message Parsed. Field Count: {0:>2}, Type: ({1:02}) {2}'.format(len(value), msgid, msgname))
-
-            assert cumfieldcount == len(value), 'The number of consumed fields shall equal the length of the resulting message.'
-            self.publishFields(value)
-            self.transition(WaitingForMessageID())
-        else:
-            raise Expection('Unrecognised parser action {0}.'.format(action))
+        # Subscriptions are restored once the client id is written.
+        restored = self._zmq_requests.setTWSProtocol(self)
+        if restored is not None:
+            self.publishStatus(CONNECTED, restored)
+
+    def messageParsed(self, message):
+        msgid = int(message[0])
+        if self._debug:
+            log.debug('Message Parsed. Field Count: %2d, Type: (%02d) %s', len(message), msgid, MESSAGE_NAMES.get(msgid, 'Unknown'))
+        if self._summary is not None:
+            self._summary.add(msgid)
+
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.messages[msgid] += 1
+            if metrics.parse.sample():
+                metrics.parse.add(metrics.timer() - self._message_time)
+            # Any message following starts in the latest chunk.
+            self._message_time = self._chunk_time
+
+        if self._histcache:
+            self._histcache.received(message)
+        if self._orderids is not None:
+            self._orderids.received(message)
+        if self._pool:
+            self._pool.completed(self.source, message)
+
+        messages = self._multiplexer.incoming(message) if self._multiplexer else (message,)
+        for message in messages:
+            if self._correlator is not None:
+                self.replyTracked(message)
+            if self._bars is not None and msgid in BarEngine.TICK_MESSAGES:
+                self._bars.add(message)
+            if self._depth and msgid in DepthEngine.DEPTH_MESSAGES:
+                self._depth.add(message)
+                if not self._depth_passthrough:
+                    continue
+            if self._conflator:
+                self._conflator.add(message)
+            else:
+                self.publishFields(message)
+
+    def subscriptionCancelled(self, msgid, id):
+        """
+        Discards the open bars or depth book of tickerId id once
+        a client cancels its market data or market depth.
+
+        """
+        if self._bars is not None and msgid == CANCEL_MKT_DATA:
+            self._bars.reset(id)
+        if self._depth and msgid == CANCEL_MKT_DEPTH:
+            self._depth.reset(int(id))
+
+    def conflationStats(self):
+        """
+        Returns the counters of the connection's conflation,
+        or None if it is not conflated.
+
+        """
+        return self._conflator.stats() if self._conflator else None
 
     #### Message writing and publishing methods ####
 
     def publishFields(self, fields):
         """
         Publishes a set of fields as an atomic message via
-        ZeroMQ.
+        ZeroMQ, as a binary record if the binary encoding is
+        enabled and the message has a schema, preceded by a topic
+        frame if topics are enabled and by the name of the source
+        connection if the proxy has a pool of named connections.
+
+        """
+        if self._debug:
+            log.debug('Publishing %r', fields)
+        if self._snapshot is not None:
+            self._snapshot.update(fields, self.source)
+        frames = encode(fields, self._topics, self.source, self._binary)
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.published += 1
+            if metrics.publish.sample():
+                start = metrics.timer()
+                self._zmq_broadcast.send(frames)
+                metrics.publish.add(metrics.timer() - start)
+                return
+        self._zmq_broadcast.send(frames)
+
+    def replyTracked(self, fields):
+        """
+        Sends a message answering a tracked request to the client
+        that made it, on the command socket.
 
         """
-        log.debug('Publishing ' + repr(fields))
-        self._zmq_broadcast.send(self.delimiter.join(map(str, fields)) + self.delimiter)
+        tracked = self._correlator.incoming(fields)
+        if tracked is not None:
+            client, messageid, fields = tracked
+            self._zmq_requests.sendTracked(client, messageid, encode(fields, binary=self._binary))
+
+    def publishStatus(self, status, restored=0):
+        """
+        Tells clients of the broadcast the connection to TWS was
+        lost or re-established, and how many subscriptions were
+        restored.
+
+        """
+        self.publishFields((CONNECTION_STATUS, 1, status, self.source or '', int(time.time()), restored))
 
     def writeField(self, field):
         self.transport.write(str(field) + self.delimiter)
@@ -150,59 +251,182 @@ class IBTWSProtocol(StateMachine, LineOnlyReceiver):
     def writeMessage(self, msg):
         self.transport.write(msg)
 
-ZMQ_OK_RESPONSE  = 'OK'
-ZMQ_ERR_RESPONSE = 'ERR'
-
-ZMQ_OOB_PREFIX = 'OOB'
-
-class ZmqRequests(ZmqREPConnection):
-    _twsprotocol = None
-
-    def setTWSProtocol(self, protocol):
-        self._twsprotocol = protocol
-
-    def gotMessage(self, messageid, msg):
-        # Handle OOB messages.
-        if msg.startswith(ZMQ_OOB_PREFIX + '\0'):
-            fields = msg.split('\0')
-            if fields[1] == 'NOP':
-                log.debug('Sending NOP response.')
-                self.reply_ok(messageid)
-            else:
-                log.error('Unrecognized out-of-band message {0}.'.format(msg))
-                self.reply_err(messageid)
-        else:
-            if self._twsprotocol:
-                self._twsprotocol.writeMessage(msg)
-                self.reply_ok(messageid)
-            else:
-                self.reply_err(messageid)
-
-    def reply_ok(self, messageid):
-        self.reply(messageid, ZMQ_OK_RESPONSE)
-
-    def reply_err(self, messageid):
-        self.reply(messageid, ZMQ_ERR_RESPONSE)
-
-class IBTWSProtocolFactory(Factory):
-    def __init__(self, zmq_requests, zmq_broadcast):
+ENGINES = { 'twisted', 'asyncio' }
+
+AIOPROXY_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aioproxy.py')
+
+class ZmqRequests(CommandHandler, ZmqREPConnection):
+    """
+    The command socket, answering requests through txzmq's
+    ZmqREPConnection.
+
+    """
+    def doRead(self):
+        # As ZmqConnection.doRead, but stopping once paused. The
+        # socket only signals new messages, so those left unread
+        # are read on resuming.
+        if self.read_scheduled is not None:
+            if not self.read_scheduled.called:
+                self.read_scheduled.cancel()
+            self.read_scheduled = None
+        while not self._paused and self.factory is not None:
+            if not self.socket.get(constants.EVENTS) & constants.POLLIN:
+                return
+            try:
+                message = self._readMultipart()
+            except ZMQError as e:
+                if e.errno == constants.EAGAIN:
+                    continue
+                raise
+            callWithLogger(self, self.messageReceived, message)
+
+    def sendTracked(self, client, messageid, frame):
+        self.send(list(client) + [messageid, '', frame])
+
+class IBTWSProtocolFactory(ReconnectingClientFactory):
+    """
+    Builds the protocol of a TWS connection, reconnecting with
+    exponential backoff from initialDelay up to maxDelay seconds
+    when the connection fails or is lost, if reconnect is set.
+    connected fires with the first protocol built.
+
+    """
+    def __init__(self, zmq_requests, zmq_broadcast, reconnect=True, initialDelay=1.0, maxDelay=60, **options):
         self.zmq_requests = zmq_requests
         self.zmq_broadcast = zmq_broadcast
+        self.options = options
+        self.continueTrying = reconnect
+        self.initialDelay = self.delay = initialDelay
+        self.maxDelay = maxDelay
+        self.connected = defer.Deferred()
 
     def buildProtocol(self, addr):
-        return IBTWSProtocol(self.zmq_requests, self.zmq_broadcast)
-
-def main(config):
+        protocol = IBTWSProtocol(self.zmq_requests, self.zmq_broadcast, **self.options)
+        protocol.factory = self
+        if not self.connected.called:
+            self.connected.callback(protocol)
+        return protocol
+
+def start(config):
+    """
+    Binds the ZeroMQ endpoints and connects to TWS, returning
+    the command connection, broadcast connection and a Deferred
+    firing once every connection of the pool has connected.
+
+    """
     zmq_requests_factory = ZmqFactory()
     zmq_requests_endpoint = ZmqEndpoint(ZmqEndpointType.bind, config['endpoint.command'])
-    zmq_requests = ZmqRequests(zmq_requests_factory, zmq_requests_endpoint)
+    zmq_requests = ZmqRequests(zmq_requests_factory)
+    configure(zmq_requests,
+              hwm=config['command.hwm'],
+              sndbuf=config['command.sndbuf'],
+              rcvbuf=config['command.rcvbuf'],
+              linger=config['command.linger'])
+    zmq_requests.addEndpoints([zmq_requests_endpoint])
+    if config['broadcast.encoding'] not in ENCODINGS:
+        raise ValueError('Unknown broadcast encoding {0}.'.format(config['broadcast.encoding']))
+    pool = ConnectionPool.from_config(config)
+    zmq_requests.setPool(pool)
+    if config['pacing.enabled']:
+        lane_limits = dict((lane, (config['pacing.{0}.rate'.format(lane)], config['pacing.{0}.burst'.format(lane)]))
+                           for lane in (MARKET_DATA, HISTORICAL)
+                           if config['pacing.{0}.rate'.format(lane)])
+        # IB paces each client connection separately.
+        for connection in pool:
+            connection.scheduler = Scheduler(partial(zmq_requests.writeRequest, connection),
+                                             rate=config['pacing.rate'],
+                                             burst=config['pacing.burst'],
+                                             lane_limits=lane_limits,
+                                             queue_size=config['pacing.queue.size'])
+    multiplexer = None
+    if config['multiplex.enabled']:
+        timeout = config['multiplex.client.timeout']
+        multiplexer = SubscriptionMultiplexer(timeout=timeout or None)
+        zmq_requests.setMultiplexer(multiplexer)
+        if timeout:
+            LoopingCall(zmq_requests.expireClients).start(timeout, now=False)
+    correlator = RequestCorrelator() if config['correlation.enabled'] else None
+    if correlator is not None:
+        zmq_requests.setCorrelator(correlator)
+    metrics = Metrics(sample=config['metrics.sample']) if config['metrics.enabled'] else None
+    if metrics is not None:
+        zmq_requests.setMetrics(metrics)
+    summary = None
+    if config['log.summary.interval'] and log.isEnabledFor(logging.INFO):
+        summary = MessageSummary(config['log.summary.interval'])
+    orderids = OrderIdAllocator() if config['orderids.enabled'] else None
+    if orderids is not None:
+        zmq_requests.setOrderIdAllocator(orderids)
+    snapshot = SnapshotCache() if config['snapshot.enabled'] else None
+    if snapshot is not None:
+        zmq_requests.setSnapshotCache(snapshot)
+
+    # With fan-out the broadcast is the pipe to the workers, which
+    # do the derived processing and encoding.
+    fanout = config['fanout.enabled']
+    if fanout and not config['fanout.endpoints']:
+        raise ValueError('fanout.enabled needs at least one endpoint in fanout.endpoints.')
+    topics = config['broadcast.topics'] and not fanout
+    binary = config['broadcast.encoding'] == 'binary' and not fanout
+    derived = derived_options(config) if not fanout else {}
 
     zmq_broadcast_factory = ZmqFactory()
-    zmq_broadcast_endpoint = ZmqEndpoint(ZmqEndpointType.bind, config['endpoint.broadcast'])
-    zmq_broadcast = ZmqPubConnection(zmq_broadcast_factory, zmq_broadcast_endpoint)
+    zmq_broadcast_endpoint = ZmqEndpoint(ZmqEndpointType.bind,
+                                         config['fanout.endpoint'] if fanout else config['endpoint.broadcast'])
+    broadcast_type = FanoutPipe if fanout else BroadcastConnection
+    zmq_broadcast = broadcast_type(zmq_broadcast_factory, policy=config['broadcast.policy'],
+                                   held_max=config['broadcast.held.max'])
+    configure(zmq_broadcast,
+              hwm=config['broadcast.hwm'],
+              sndbuf=config['broadcast.sndbuf'],
+              linger=config['broadcast.linger'])
+    zmq_broadcast.addEndpoints([zmq_broadcast_endpoint])
+    zmq_requests.setBroadcast(zmq_broadcast)
+    workers = start_workers(config, zmq_broadcast) if fanout else defer.succeed(None)
+    if metrics is not None and config['metrics.interval']:
+        LoopingCall(zmq_requests.publishMetrics, zmq_broadcast, topics).start(
+            config['metrics.interval'], now=False)
+
+    histcache = None
+    if config['histcache.enabled']:
+        histcache = HistoricalDataCache(config['histcache.path'],
+                                        max_size=config['histcache.size'],
+                                        ttl=config['histcache.ttl'])
+        zmq_requests.setHistoricalCache(histcache)
+        reactor.addSystemEventTrigger('before', 'shutdown', histcache.close)
+
+    connecting = []
+    for connection in pool:
+        factory = IBTWSProtocolFactory(zmq_requests, zmq_broadcast,
+                                       reconnect=config['reconnect.enabled'],
+                                       initialDelay=config['reconnect.delay.initial'],
+                                       maxDelay=config['reconnect.delay.max'],
+                                       clientid=connection.clientid,
+                                       source=connection.name,
+                                       pool=pool,
+                                       topics=topics,
+                                       binary=binary,
+                                       multiplexer=multiplexer,
+                                       correlator=correlator,
+                                       orderids=orderids,
+                                       metrics=metrics,
+                                       summary=summary,
+                                       snapshot=snapshot,
+                                       histcache=histcache,
+                                       write_buffer=config['command.buffer.size'] or None,
+                                       **derived)
+        workers.addCallback(lambda _, connection=connection, factory=factory:
+                            reactor.connectTCP(connection.host, connection.port, factory))
+        connecting.append(factory.connected)
+    return zmq_requests, zmq_broadcast, defer.gatherResults(connecting)
 
-    api_endpoint = TCP4ClientEndpoint(reactor, config['ibtws.host'], config['ibtws.port'])
-    api_endpoint.connect(IBTWSProtocolFactory(zmq_requests, zmq_broadcast))
+def main(config):
+    if config['engine'] not in ENGINES:
+        raise ValueError('Unknown engine {0}.'.format(config['engine']))
+    if config['engine'] == 'asyncio':
+        # The asyncio engine runs on Python 3, in place of this process.
+        os.execvp(config['engine.python'], [config['engine.python'], AIOPROXY_SCRIPT, config.path])
+    start(config)
     reactor.run()
 
 if __name__ == '__main__':
@@ -213,4 +437,5 @@ if __name__ == '__main__':
         sys.exit(1)
 
     config = Config(sys.argv[1])
+    logging.getLogger().setLevel(config['log.level'])
     main(config)
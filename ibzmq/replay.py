@@ -0,0 +1,185 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Republishes a message log written by bin/msglog.py on the
+broadcast endpoint, in place of a live TWS connection, at the
+recorded speed, a multiple of it or as fast as possible.
+
+Pacing follows the log's timestamps, so sqlite logs, which
+only record whole seconds, are replayed one burst per second.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import sqlite3
+
+from twisted.internet import reactor, defer
+
+from txzmq import ZmqFactory, ZmqEndpoint, ZmqEndpointType, ZmqPubConnection
+
+from broadcast import encode_raw
+from capture import CaptureReader
+from msglog import read_messages
+from metrics import Histogram
+from stats import format_summary
+from config import Config
+
+import logging
+log = logging.getLogger(__name__)
+
+# Number of messages sent per reactor iteration when
+# replaying as fast as possible.
+MAX_SPEED_BATCH = 1000
+
+def open_log(path):
+    """
+    Yields the (time, type, content) tuples of a sqlite or
+    capture message log, where time is in seconds since
+    the epoch.
+
+    """
+    if os.path.isdir(path):
+        reader = CaptureReader(path)
+        try:
+            for record in reader:
+                yield record.time / 1e9, record.type, record.content
+        finally:
+            reader.close()
+    else:
+        if not os.path.exists(path):
+            raise IOError('Message log {0} not found.'.format(path))
+        connection = sqlite3.connect(path)
+        try:
+            for message in read_messages(connection):
+                yield message
+        finally:
+            connection.close()
+
+class Replayer(object):
+    """
+    Sends the messages of a log through send() at speed
+    times their recorded rate, or as fast as possible if
+    speed is None.
+
+    Records the lag between the time each message was due
+    and the time it was sent or, as fast as possible, where
+    every message is due at once, the time each send took,
+    in histograms so that memory stays constant however long
+    the log.
+
+    """
+    def __init__(self, messages, send, speed=1.0, clock=reactor, timer=time.time):
+        self._messages = iter(messages)
+        self._send = send
+        self._speed = speed
+        self._clock = clock
+        self._timer = timer
+        self._done = None
+        self._next = None
+        self._origin = None
+
+        self.lags = Histogram()
+        self.send_times = Histogram()
+        self.sent = 0
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        self._done = defer.Deferred()
+        self.started = self._timer()
+        self._next = next(self._messages, None)
+        if self._next is not None:
+            self._origin = (self._next[0], self.started)
+        self._clock.callLater(0, self._run)
+        return self._done
+
+    def _due(self, t):
+        if self._speed is None:
+            return None
+        recorded, wallclock = self._origin
+        return wallclock + (t - recorded) / self._speed
+
+    def _run(self):
+        try:
+            self._replay()
+        except Exception:
+            self._done.errback()
+
+    def _replay(self):
+        sent = 0
+        while self._next is not None:
+            t, type, content = self._next
+            now = self._timer()
+            due = self._due(t)
+
+            if due is None:
+                if sent >= MAX_SPEED_BATCH:
+                    self._clock.callLater(0, self._run)
+                    return
+                due = now
+            elif due > now:
+                self._clock.callLater(due - now, self._run)
+                return
+
+            self._send(content)
+            if self._speed is None:
+                self.send_times.add(self._timer() - now)
+            else:
+                self.lags.add(self._timer() - due)
+            self.sent += 1
+            sent += 1
+            self._next = next(self._messages, None)
+
+        self.finished = self._timer()
+        self._done.callback(self)
+
+    @property
+    def rate(self):
+        elapsed = (self.finished or self._timer()) - self.started
+        return self.sent / elapsed if elapsed > 0 else float('inf')
+
+    def report(self):
+        if self._speed is None:
+            name, times = 'Send time', self.send_times
+        else:
+            name, times = 'Lag', self.lags
+        return 'Replayed {0} messages at {1:,.0f} msgs/sec. {2} {3}'.format(
+            self.sent, self.rate, name, format_summary(times.summary()))
+
+def main(config, path, speed):
+    zmq_broadcast_factory = ZmqFactory()
+    zmq_broadcast_endpoint = ZmqEndpoint(ZmqEndpointType.bind, config['endpoint.broadcast'])
+    zmq_broadcast = ZmqPubConnection(zmq_broadcast_factory, zmq_broadcast_endpoint)
+
+    topics = config['broadcast.topics']
+    replayer = Replayer(open_log(path), lambda message: zmq_broadcast.send(encode_raw(message, topics)), speed)
+
+    def start():
+        log.info('Replaying {0} at {1}.'.format(path, '{0}x'.format(speed) if speed else 'maximum speed'))
+        d = replayer.start()
+        d.addCallback(lambda replayer: log.info(replayer.report()))
+        d.addErrback(lambda failure: log.error(failure.getTraceback()))
+        d.addBoth(lambda _: reactor.stop())
+
+    # Give subscribers time to connect before publishing.
+    reactor.callLater(config['replay.delay'], start)
+    reactor.run()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    if len(sys.argv) not in (3, 4):
+        print('Usage: {0} config.yaml log [speed|max]'.format(sys.argv[0]))
+        sys.exit(1)
+
+    config = Config(sys.argv[1])
+    speed = sys.argv[3] if len(sys.argv) == 4 else '1'
+    main(config, sys.argv[2], None if speed == 'max' else float(speed))
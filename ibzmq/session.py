@@ -0,0 +1,79 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+Records the subscriptions active on a TWS connection so they
+can be restored when the connection is re-established.
+
+"""
+
+from collections import OrderedDict
+
+from incoming import ID_FIELD
+from outgoing import (REQ_MKT_DATA, CANCEL_MKT_DATA,
+                      REQ_MKT_DEPTH, CANCEL_MKT_DEPTH,
+                      REQ_REAL_TIME_BARS, CANCEL_REAL_TIME_BARS,
+                      REQ_ACCOUNT_DATA)
+
+# Subscriptions restored on reconnection, by the id of the
+# cancel ending them.
+SUBSCRIPTIONS = {
+    REQ_MKT_DATA:       CANCEL_MKT_DATA,
+    REQ_MKT_DEPTH:      CANCEL_MKT_DEPTH,
+    REQ_REAL_TIME_BARS: CANCEL_REAL_TIME_BARS,
+}
+
+SUBSCRIPTION_CANCELS = dict((cancel, request) for request, cancel in SUBSCRIPTIONS.items())
+
+class Session(object):
+    """
+    The market data, market depth, real time bar and account
+    update subscriptions written to a connection and not yet
+    cancelled, in the order they were made.
+
+    """
+    def __init__(self):
+        self._requests = OrderedDict()
+
+    def record(self, msg):
+        fields = msg.split('\0')
+        msgid = int(fields[0])
+        if msgid in SUBSCRIPTIONS:
+            # Snapshots end by themselves.
+            if msgid == REQ_MKT_DATA and fields[-2] == '1':
+                return
+            self._requests[(msgid, fields[ID_FIELD])] = msg
+        elif msgid in SUBSCRIPTION_CANCELS:
+            self._requests.pop((SUBSCRIPTION_CANCELS[msgid], fields[ID_FIELD]), None)
+        elif msgid == REQ_ACCOUNT_DATA:
+            # Subscribe flag followed by the account code.
+            key = (msgid, fields[3])
+            if fields[2] == '1':
+                self._requests[key] = msg
+            else:
+                self._requests.pop(key, None)
+
+    def forget(self, msg):
+        """
+        Returns whether msg cancels an active subscription,
+        removing the subscription if so.
+
+        """
+        fields = msg.split('\0')
+        msgid = int(fields[0])
+        if msgid in SUBSCRIPTION_CANCELS:
+            return self._requests.pop((SUBSCRIPTION_CANCELS[msgid], fields[ID_FIELD]), None) is not None
+        return False
+
+    def requests(self):
+        """
+        Returns the requests restoring the active subscriptions.
+
+        """
+        return self._requests.values()
+
+    def __len__(self):
+        return len(self._requests)
@@ -0,0 +1,255 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+"""
+A fake TWS for exercising the proxy without a gateway.
+
+After the version and client id handshake the simulator streams
+synthetic messages of every type in MESSAGE_PARSERS, or the
+messages of a recorded log, at a fixed rate or as fast as the
+client reads them. Every probe_interval messages it sends a
+probe, a TICK_STRING for PROBE_TICKER whose value is the time it
+was written, so subscribers can measure end to end latency. The
+stream ends with a probe whose value is PROBE_END.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import itertools
+
+from zope.interface import implementer
+
+from twisted.internet import reactor
+from twisted.internet.interfaces import IPullProducer
+from twisted.internet.protocol import Factory, Protocol
+from twisted.internet.task import LoopingCall
+
+from framing import FieldSplitter, join_fields
+from incoming import (MESSAGE_PARSERS, MESSAGE_FIELD_COUNTS, MESSAGES_WITH_ID, ID_FIELD,
+                      TICK_PRICE, TICK_SIZE, TICK_GENERIC, TICK_STRING,
+                      OPEN_ORDER, CONTRACT_DATA, BOND_CONTRACT_DATA,
+                      HISTORICAL_DATA, SCANNER_DATA)
+
+import logging
+log = logging.getLogger(__name__)
+
+SERVER_VERSION = 76
+
+PROBE_TICKER    = 999999
+PROBE_TICK_TYPE = 45
+PROBE_END       = 'END'
+
+# Messages written per reactor iteration.
+BATCH_SIZE = 500
+
+TICKERS = 50
+
+def probe(value=None):
+    if value is None:
+        value = '{0:.6f}'.format(time.time())
+    return (TICK_STRING, 6, PROBE_TICKER, PROBE_TICK_TYPE, value)
+
+def is_probe(message):
+    return int(message[0]) == TICK_STRING and int(message[ID_FIELD]) == PROBE_TICKER
+
+def fixed_message(msgid, seq):
+    fields = ['0'] * MESSAGE_FIELD_COUNTS[msgid]
+    if msgid in MESSAGES_WITH_ID and fields:
+        fields[ID_FIELD - 2] = str(seq % TICKERS)
+    return (msgid, 1) + tuple(fields)
+
+def open_order(seq, legs=2):
+    fields = (OPEN_ORDER, 30, seq) + ('0',) * 57
+    fields += ('MKT', '0.0', '0', '0', '0', '0')
+    fields += ('0',) * 6
+    fields += ('', legs) + ('0',) * 8*legs
+    fields += (legs,) + ('0',) * legs
+    fields += (legs,) + ('0',) * 2*legs
+    fields += ('0', '0', '5.0') + ('0',) * 7
+    fields += ('D', '0')
+    fields += ('0',) * 4
+    fields += (1, '0', '0', '0')
+    fields += ('Adaptive', legs) + ('0',) * 2*legs
+    return fields + ('0',) * 10
+
+def historical_data(seq, bars=2000):
+    fields = [HISTORICAL_DATA, 3, seq, '20121018  09:30:00', '20121018  16:00:00', bars]
+    for i in xrange(bars):
+        fields.extend(('20121018  09:30:{0:02}'.format(i % 60), '1.0', '1.5', '0.5', '1.25', 100, '1.2', 'false', 4))
+    return tuple(fields)
+
+def synthetic_message(msgid, seq):
+    """
+    Returns a well formed message of type msgid for sequence
+    number seq, with OPEN_ORDER and HISTORICAL_DATA messages
+    at realistic, large sizes.
+
+    """
+    tickerid = seq % TICKERS
+    if msgid == TICK_PRICE:
+        return (TICK_PRICE, 6, tickerid, 1 + seq % 2, '{0:.2f}'.format(100 + seq % 20 * 0.01), 100, 1)
+    elif msgid == TICK_SIZE:
+        return (TICK_SIZE, 6, tickerid, seq % 2, 100 + seq % 1000)
+    elif msgid == TICK_GENERIC:
+        return (TICK_GENERIC, 6, tickerid, 49, '0.0')
+    elif msgid == OPEN_ORDER:
+        return open_order(seq)
+    elif msgid == HISTORICAL_DATA:
+        return historical_data(seq)
+    elif msgid == CONTRACT_DATA:
+        return (CONTRACT_DATA, 8, seq) + ('0',) * 28 + (1, 'ISIN', 'US0000000000')
+    elif msgid == BOND_CONTRACT_DATA:
+        return (BOND_CONTRACT_DATA, 6, seq) + ('0',) * 28 + (1, 'CUSIP', '000000000')
+    elif msgid == SCANNER_DATA:
+        return (SCANNER_DATA, 3, seq, 2) + ('0',) * 32
+    return fixed_message(msgid, seq)
+
+def synthetic_messages(full_cycle=1000):
+    """
+    Yields an endless stream of encoded synthetic messages,
+    mostly ticks, with every message type once every
+    full_cycle messages.
+
+    """
+    ticks = (TICK_PRICE, TICK_SIZE, TICK_PRICE, TICK_SIZE, TICK_GENERIC)
+    others = sorted(set(MESSAGE_PARSERS) - set(ticks))
+    for seq in itertools.count():
+        position = seq % full_cycle
+        if position < len(others):
+            msgid = others[position]
+        else:
+            msgid = ticks[seq % len(ticks)]
+        yield join_fields(synthetic_message(msgid, seq))
+
+def recorded_messages(messages):
+    """
+    Yields the encoded messages of a message log.
+
+    """
+    for _, _, content in messages:
+        yield content
+
+@implementer(IPullProducer)
+class TWSSimulatorProtocol(Protocol):
+    """
+    Serves one client connection, writing count messages
+    from messages at rate messages per second, or as fast
+    as the client reads them if rate is None.
+
+    """
+    def __init__(self, messages, count=None, rate=None, probe_interval=100):
+        self._messages = messages
+        self._count = count
+        self._rate = rate
+        self._probe_interval = probe_interval
+        self._splitter = FieldSplitter()
+        self._handshake = []
+        self._loop = None
+        self._started = None
+        self._finished = False
+
+        self.sent = 0
+        self.clientVersion = None
+        self.clientId = None
+
+    def dataReceived(self, data):
+        if self.clientId is not None:
+            return
+
+        self._handshake.extend(self._splitter.split(data))
+        if self.clientVersion is None and self._handshake:
+            self.clientVersion = int(self._handshake[0])
+            self.transport.write(join_fields([SERVER_VERSION, time.strftime('%Y%m%d %H:%M:%S')]))
+        if len(self._handshake) >= 2:
+            self.clientId = int(self._handshake[1])
+            log.info('Client {0} connected with version {1}.'.format(self.clientId, self.clientVersion))
+            self.startStreaming()
+
+    def startStreaming(self):
+        if self._rate is None:
+            self.transport.registerProducer(self, False)
+        else:
+            self._started = time.time()
+            self._loop = LoopingCall(self._tick)
+            self._loop.start(0.01)
+
+    def _tick(self):
+        due = int((time.time() - self._started) * self._rate)
+        self.writeBatch(due - self.sent)
+
+    def resumeProducing(self):
+        self.writeBatch(BATCH_SIZE)
+
+    def stopProducing(self):
+        self._finish()
+
+    def writeBatch(self, count):
+        if self._finished:
+            return
+
+        data = []
+        for _ in xrange(count):
+            if self._count is not None and self.sent >= self._count:
+                break
+            message = next(self._messages, None)
+            if message is None:
+                break
+            data.append(message)
+            self.sent += 1
+            if self._probe_interval and not self.sent % self._probe_interval:
+                data.append(join_fields(probe()))
+        else:
+            self.transport.write(''.join(data))
+            return
+
+        data.append(join_fields(probe(PROBE_END)))
+        self.transport.write(''.join(data))
+        log.info('Sent {0} messages.'.format(self.sent))
+        self._finish()
+
+    def _finish(self):
+        self._finished = True
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        elif self._rate is None and self.transport.producer is self:
+            self.transport.unregisterProducer()
+
+    def connectionLost(self, reason):
+        self._finish()
+
+class TWSSimulatorFactory(Factory):
+    def __init__(self, messages, count=None, rate=None, probe_interval=100):
+        self.messages = messages
+        self.count = count
+        self.rate = rate
+        self.probe_interval = probe_interval
+
+    def buildProtocol(self, addr):
+        return TWSSimulatorProtocol(self.messages, self.count, self.rate, self.probe_interval)
+
+def main(port, count, rate, path=None):
+    if path:
+        from replay import open_log
+        messages = recorded_messages(open_log(path))
+    else:
+        messages = synthetic_messages()
+
+    reactor.listenTCP(port, TWSSimulatorFactory(messages, count, rate))
+    log.info('Simulating TWS on port {0}.'.format(port))
+    reactor.run()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    if len(sys.argv) not in (4, 5):
+        print('Usage: {0} port count rate|max [log]'.format(sys.argv[0]))
+        sys.exit(1)
+
+    port, count, rate = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3]
+    main(port, count, None if rate == 'max' else float(rate), *sys.argv[4:])
@@ -0,0 +1,114 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+from collections import OrderedDict
+
+from framing import join_fields
+from incoming import (ID_FIELD, TICK_PRICE, TICK_SIZE, TICK_OPTION_COMPUTATION,
+                      TICK_GENERIC, TICK_STRING, TICK_EFP, MARKET_DATA_TYPE,
+                      ACCT_VALUE, PORTFOLIO_VALUE, ACCT_UPDATE_TIME)
+
+def tick_key(message):
+    return (message[0], message[ID_FIELD], message[3])
+
+def ticker_key(message):
+    return (message[0], message[ID_FIELD])
+
+def account_value_key(message):
+    # Key, currency and account name.
+    return (message[0], message[2], message[4], message[5])
+
+def portfolio_value_key(message):
+    # Contract id and account name.
+    return (message[0], message[2], message[-1])
+
+def message_key(message):
+    return (message[0],)
+
+class SnapshotCache(object):
+    """
+    Keeps the last value of every tick, market data type and
+    account update published, so clients joining late can be
+    sent the current state of the market and their accounts
+    without re-requesting it from TWS.
+
+    Ticks are keyed by (message id, tickerId, tickType), account
+    values by key, currency and account and portfolio values by
+    contract id and account. Each value remembers the connection
+    it came from, so the values of a lost connection can be
+    discarded with it.
+
+    """
+    KEYS = {
+        TICK_PRICE:              tick_key,
+        TICK_SIZE:               tick_key,
+        TICK_OPTION_COMPUTATION: tick_key,
+        TICK_GENERIC:            tick_key,
+        TICK_STRING:             tick_key,
+        TICK_EFP:                tick_key,
+        MARKET_DATA_TYPE:        ticker_key,
+        ACCT_VALUE:              account_value_key,
+        PORTFOLIO_VALUE:         portfolio_value_key,
+        ACCT_UPDATE_TIME:        message_key,
+    }
+
+    # Messages filtered by tickerId in snapshots of
+    # particular tickers.
+    TICKER_MESSAGES = KEYS.viewkeys() - { ACCT_VALUE, PORTFOLIO_VALUE, ACCT_UPDATE_TIME }
+
+    def __init__(self):
+        self._values = OrderedDict()
+
+    def update(self, message, source=None):
+        key = self.KEYS.get(message[0])
+        if key is not None:
+            self._values[key(message)] = (source, message)
+
+    def messages(self, tickerids=None):
+        """
+        Returns the cached messages, or only the market data of
+        tickerids if given.
+
+        """
+        if tickerids is None:
+            return [message for _, message in self._values.itervalues()]
+        tickerids = set(str(id) for id in tickerids)
+        return [message for _, message in self._values.itervalues()
+                if message[0] in self.TICKER_MESSAGES and str(message[ID_FIELD]) in tickerids]
+
+    def snapshot(self, tickerids=None):
+        """
+        Returns the cached messages, encoded as received from
+        TWS, or only the market data of tickerids if given.
+
+        """
+        return [join_fields(message) for message in self.messages(tickerids)]
+
+    def discard_ticker(self, tickerid):
+        """
+        Discards the market data of tickerid, once its
+        subscription is cancelled.
+
+        """
+        tickerid = str(tickerid)
+        for key in [key for key, (_, message) in self._values.iteritems()
+                    if message[0] in self.TICKER_MESSAGES and str(message[ID_FIELD]) == tickerid]:
+            del self._values[key]
+
+    def discard_source(self, source):
+        """
+        Discards the values received on the connection source,
+        which are stale once it is lost.
+
+        """
+        for key in [key for key, (from_source, _) in self._values.iteritems() if from_source == source]:
+            del self._values[key]
+
+    def clear(self):
+        self._values.clear()
+
+    def __len__(self):
+        return len(self._values)
@@ -0,0 +1,46 @@
+##  _ _                                                                      ##
+## (_) |__   ______ _ _ ___ _ __  __ _  IB-ZeroMQ - An Interactive Brokers   ##
+## | | '_ \ |_ / -_) '_/ _ \ '  \/ _` |             TWS API to ZeroMQ Proxy  ##
+## |_|_.__/ /__\___|_| \___/_|_|_\__, | (c) 2012, James Brotchie             ##
+##                                  |_| http://zerotick.org/                 ##
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+def percentile(ordered, p):
+    """
+    Returns the p-th percentile of an ordered sequence
+    using the nearest rank method.
+
+    """
+    if not ordered:
+        return None
+    rank = int(round(p / 100.0 * (len(ordered) - 1)))
+    return ordered[rank]
+
+def summarize(samples, percentiles=PERCENTILES):
+    """
+    Returns a dict of the count, mean, max and percentiles
+    of a sequence of samples.
+
+    """
+    ordered = sorted(samples)
+    summary = {
+        'count': len(ordered),
+        'mean': sum(ordered) / float(len(ordered)) if ordered else None,
+        'max': ordered[-1] if ordered else None,
+    }
+    for p in percentiles:
+        summary['p{0:g}'.format(p)] = percentile(ordered, p)
+    return summary
+
+def format_summary(summary, scale=1e6, unit='us'):
+    """
+    Formats a summary of durations in seconds for logging,
+    in microseconds by default.
+
+    """
+    if not summary['count']:
+        return 'no samples'
+    keys = sorted((k for k in summary if k.startswith('p')), key=lambda k: float(k[1:]))
+    return ' '.join('{0}={1:.1f}{2}'.format(k, summary[k] * scale, unit)
+                    for k in ['mean'] + keys + ['max'])
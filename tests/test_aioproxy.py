@@ -0,0 +1,177 @@
+# The asyncio engine runs on Python 3 with the ibzmq directory on
+# the path: PYTHONPATH=ibzmq python3 -m pytest tests/test_aioproxy.py
+
+import json
+import pytest
+
+asyncio = pytest.importorskip('asyncio')
+
+import zmq
+
+from ibzmq.aioproxy import LoopClock, TWSProtocol, start
+from ibzmq.config import Config
+from ibzmq.framing import join_fields
+from ibzmq.incoming import CONNECTION_STATUS
+from ibzmq.outgoing import REQ_CURRENT_TIME
+
+HANDSHAKE = join_fields([76, '20121018 10:00:00 EST']).encode()
+
+TICK = (1, 6, '1042', '1', '1.25', '100', '1')
+
+REQUEST = join_fields([REQ_CURRENT_TIME, 1])
+
+class FakeTransport(object):
+    def __init__(self):
+        self.written = b''
+        self.limit = None
+
+    def write(self, data):
+        self.written += data
+
+    def set_write_buffer_limits(self, high=None):
+        self.limit = high
+
+class FakeConnector(object):
+    def resetDelay(self):
+        pass
+
+    def retry(self):
+        pass
+
+class FakeRequests(object):
+    def __init__(self):
+        self.calls = []
+
+    def setTWSProtocol(self, protocol):
+        self.calls.append('attached')
+
+    def lostTWSProtocol(self, protocol):
+        self.calls.append('detached')
+
+    def pauseReading(self, source):
+        self.calls.append(('pause', source))
+
+    def resumeReading(self, source):
+        self.calls.append(('resume', source))
+
+class FakeBroadcast(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+def config(directory, port=0, **overrides):
+    settings = dict(Config.DEFAULTS)
+    settings.update({
+        'ibtws.host': '127.0.0.1',
+        'ibtws.port': port,
+        'endpoint.command': 'ipc://{0}/command'.format(directory),
+        'endpoint.broadcast': 'ipc://{0}/broadcast'.format(directory),
+        'reconnect.enabled': False,
+        'log.summary.interval': 0,
+    })
+    settings.update(overrides)
+    return settings
+
+def test_loop_clock():
+    loop = asyncio.new_event_loop()
+    clock, calls = LoopClock(loop), []
+    call = clock.callLater(0.01, calls.append, 1)
+    cancelled = clock.callLater(0.01, calls.append, 2)
+    cancelled.cancel()
+    assert call.active() and not cancelled.active()
+    loop.run_until_complete(asyncio.sleep(0.02))
+    assert calls == [1]
+    assert not call.active()
+    loop.close()
+
+def test_refuses_unsupported_features(tmpdir):
+    with pytest.raises(ValueError):
+        start(config(str(tmpdir), **{ 'depth.enabled': True }), asyncio.new_event_loop())
+    with pytest.raises(ValueError):
+        start(config(str(tmpdir), **{ 'broadcast.policy': 'shed' }), asyncio.new_event_loop())
+
+def test_protocol_decodes_and_publishes():
+    requests, broadcast, transport = FakeRequests(), FakeBroadcast(), FakeTransport()
+    protocol = TWSProtocol(FakeConnector(), requests, broadcast, clientid=3, write_buffer=1024)
+    protocol.connection_made(transport)
+    assert transport.written == b'59\0'
+    assert transport.limit == 1024
+
+    # One byte at a time, so every field and message is split.
+    for i in range(len(HANDSHAKE)):
+        protocol.data_received(HANDSHAKE[i:i+1])
+    stream = join_fields(TICK).encode() * 2
+    for i in range(len(stream)):
+        protocol.data_received(stream[i:i+1])
+
+    assert transport.written == b'59\x003\0'
+    assert protocol.serverVersion == 76
+    assert broadcast.sent == [join_fields(TICK)] * 2
+
+    protocol.pause_writing()
+    protocol.resume_writing()
+    protocol.connection_lost(None)
+    assert requests.calls == ['attached', ('pause', None), ('resume', None), ('resume', None), 'detached']
+    assert broadcast.sent[-1].split('\0')[:3] == [str(CONNECTION_STATUS), '1', 'DISCONNECTED']
+
+class FakeTWS(asyncio.Protocol):
+    connections = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.received = b''
+        FakeTWS.connections.append(self)
+
+    def data_received(self, data):
+        if not self.received:
+            self.transport.write(HANDSHAKE)
+        self.received += data
+
+def receive(loop, socket):
+    for _ in range(200):
+        loop.run_until_complete(asyncio.sleep(0.01))
+        if socket.poll(0):
+            return socket.recv_multipart()
+    raise AssertionError('Nothing received.')
+
+def test_serves_the_endpoints(tmpdir):
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(loop.create_server(FakeTWS, '127.0.0.1', 0))
+    port = server.sockets[0].getsockname()[1]
+    zmq_requests, zmq_broadcast, connected = start(config(str(tmpdir), port), loop)
+    protocol = loop.run_until_complete(connected)[0]
+
+    context = zmq.Context.instance()
+    subscriber = context.socket(zmq.SUB)
+    subscriber.setsockopt(zmq.SUBSCRIBE, b'')
+    subscriber.connect('ipc://{0}/broadcast'.format(tmpdir))
+    client = context.socket(zmq.DEALER)
+    client.connect('ipc://{0}/command'.format(tmpdir))
+    try:
+        loop.run_until_complete(asyncio.sleep(0.1))
+        tws = FakeTWS.connections[-1]
+        assert tws.received == b'59\x000\0'
+        tws.transport.write(join_fields(TICK).encode())
+        assert receive(loop, subscriber) == [join_fields(TICK).encode()]
+
+        client.send_multipart([b'1', b'', b'OOB\0NOP\0'])
+        assert receive(loop, client) == [b'1', b'', b'OK']
+        client.send_multipart([b'2', b'', REQUEST.encode()])
+        assert receive(loop, client) == [b'2', b'', b'OK']
+        assert tws.received.endswith(REQUEST.encode())
+
+        client.send_multipart([b'3', b'', b'OOB\0POOL\0'])
+        reply = receive(loop, client)
+        assert reply[:3] == [b'3', b'', b'OK']
+        assert json.loads(reply[3].decode())['default']['routed'] == 1
+        client.send_multipart([b'4', b'', b'OOB\0BOGUS\0'])
+        assert receive(loop, client) == [b'4', b'', b'ERR']
+    finally:
+        for socket in (subscriber, client, zmq_requests, zmq_broadcast):
+            socket.close()
+        protocol.transport.close()
+        server.close()
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
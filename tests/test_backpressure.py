@@ -0,0 +1,189 @@
+import zmq
+
+from py.test import raises
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransport
+from txzmq import ZmqFactory, ZmqEndpoint, ZmqEndpointType
+
+from ibzmq.backpressure import BroadcastConnection, RequestProducer, configure, FALLBACK_PERIOD
+from ibzmq.broadcast import encode
+from ibzmq.incoming import TICK_PRICE, TICK_SIZE, ORDER_STATUS
+from ibzmq.proxy import IBTWSProtocol, ZmqRequests
+
+from test_framing import FakeRequests, FakeBroadcast
+
+TICK = (TICK_SIZE, 6, '7', '0', '100')
+
+def order_status(id):
+    return (ORDER_STATUS, 6, str(id), 'Submitted', '0', '100', '0', '1', '0', '0', '0', '')
+
+def broadcast(factory, address, policy, hwm=2, **options):
+    clock = Clock()
+    connection = BroadcastConnection(factory, policy=policy, clock=clock, **options)
+    configure(connection, hwm=hwm, linger=0)
+    connection.addEndpoints([ZmqEndpoint(ZmqEndpointType.bind, address)])
+    return connection, clock
+
+def subscriber(factory, address, hwm=2):
+    s = factory.context.socket(zmq.SUB)
+    s.setsockopt(zmq.RCVHWM, hwm)
+    s.setsockopt(zmq.LINGER, 0)
+    s.setsockopt(zmq.SUBSCRIBE, '')
+    s.connect(address)
+    return s
+
+def drain(s):
+    received = []
+    while True:
+        try:
+            received.append(s.recv(zmq.NOBLOCK))
+        except zmq.Again:
+            return received
+
+def test_unknown_policy():
+    with raises(ValueError):
+        BroadcastConnection(ZmqFactory(), policy='block')
+    with raises(ValueError):
+        BroadcastConnection(ZmqFactory(), policy='shed', held_max=0)
+
+def test_shed_drops_ticks_and_holds_orders():
+    factory = ZmqFactory()
+    connection, clock = broadcast(factory, 'inproc://shed', 'shed')
+    s = subscriber(factory, 'inproc://shed')
+    # Reads the subscription.
+    connection.doRead()
+
+    for _ in xrange(10):
+        connection.send(encode(TICK))
+    sent = 10 - connection.dropped[TICK_SIZE]
+    assert 0 < sent < 10
+    for id in xrange(3):
+        connection.send(encode(order_status(id)))
+    # Nothing overtakes the held orders.
+    connection.send(encode(TICK))
+
+    assert connection.pending == 3
+    assert connection.stats() == { 'policy': 'shed', 'dropped': { 'TickSize': 11 - sent },
+                                   'held': 3, 'pending': 3, 'overflows': 0, 'fallback': False }
+
+    received = drain(s)
+    clock.advance(0.01)
+    received += drain(s)
+    clock.advance(0.01)
+    received += drain(s)
+    assert received == [encode(TICK)] * sent + [encode(order_status(id)) for id in xrange(3)]
+    assert connection.pending == 0
+    s.close()
+    factory.shutdown()
+
+def test_full_subscriber_cannot_hold_up_others():
+    factory = ZmqFactory()
+    connection, clock = broadcast(factory, 'inproc://overflow', 'shed', held_max=3)
+    slow = subscriber(factory, 'inproc://overflow')
+    fast = subscriber(factory, 'inproc://overflow', hwm=100)
+    connection.doRead()
+
+    received = []
+    for id in xrange(10):
+        connection.send(encode(order_status(id)))
+        received += drain(fast)
+    assert received == [encode(order_status(id)) for id in xrange(10)]
+    assert connection.overflows == 1
+    assert connection.pending == 0
+    assert connection.stats()['fallback']
+
+    # Shedding again once the fallback period is over.
+    clock.advance(FALLBACK_PERIOD)
+    assert not connection.stats()['fallback']
+    assert len(drain(slow)) < 10
+    slow.close()
+    fast.close()
+    factory.shutdown()
+
+def test_drop_policy_never_refuses():
+    factory = ZmqFactory()
+    connection, clock = broadcast(factory, 'inproc://drop', 'drop')
+    s = subscriber(factory, 'inproc://drop')
+    for id in xrange(10):
+        connection.send(encode(order_status(id)))
+    assert connection.pending == 0
+    assert len(drain(s)) < 10
+    s.close()
+    factory.shutdown()
+
+class Recorder(ZmqRequests):
+    def gotMessage(self, messageid, msg):
+        self.received.append(msg)
+        if self.pause_after and len(self.received) == self.pause_after:
+            self.pauseReading('data')
+
+def requests(factory, address, pause_after=None):
+    connection = Recorder(factory, ZmqEndpoint(ZmqEndpointType.bind, address))
+    connection.received = []
+    connection.pause_after = pause_after
+    client = factory.context.socket(zmq.DEALER)
+    client.setsockopt(zmq.LINGER, 0)
+    client.connect(address)
+    return connection, client
+
+def send(client, *requests):
+    for request in requests:
+        client.send_multipart(['id', '', request])
+
+def test_paused_requests_are_left_on_the_socket():
+    factory = ZmqFactory()
+    connection, client = requests(factory, 'inproc://requests', pause_after=1)
+    send(client, 'a', 'b', 'c')
+
+    connection.doRead()
+    assert connection.received == ['a']
+    connection.doRead()
+    assert connection.received == ['a']
+
+    connection.pause_after = None
+    connection.resumeReading('data')
+    assert connection.received == ['a', 'b', 'c']
+    client.close()
+    factory.shutdown()
+
+def test_reading_resumes_once_every_connection_drains():
+    factory = ZmqFactory()
+    connection, client = requests(factory, 'inproc://pool')
+    connection.pauseReading('data1')
+    connection.pauseReading('data2')
+    send(client, 'a')
+
+    connection.resumeReading('data1')
+    connection.doRead()
+    assert connection.received == []
+    connection.resumeReading('data2')
+    assert connection.received == ['a']
+    client.close()
+    factory.shutdown()
+
+class PausingRequests(FakeRequests):
+    def __init__(self):
+        self.calls = []
+
+    def pauseReading(self, source):
+        self.calls.append(('pause', source))
+
+    def resumeReading(self, source):
+        self.calls.append(('resume', source))
+
+def test_protocol_registers_producer():
+    requests = PausingRequests()
+    protocol = IBTWSProtocol(requests, FakeBroadcast(), source='data', write_buffer=1024)
+    transport = StringTransport()
+    protocol.makeConnection(transport)
+
+    assert isinstance(transport.producer, RequestProducer)
+    assert transport.bufferSize == 1024
+    transport.producer.pauseProducing()
+    transport.producer.resumeProducing()
+    assert requests.calls == [('pause', 'data'), ('resume', 'data')]
+
+def test_protocol_without_write_buffer():
+    transport = StringTransport()
+    IBTWSProtocol(FakeRequests(), FakeBroadcast()).makeConnection(transport)
+    assert transport.producer is None
@@ -0,0 +1,114 @@
+from py.test import raises
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransport
+from twisted.internet.error import ConnectionLost
+from twisted.python.failure import Failure
+from txzmq import ZmqFactory, ZmqEndpoint, ZmqEndpointType
+
+from ibzmq.bars import BarEngine, parse_bar
+from ibzmq.binary import pack, unpack
+from ibzmq.framing import join_fields
+from ibzmq.incoming import TICK_PRICE, TICK_SIZE, BAR
+from ibzmq.outgoing import CANCEL_MKT_DATA
+from ibzmq.pool import ConnectionPool, Connection
+from ibzmq.proxy import IBTWSProtocol, ZmqRequests
+
+from test_framing import HANDSHAKE, FakeRequests, FakeBroadcast
+
+def test_protocol_discards_bars_on_cancel_and_connection_loss():
+    clock = Clock()
+    broadcast = FakeBroadcast()
+    factory = ZmqFactory()
+    requests = ZmqRequests(factory, ZmqEndpoint(ZmqEndpointType.bind, 'inproc://bars'))
+    requests.setPool(ConnectionPool([Connection(None, '127.0.0.1', 4002, 0)]))
+    protocol = IBTWSProtocol(requests, broadcast, bars={'intervals': [5], 'clock': clock})
+    protocol.makeConnection(StringTransport())
+    protocol.dataReceived(HANDSHAKE + ''.join(join_fields(m) for m in last(7, '10.0', 2) + last(8, '20.0', 3)))
+
+    requests.submitRequest(None, join_fields([CANCEL_MKT_DATA, 1, 7]))
+    clock.advance(5)
+    assert [m for m in broadcast.sent if m.startswith('{0}\0'.format(BAR))] == \
+           [join_fields([BAR, 1, 8, 5, 0, 20.0, 20.0, 20.0, 20.0, 3, 1])]
+
+    protocol.dataReceived(''.join(join_fields(m) for m in last(8, '21.0', 1)))
+    protocol.connectionLost(Failure(ConnectionLost()))
+    sent = len(broadcast.sent)
+    clock.advance(5)
+    assert len(broadcast.sent) == sent
+    factory.shutdown()
+
+def last(id, price, size):
+    return [(TICK_PRICE, 6, id, '4', price, size, '0'), (TICK_SIZE, 6, id, '5', size)]
+
+def engine(intervals=(1, 60)):
+    clock = Clock()
+    clock.advance(1000)
+    published = []
+    return BarEngine(published.append, intervals=intervals, clock=clock), clock, published
+
+def feed(bars, messages):
+    for message in messages:
+        bars.add(message)
+
+def test_builds_ohlcv_bars():
+    bars, clock, published = engine(intervals=(1,))
+    feed(bars, last('7', '10.0', '1') + last('7', '10.5', '2') + last('7', '9.5', '3') + last('7', '10.25', '4'))
+    assert published == []
+    clock.advance(1)
+    assert published == [(BAR, 1, '7', 1, 1000, 10.0, 10.5, 9.5, 10.25, 10, 4)]
+    assert bars.trades == 4
+
+def test_lone_last_size_is_a_trade():
+    bars, clock, published = engine(intervals=(1,))
+    feed(bars, last('7', '10.0', '1'))
+    bars.add((TICK_SIZE, 6, '7', '5', '3'))
+    bars.add((TICK_SIZE, 6, '7', '0', '500'))
+    clock.advance(1)
+    assert published[0][-2:] == (4, 2)
+
+def test_ignores_other_ticks():
+    bars, clock, published = engine()
+    bars.add((TICK_PRICE, 6, '7', '1', '10.0', '100', '1'))
+    bars.add((TICK_SIZE, 6, '8', '5', '3'))
+    bars.add((TICK_PRICE, 6, '7', '4', '-1', '0', '0'))
+    clock.advance(60)
+    assert published == []
+    assert not clock.getDelayedCalls()
+
+def test_intervals_and_tickers_kept_apart():
+    bars, clock, published = engine()
+    feed(bars, last('7', '10.0', '1') + last('8', '20.0', '1'))
+    clock.advance(1)
+    assert [(m[2], m[3]) for m in published] == [('7', 1), ('8', 1)]
+    feed(bars, last('7', '11.0', '1'))
+    clock.advance(59)
+    assert [(m[2], m[3], m[4]) for m in published[2:]] == [('7', 1, 1001), ('7', 60, 960), ('8', 60, 960)]
+    assert published[-2][5:] == (10.0, 11.0, 10.0, 11.0, 2, 2)
+    assert not clock.getDelayedCalls()
+
+def test_late_close_publishes_previous_bar_first():
+    bars, clock, published = engine(intervals=(1,))
+    feed(bars, last('7', '10.0', '1'))
+    bars.trade('7', 11.0, 1)
+    clock.rightNow += 1
+    bars.trade('7', 12.0, 1)
+    assert published == [(BAR, 1, '7', 1, 1000, 10.0, 11.0, 10.0, 11.0, 2, 2)]
+
+def test_rejects_bad_intervals():
+    for intervals in ((), (0,), (1.5,)):
+        with raises(ValueError):
+            BarEngine(None, intervals=intervals, clock=Clock())
+
+def test_parse_and_pack():
+    bar = (BAR, 1, '7', 60, 960, 10.0, 11.0, 9.5, 10.5, 300, 12)
+    assert parse_bar(join_fields(bar).split('\0')) == ('7', 60, 960, 10.0, 11.0, 9.5, 10.5, 300, 12)
+    assert unpack(pack(bar)) == (BAR, 1, 7, 60, 960, 10.0, 11.0, 9.5, 10.5, 300, 12)
+
+def test_protocol_publishes_bars():
+    clock = Clock()
+    broadcast = FakeBroadcast()
+    protocol = IBTWSProtocol(FakeRequests(), broadcast, bars={'intervals': [5], 'clock': clock})
+    protocol.makeConnection(StringTransport())
+    protocol.dataReceived(HANDSHAKE + ''.join(join_fields(m) for m in last(7, '10.0', 2)))
+    clock.advance(5)
+    assert broadcast.sent[-1] == join_fields([BAR, 1, 7, 5, 0, 10.0, 10.0, 10.0, 10.0, 2, 1])
@@ -0,0 +1,43 @@
+from ibzmq.binary import pack, unpack, decode, to_text, is_binary, message_id, unpack_array
+from ibzmq.broadcast import encode, message_topic
+from ibzmq.framing import join_fields
+from ibzmq.incoming import TICK_PRICE, TICK_SIZE, TICK_STRING, REAL_TIME_BARS
+
+PRICE = (TICK_PRICE, 6, '1042', '1', '1.25', '100', '1')
+
+def test_pack_roundtrip():
+    frame = pack(PRICE)
+    assert is_binary(frame)
+    assert message_id(frame) == TICK_PRICE
+    assert unpack(frame) == (TICK_PRICE, 6, 1042, 1, 1.25, 100, 1)
+    assert len(frame) == 5 + 4 + 4 + 8 + 8 + 4
+
+def test_large_values():
+    bar = (REAL_TIME_BARS, 3, '7', '1350550000', '1.0', '1.5', '0.5', '1.25', '12345678901', '1.2', '42')
+    assert unpack(pack(bar))[8] == 12345678901
+
+def test_unpackable_messages_sent_as_text():
+    assert pack((TICK_STRING, 6, '1042', '45', '1350550000')) is None
+    assert pack((TICK_PRICE, 6, '1042', '1', '', '100', '1')) is None
+    assert pack((TICK_SIZE, 6, '1042', '0')) is None
+    assert encode((TICK_PRICE, 6, '1042', '1', '', '100', '1'), binary=True) == \
+        join_fields((TICK_PRICE, 6, '1042', '1', '', '100', '1'))
+
+def test_encode_binary_with_topic():
+    frames = encode(PRICE, topics=True, binary=True)
+    assert frames == [message_topic(PRICE), pack(PRICE)]
+
+def test_decode_either_encoding():
+    assert decode(pack(PRICE)) == (TICK_PRICE, 6, 1042, 1, 1.25, 100, 1)
+    assert decode(join_fields(PRICE)) == ('1', '6', '1042', '1', '1.25', '100', '1')
+
+def test_to_text():
+    assert to_text(pack(PRICE)) == join_fields(PRICE)
+    assert to_text(join_fields(PRICE)) == join_fields(PRICE)
+
+def test_unpack_array():
+    frames = [pack((TICK_PRICE, 6, str(id), '1', str(id + 0.5), '100', '1')) for id in xrange(3)]
+    records = unpack_array(frames, TICK_PRICE)
+    assert list(records['tickerId']) == [0, 1, 2]
+    assert list(records['price']) == [0.5, 1.5, 2.5]
+    assert list(records['msgid']) == [TICK_PRICE] * 3
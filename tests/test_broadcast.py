@@ -0,0 +1,32 @@
+from ibzmq.broadcast import topic, message_topic, message_frame, message_source, encode
+from ibzmq.incoming import TICK_PRICE, ACCT_VALUE, ERR_MSG
+
+def test_topic():
+    assert topic(TICK_PRICE, 1042) == '01|1042|'
+    assert topic(TICK_PRICE) == '01|'
+    assert topic('45', '7') == '45|7|'
+
+def test_topic_prefix_does_not_match_other_ids():
+    assert not topic(TICK_PRICE, 10421).startswith(topic(TICK_PRICE, 1042))
+    assert topic(TICK_PRICE, 1042).startswith(topic(TICK_PRICE))
+
+def test_message_topic():
+    assert message_topic((TICK_PRICE, 6, '1042', '1', '1.25', '100', '1')) == '01|1042|'
+    assert message_topic((ERR_MSG, 2, '-1', '2104', 'Market data farm OK')) == '04|-1|'
+    assert message_topic((ACCT_VALUE, 2, 'CashBalance', '100', 'USD', 'DU1')) == '06|'
+
+def test_message_frame():
+    assert message_frame(['1\x006\x00']) == '1\x006\x00'
+    assert message_frame(['01|1042|', '1\x006\x00']) == '1\x006\x00'
+
+def test_source_frame():
+    message = (TICK_PRICE, 6, '1042', '1', '1.25', '100', '1')
+    frames = encode(message, source='data1')
+    assert frames == ['data1', '1\x006\x001042\x001\x001.25\x00100\x001\x00']
+    assert message_source(frames) == 'data1'
+    frames = encode(message, topics=True, source='data1')
+    assert frames[0] == '01|1042|'
+    assert message_source(frames, topics=True) == 'data1'
+    assert message_frame(frames) == frames[-1]
+    assert message_source([encode(message)]) is None
+    assert message_source(encode(message, topics=True), topics=True) is None
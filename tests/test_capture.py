@@ -0,0 +1,125 @@
+import os
+
+from py.test import raises
+
+from ibzmq.capture import CaptureWriter, CaptureReader, CaptureRecord, NO_ID, message_id
+from ibzmq.framing import join_fields
+from ibzmq.incoming import TICK_PRICE, TICK_SIZE, ACCT_VALUE
+
+def tick_price(tickerid, price):
+    return join_fields([TICK_PRICE, 6, tickerid, 1, price, 100, 1])
+
+def tick_size(tickerid, size):
+    return join_fields([TICK_SIZE, 6, tickerid, 0, size])
+
+ACCOUNT = join_fields([ACCT_VALUE, 2, 'CashBalance', '100', 'USD', 'DU1'])
+
+def write_capture(directory, segment_size=1024):
+    writer = CaptureWriter(directory, segment_size=segment_size)
+    records = []
+    for i in xrange(100):
+        for type, content in ((TICK_PRICE, tick_price(i % 4, i)),
+                              (TICK_SIZE, tick_size(i % 4, i)),
+                              (ACCT_VALUE, ACCOUNT)):
+            t_ns = i * 1000 + len(records)
+            writer.write_ns(type, content, t_ns)
+            records.append(CaptureRecord(t_ns, type, message_id(type, content), content))
+    writer.close()
+    return records
+
+def test_message_id():
+    assert message_id(TICK_PRICE, tick_price(1042, 1)) == 1042
+    assert message_id(ACCT_VALUE, ACCOUNT) == NO_ID
+
+def test_round_trip_across_segments(tmpdir):
+    directory = str(tmpdir.join('capture'))
+    records = write_capture(directory)
+    assert len([name for name in os.listdir(directory) if name.endswith('.cap')]) > 1
+
+    reader = CaptureReader(directory)
+    assert list(reader) == records
+    reader.close()
+
+def test_read_time_range(tmpdir):
+    directory = str(tmpdir.join('capture'))
+    records = write_capture(directory)
+    start, end = 20000, 40000
+
+    reader = CaptureReader(directory)
+    assert list(reader.read(start, end)) == [r for r in records if start <= r.time < end]
+
+def test_read_types_and_ids(tmpdir):
+    directory = str(tmpdir.join('capture'))
+    records = write_capture(directory)
+
+    reader = CaptureReader(directory)
+    assert list(reader.read(types=[TICK_SIZE], ids=[3])) == \
+           [r for r in records if r.type == TICK_SIZE and r.id == 3]
+    assert list(reader.read(start=50000, types=[ACCT_VALUE])) == \
+           [r for r in records if r.type == ACCT_VALUE and r.time >= 50000]
+
+def test_segment_positions(tmpdir):
+    directory = str(tmpdir.join('capture'))
+    records = write_capture(directory, segment_size=1 << 20)
+
+    segment = CaptureReader(directory).segments[0]
+    positions = segment.positions(start=20000, end=60000, types=[TICK_PRICE], ids=[1, 2])
+    assert positions.tolist() == [i for i, r in enumerate(records)
+                                  if 20000 <= r.time < 60000 and r.type == TICK_PRICE and r.id in (1, 2)]
+
+def test_reads_live_capture(tmpdir):
+    directory = str(tmpdir.join('capture'))
+    writer = CaptureWriter(directory)
+    assert list(CaptureReader(directory)) == []
+
+    writer.write_ns(TICK_PRICE, tick_price(1, 1), 1000)
+    writer.close()
+    assert [r.id for r in CaptureReader(directory)] == [1]
+
+def test_reopen_appends_segment(tmpdir):
+    directory = str(tmpdir.join('capture'))
+    first = write_capture(directory, segment_size=1 << 20)
+    second = write_capture(directory, segment_size=1 << 20)
+    assert list(CaptureReader(directory)) == first + second
+
+def test_rejects_foreign_segment(tmpdir):
+    tmpdir.join('000000.cap').write('not a capture')
+    tmpdir.join('000000.idx').write('')
+    with raises(ValueError):
+        CaptureReader(str(tmpdir))
+
+def test_segment_contents(tmpdir):
+    import numpy
+    directory = str(tmpdir.join('capture'))
+    records = write_capture(directory)
+
+    reader = CaptureReader(directory)
+    contents = []
+    for segment in reader.segments:
+        contents += segment.contents(numpy.arange(segment.count))
+        assert segment.contents(numpy.array([0, segment.count - 1])) == \
+               [segment.content(segment.entry(i)[1]) for i in (0, segment.count - 1)]
+    assert contents == [r.content for r in records]
+    reader.close()
+
+def test_writes_index_after_data(tmpdir):
+    directory = str(tmpdir.join('capture'))
+    writer = CaptureWriter(directory)
+    for i in xrange(10):
+        writer.write_ns(TICK_PRICE, tick_price(1, i), i)
+    assert list(CaptureReader(directory)) == []
+
+    writer.flush()
+    assert [r.time for r in CaptureReader(directory)] == range(10)
+    writer.close()
+
+def test_ignores_entries_past_data(tmpdir):
+    directory = str(tmpdir.join('capture'))
+    records = write_capture(directory, segment_size=1 << 20)
+    data = tmpdir.join('capture', '000000.cap')
+    data.write(data.read('rb')[:-len(records[-1].content)], 'wb')
+
+    reader = CaptureReader(directory)
+    assert reader.segments[0].count == len(records) - 1
+    assert list(reader) == records[:-1]
+    reader.close()
@@ -0,0 +1,77 @@
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransport
+from txzmq import ZmqFactory, ZmqEndpoint, ZmqEndpointType
+
+from ibzmq.conflation import Conflator
+from ibzmq.framing import join_fields
+from ibzmq.incoming import TICK_PRICE, TICK_SIZE, TICK_SNAPSHOT_END, ORDER_STATUS
+from ibzmq.metrics import Metrics
+from ibzmq.pool import ConnectionPool, Connection
+from ibzmq.proxy import IBTWSProtocol, ZmqRequests
+
+from test_framing import HANDSHAKE, FakeBroadcast
+
+def tick_price(tickerid, ticktype, price):
+    return (TICK_PRICE, 6, str(tickerid), str(ticktype), price, '100', '1')
+
+def tick_size(tickerid, ticktype, size):
+    return (TICK_SIZE, 6, str(tickerid), str(ticktype), size)
+
+ORDER = (ORDER_STATUS, 6, '7', 'Filled') + ('',) * 8
+
+def conflator(interval=0):
+    published, clock = [], Clock()
+    return Conflator(published.append, interval, clock), published, clock
+
+def test_keeps_latest_per_ticker_and_tick_type():
+    c, published, clock = conflator()
+    c.add(tick_price(1, 1, '1.00'))
+    c.add(tick_price(2, 1, '2.00'))
+    c.add(tick_price(1, 1, '1.25'))
+    c.add(tick_size(1, 1, '300'))
+    assert published == []
+
+    clock.advance(0)
+    assert published == [tick_price(1, 1, '1.25'), tick_price(2, 1, '2.00'), tick_size(1, 1, '300')]
+    assert c.stats() == {'received': 4, 'merged': 1, 'flushed': 3, 'pending': 0}
+
+def test_flushes_on_interval():
+    c, published, clock = conflator(0.5)
+    c.add(tick_price(1, 1, '1.00'))
+    clock.advance(0.4)
+    assert published == []
+    clock.advance(0.1)
+    assert published == [tick_price(1, 1, '1.00')]
+
+def test_order_messages_pass_through_immediately():
+    c, published, clock = conflator(1)
+    c.add(tick_price(1, 1, '1.00'))
+    c.add(ORDER)
+    c.add(ORDER)
+    assert published == [ORDER, ORDER]
+
+    clock.advance(1)
+    assert published == [ORDER, ORDER, tick_price(1, 1, '1.00')]
+
+def test_snapshot_end_flushes_pending():
+    c, published, clock = conflator(1)
+    end = (TICK_SNAPSHOT_END, 1, '1')
+    c.add(tick_price(1, 1, '1.00'))
+    c.add(end)
+    assert published == [tick_price(1, 1, '1.00'), end]
+    assert not clock.getDelayedCalls()
+
+def test_reported_in_metrics():
+    factory = ZmqFactory()
+    requests = ZmqRequests(factory, ZmqEndpoint(ZmqEndpointType.bind, 'inproc://conflation'))
+    requests.setPool(ConnectionPool([Connection(None, '127.0.0.1', 4002, 0)]))
+    requests.setMetrics(Metrics())
+    protocol = IBTWSProtocol(requests, FakeBroadcast(), conflation=0)
+    protocol.makeConnection(StringTransport())
+    protocol.dataReceived(HANDSHAKE + join_fields(tick_price(1, 1, '1.00')) + join_fields(tick_price(1, 1, '1.25')))
+
+    assert requests.metricsReport()['conflation'] == {
+        'default': {'received': 2, 'merged': 1, 'flushed': 0, 'pending': 1},
+    }
+    protocol._conflator.flush()
+    factory.shutdown()
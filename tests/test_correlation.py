@@ -0,0 +1,99 @@
+from py.test import raises
+
+from ibzmq.framing import join_fields
+from ibzmq.incoming import (CONTRACT_DATA, CONTRACT_DATA_END, TICK_PRICE, TICK_SNAPSHOT_END,
+                            ERR_MSG, ORDER_STATUS, HISTORICAL_DATA)
+from ibzmq.outgoing import (REQ_CONTRACT_DATA, REQ_MKT_DATA, CANCEL_MKT_DATA,
+                            PLACE_ORDER, CANCEL_ORDER, REQ_IDS, REQ_HISTORICAL_DATA)
+from ibzmq.correlation import RequestCorrelator
+
+UPSTREAM = 100
+
+def correlator():
+    return RequestCorrelator(first_id=UPSTREAM)
+
+def req_mkt_data(id, snapshot=0):
+    return join_fields([REQ_MKT_DATA, 9, id, 0, 'AAPL', 'STK', '', '0.0', '', '', 'SMART', '', 'USD', '', '', 0, '', snapshot])
+
+def req_contract_data(id):
+    return join_fields([REQ_CONTRACT_DATA, 6, id, 0, 'AAPL', 'STK', '', '0.0', '', '', 'SMART', 'USD', '', 0, '', ''])
+
+def test_requests_get_unique_ids():
+    c = correlator()
+    assert c.outgoing('a', 'm1', req_contract_data(1)) == [req_contract_data(UPSTREAM)]
+    assert c.outgoing('b', 'm2', req_contract_data(1)) == [req_contract_data(UPSTREAM + 1)]
+
+def test_replies_tracked_until_end():
+    c = correlator()
+    c.outgoing('a', 'm1', req_contract_data(7))
+    assert c.incoming((CONTRACT_DATA, 8, str(UPSTREAM), 'AAPL')) == ('a', 'm1', (CONTRACT_DATA, 8, '7', 'AAPL'))
+    assert c.incoming((CONTRACT_DATA_END, 1, str(UPSTREAM))) == ('a', 'm1', (CONTRACT_DATA_END, 1, '7'))
+    assert c.incoming((CONTRACT_DATA, 8, str(UPSTREAM), 'AAPL')) is None
+
+def test_untracked_messages_ignored():
+    c = correlator()
+    c.outgoing('a', 'm1', req_contract_data(7))
+    assert c.incoming((CONTRACT_DATA, 8, '7', 'AAPL')) is None
+    assert c.incoming((ERR_MSG, 2, '-1', '2104', 'Market data farm connection is OK')) is None
+
+def test_errors_end_requests_but_warnings_do_not():
+    c = correlator()
+    c.outgoing('a', 'm1', join_fields([REQ_HISTORICAL_DATA, 4, 7, 'AAPL']))
+    assert c.incoming((ERR_MSG, 2, str(UPSTREAM), '2106', 'HMDS data farm connection is OK'))[2][2] == '7'
+    assert c.incoming((ERR_MSG, 2, str(UPSTREAM), '162', 'No data'))[2][2] == '7'
+    assert c.incoming((HISTORICAL_DATA, 3, str(UPSTREAM))) is None
+
+def test_errors_end_subscriptions_and_orders():
+    c = correlator()
+    c.outgoing('a', 'm1', req_mkt_data(7))
+    assert c.incoming((ERR_MSG, 2, str(UPSTREAM), '200', 'No security definition'))[2][2] == '7'
+    assert c.incoming((TICK_PRICE, 6, str(UPSTREAM), 1, '1.0', 100, 1)) is None
+
+    c.outgoing('a', 'm2', join_fields([PLACE_ORDER, 35, 42, 0, 'AAPL']))
+    assert c.incoming((ERR_MSG, 2, '42', '399', 'Order message'))[2][2] == '42'
+    assert c.incoming((ERR_MSG, 2, '42', '201', 'Order rejected'))[2][2] == '42'
+    assert len(c) == 0
+
+def test_subscriptions_tracked_until_cancelled():
+    c = correlator()
+    c.outgoing('a', 'm1', req_mkt_data(7))
+    assert c.incoming((ERR_MSG, 2, str(UPSTREAM), '10167', 'Displaying delayed market data')) is not None
+    assert c.incoming((TICK_PRICE, 6, str(UPSTREAM), '1', '1.25', '100', '1'))[2][2] == '7'
+    assert c.outgoing('a', 'm2', join_fields([CANCEL_MKT_DATA, 1, 7])) == [join_fields([CANCEL_MKT_DATA, 1, UPSTREAM])]
+    assert c.incoming((TICK_PRICE, 6, str(UPSTREAM), '1', '1.25', '100', '1')) is None
+    assert c.outgoing('a', 'm3', join_fields([CANCEL_MKT_DATA, 1, 7])) == []
+
+def test_snapshots_end_by_themselves():
+    c = correlator()
+    c.outgoing('a', 'm1', req_mkt_data(7, snapshot=1))
+    assert c.incoming((TICK_SNAPSHOT_END, 1, str(UPSTREAM))) is not None
+    assert len(c) == 0
+
+def test_reused_id_replaces_request():
+    c = correlator()
+    c.outgoing('a', 'm1', req_mkt_data(7))
+    assert c.outgoing('a', 'm2', req_mkt_data(7)) == [join_fields([CANCEL_MKT_DATA, 1, UPSTREAM]), req_mkt_data(UPSTREAM + 1)]
+    assert c.incoming((TICK_PRICE, 6, str(UPSTREAM + 1), '1', '1.25', '100', '1'))[:2] == ('a', 'm2')
+    assert len(c) == 1
+
+def test_orders_keep_their_id():
+    c = correlator()
+    order = join_fields([PLACE_ORDER, 35, 12, 0, 'AAPL'])
+    assert c.outgoing('a', 'm1', order) == [order]
+    assert c.outgoing('a', 'm2', join_fields([CANCEL_ORDER, 1, 12])) == [join_fields([CANCEL_ORDER, 1, 12])]
+    assert c.incoming((ORDER_STATUS, 6, '12', 'PreSubmitted')) == ('a', 'm1', (ORDER_STATUS, 6, '12', 'PreSubmitted'))
+    assert c.incoming((ORDER_STATUS, 6, '12', 'Cancelled')) is not None
+    assert c.incoming((ORDER_STATUS, 6, '12', 'Cancelled')) is None
+
+def test_discard():
+    c = correlator()
+    c.outgoing('a', 'm1', req_contract_data(7))
+    c.discard('m1')
+    assert c.incoming((CONTRACT_DATA_END, 1, str(UPSTREAM))) is None
+    assert len(c) == 0
+
+def test_untrackable_requests_rejected():
+    with raises(ValueError):
+        correlator().outgoing('a', 'm1', join_fields([REQ_IDS, 1, 1]))
+    with raises(ValueError):
+        correlator().outgoing('a', 'm1', join_fields([REQ_CONTRACT_DATA, 6]))
@@ -0,0 +1,115 @@
+from twisted.internet.error import ConnectionLost
+from twisted.python.failure import Failure
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransport
+from txzmq import ZmqFactory, ZmqEndpoint, ZmqEndpointType
+
+from ibzmq.depth import (DepthEngine, BookSide, parse_book,
+                         INSERT, UPDATE, DELETE, BID, ASK)
+from ibzmq.framing import join_fields
+from ibzmq.incoming import MARKET_DEPTH, MARKET_DEPTH_L2, BOOK_SNAPSHOT, BOOK_DIFF
+from ibzmq.outgoing import CANCEL_MKT_DEPTH
+from ibzmq.pool import ConnectionPool, Connection
+from ibzmq.proxy import IBTWSProtocol, ZmqRequests
+
+from test_framing import HANDSHAKE, FakeRequests, FakeBroadcast
+
+def depth(id, position, operation, side, price, size):
+    return (MARKET_DEPTH, 1, str(id), str(position), str(operation), str(side), price, str(size))
+
+def depth_l2(id, position, maker, operation, side, price, size):
+    return (MARKET_DEPTH_L2, 1, str(id), str(position), maker, str(operation), str(side), price, str(size))
+
+def engine(**kwargs):
+    clock, published = Clock(), []
+    return DepthEngine(published.append, clock=clock, **kwargs), published, clock
+
+def test_book_side_operations():
+    side = BookSide()
+    side.apply(INSERT, 0, 1.0, 100)
+    side.apply(INSERT, 0, 1.1, 200)
+    side.apply(INSERT, 2, 0.9, 300)
+    assert side.levels(10) == [(1.1, 200, ''), (1.0, 100, ''), (0.9, 300, '')]
+    side.apply(UPDATE, 1, 1.0, 150)
+    side.apply(DELETE, 0, 0, 0)
+    assert side.levels(10) == [(1.0, 150, ''), (0.9, 300, '')]
+    assert side.levels(1) == [(1.0, 150, '')]
+
+def test_publishes_throttled_snapshots():
+    e, published, clock = engine(rows=2, interval=0.1)
+    e.add(depth(7, 0, INSERT, BID, '1.00', 100))
+    e.add(depth(7, 1, INSERT, BID, '0.99', 200))
+    e.add(depth(7, 2, INSERT, BID, '0.98', 300))
+    e.add(depth(7, 0, INSERT, ASK, '1.01', 400))
+    assert published == []
+
+    clock.advance(0.1)
+    assert published == [(BOOK_SNAPSHOT, 1, 7, 2, '1.0', 100, '', '0.99', 200, '', 1, '1.01', 400, '')]
+    clock.advance(1)
+    assert len(published) == 1
+
+def test_publishes_diffs():
+    e, published, clock = engine(interval=0, diffs=True)
+    e.add(depth_l2(7, 0, 'ISLAND', INSERT, BID, '1.00', 100))
+    e.add(depth_l2(7, 1, 'ARCA', INSERT, BID, '0.99', 200))
+    clock.advance(0)
+    e.add(depth_l2(7, 1, 'ARCA', UPDATE, BID, '0.99', 250))
+    e.add(depth_l2(7, 0, 'ISLAND', DELETE, BID, '1.00', 100))
+    clock.advance(0)
+    assert published == [
+        (BOOK_DIFF, 1, 7, 2, BID, 0, '1.0', 100, 'ISLAND', BID, 1, '0.99', 200, 'ARCA'),
+        (BOOK_DIFF, 1, 7, 2, BID, 0, '0.99', 250, 'ARCA', BID, 1, '0.0', 0, ''),
+    ]
+
+def test_parse_book():
+    e, published, clock = engine(interval=0)
+    e.add(depth(7, 0, INSERT, BID, '1.00', 100))
+    e.add(depth(7, 0, INSERT, ASK, '1.01', 400))
+    clock.advance(0)
+    fields = join_fields(published[0]).split('\0')[:-1]
+    assert parse_book(fields) == (7, {BID: [(1.0, 100, '')], ASK: [(1.01, 400, '')]})
+    assert parse_book(join_fields((BOOK_DIFF, 1, 7, 1, ASK, 0, '1.01', 0, '')).split('\0')[:-1]) == \
+        (7, [(ASK, 0, 1.01, 0, '')])
+
+def test_books_kept_per_ticker():
+    e, published, clock = engine(interval=0)
+    e.add(depth(7, 0, INSERT, BID, '1.00', 100))
+    e.add(depth(8, 0, INSERT, BID, '2.00', 100))
+    clock.advance(0)
+    assert [m[2] for m in published] == [7, 8]
+    assert e.book(8)[BID] == [(2.0, 100, '')]
+    e.reset(8)
+    assert e.book(8) == {BID: [], ASK: []}
+
+def test_malformed_update_ignored():
+    e, published, clock = engine(interval=0)
+    e.add(depth(7, 0, INSERT, BID, 'x', 100))
+    clock.advance(0)
+    assert published == []
+
+def test_proxy_publishes_books_in_place_of_updates():
+    broadcast = FakeBroadcast()
+    protocol = IBTWSProtocol(FakeRequests(), broadcast, depth={'interval': 0, 'clock': Clock()},
+                             depth_passthrough=False)
+    protocol.makeConnection(StringTransport())
+    protocol.dataReceived(HANDSHAKE + join_fields(depth(7, 0, INSERT, BID, '1.00', 100)))
+    assert broadcast.sent == []
+    protocol._depth.flush()
+    assert broadcast.sent == [join_fields((BOOK_SNAPSHOT, 1, 7, 1, '1.0', 100, '', 0))]
+
+def test_proxy_discards_books_on_cancel_and_connection_loss():
+    factory = ZmqFactory()
+    requests = ZmqRequests(factory, ZmqEndpoint(ZmqEndpointType.bind, 'inproc://depth'))
+    requests.setPool(ConnectionPool([Connection(None, '127.0.0.1', 4002, 0)]))
+    protocol = IBTWSProtocol(requests, FakeBroadcast(), depth={'interval': 0, 'clock': Clock()})
+    protocol.makeConnection(StringTransport())
+    protocol.dataReceived(HANDSHAKE + join_fields(depth(7, 0, INSERT, BID, '1.00', 100)) +
+                          join_fields(depth(8, 0, INSERT, BID, '2.00', 100)))
+
+    requests.submitRequest(None, join_fields([CANCEL_MKT_DEPTH, 1, 7]))
+    assert protocol._depth.book(7) == {BID: [], ASK: []}
+    assert protocol._depth.book(8)[BID] == [(2.0, 100, '')]
+
+    protocol.connectionLost(Failure(ConnectionLost()))
+    assert protocol._depth.book(8) == {BID: [], ASK: []}
+    factory.shutdown()
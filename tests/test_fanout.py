@@ -0,0 +1,152 @@
+import json
+
+import zmq
+
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransport
+from txzmq import ZmqFactory, ZmqEndpoint, ZmqEndpointType
+
+from ibzmq.bars import parse_bar
+from ibzmq.binary import unpack
+from ibzmq.broadcast import topic
+from ibzmq.fanout import FanoutWorker, FanoutPipe, WorkerProcess, derived_options, ready_topic
+from ibzmq.framing import join_fields
+from ibzmq.incoming import TICK_PRICE, TICK_SIZE, MARKET_DEPTH, BOOK_SNAPSHOT, PROXY_METRICS, CONNECTION_STATUS
+
+from test_framing import FakeBroadcast
+
+class FakeConfig(dict):
+    def __init__(self, **overrides):
+        dict.__init__(self, {
+            'conflation.enabled': False, 'conflation.interval': 0,
+            'depth.enabled': False, 'depth.rows': 10, 'depth.interval': 0.1,
+            'depth.diffs': False, 'depth.passthrough': True,
+            'bars.enabled': False, 'bars.intervals': [1, 60],
+        })
+        self.update(overrides)
+
+def worker(**options):
+    clock = Clock()
+    clock.advance(1000)
+    broadcast = FakeBroadcast()
+    return FanoutWorker(broadcast, 2, clock=clock, **options), broadcast, clock
+
+def tick_price(id, price, size):
+    return join_fields([TICK_PRICE, 6, id, 4, price, size, 0])
+
+def tick_size(id, size):
+    return join_fields([TICK_SIZE, 6, id, 5, size])
+
+def test_derived_options():
+    assert derived_options(FakeConfig()) == \
+           { 'conflation': None, 'depth': None, 'depth_passthrough': True, 'bars': None }
+    options = derived_options(FakeConfig(**{ 'depth.enabled': True, 'bars.enabled': True, 'conflation.enabled': True }))
+    assert options['conflation'] == 0
+    assert options['depth'] == { 'rows': 10, 'interval': 0.1, 'diffs': False }
+    assert options['bars'] == { 'intervals': [1, 60] }
+
+def test_passes_messages_through():
+    fanout, broadcast, _ = worker()
+    fanout.add([tick_price(7, '10.5', 3)])
+    assert broadcast.sent == [tick_price(7, '10.5', 3)]
+
+def test_encodes_with_topics_and_source():
+    fanout, broadcast, _ = worker(topics=True, binary=True)
+    fanout.add(['data1', tick_size(7, 3)])
+    assert broadcast.sent[0][:2] == [topic(TICK_SIZE, 7), 'data1']
+    assert unpack(broadcast.sent[0][2]) == (TICK_SIZE, 6, 7, 5, 3)
+
+def test_builds_bars():
+    fanout, broadcast, clock = worker(bars={ 'intervals': (1,) })
+    fanout.add([tick_price(7, '10.0', 1)])
+    fanout.add([tick_size(7, 1)])
+    clock.advance(1)
+    assert parse_bar(broadcast.sent[-1].split('\0')) == ('7', 1, 1000, 10.0, 10.0, 10.0, 10.0, 1, 1)
+    assert fanout.received == 2
+    assert fanout.published == 3
+
+def test_stage_per_source():
+    fanout, broadcast, clock = worker(depth={ 'rows': 5, 'interval': 0.1 }, depth_passthrough=False)
+    update = join_fields([MARKET_DEPTH, 1, 7, 0, 0, 1, '10.0', 100])
+    fanout.add(['data1', update])
+    fanout.add(['data2', update])
+    clock.advance(0.1)
+    assert sorted(frames[0] for frames in broadcast.sent) == ['data1', 'data2']
+    assert all(frames[1].startswith('{0}\0'.format(BOOK_SNAPSHOT)) for frames in broadcast.sent)
+
+def test_books_discarded_on_connection_status():
+    fanout, broadcast, clock = worker(depth={ 'rows': 5, 'interval': 0.1 }, depth_passthrough=False)
+    fanout.add(['data1', join_fields([MARKET_DEPTH, 1, 7, 0, 0, 1, '10.0', 100])])
+    fanout.add(['data1', join_fields([CONNECTION_STATUS, 1, 'DISCONNECTED', 'data1', 0, 0])])
+    fanout.add(['data1', join_fields([MARKET_DEPTH, 1, 7, 0, 0, 1, '11.0', 200])])
+    clock.advance(0.1)
+    assert [frames[1] for frames in broadcast.sent][-1] == join_fields((BOOK_SNAPSHOT, 1, 7, 1, '11.0', 200, '', 0))
+
+def test_conflates():
+    fanout, broadcast, clock = worker(conflation=0.5)
+    for size in xrange(5):
+        fanout.add([tick_size(7, size)])
+    assert broadcast.sent == []
+    clock.advance(0.5)
+    assert broadcast.sent == [tick_size(7, 4)]
+    assert fanout.stats()['conflation'] == {'default': {'received': 5, 'merged': 4, 'flushed': 1, 'pending': 0}}
+
+def test_skips_malformed_messages():
+    fanout, broadcast, _ = worker()
+    fanout.add(['garbage\0'])
+    assert broadcast.sent == []
+    assert fanout.received == 1
+
+def test_stats():
+    fanout, broadcast, clock = worker()
+    for size in xrange(10):
+        fanout.add([tick_size(7, size)])
+    clock.advance(5)
+    fanout.publishStats()
+
+    stats = json.loads(broadcast.sent[-1].split('\0')[2])
+    assert broadcast.sent[-1].startswith('{0}\0'.format(PROXY_METRICS))
+    assert stats == { 'worker': 2, 'received': 10, 'published': 10, 'interval': 5,
+                      'received_rate': 2.0, 'published_rate': 2.0 }
+    clock.advance(5)
+    assert fanout.stats()['received_rate'] == 0.0
+
+class FakeWorkerProcess(object):
+    def __init__(self):
+        self.pids = []
+
+    def subscribed(self, pid):
+        self.pids.append(pid)
+
+def test_pipe_sees_workers_subscribe():
+    factory = ZmqFactory()
+    pipe = FanoutPipe(factory)
+    pipe.addEndpoints([ZmqEndpoint(ZmqEndpointType.bind, 'inproc://pipe')])
+    process = pipe.workers[1] = FakeWorkerProcess()
+
+    s = factory.context.socket(zmq.SUB)
+    s.setsockopt(zmq.LINGER, 0)
+    s.setsockopt(zmq.SUBSCRIBE, '')
+    s.setsockopt(zmq.SUBSCRIBE, ready_topic(1, 42))
+    s.setsockopt(zmq.SUBSCRIBE, ready_topic(5, 43))
+    s.connect('inproc://pipe')
+    pipe.doRead()
+    assert process.pids == [42]
+
+    pipe.send(tick_size(7, 100))
+    assert s.recv() == tick_size(7, 100)
+    s.close()
+    factory.shutdown()
+
+def test_worker_ready_once_subscribed():
+    process = WorkerProcess('config.yaml', 0)
+    process.transport = StringTransport()
+    process.transport.pid = 42
+    ready = []
+    process.ready.addCallback(ready.append)
+    process.subscribed(41)
+    assert ready == []
+    process.subscribed(42)
+    assert ready == [process]
+    # Again after a restart.
+    process.subscribed(42)
@@ -0,0 +1,74 @@
+from twisted.test.proto_helpers import StringTransport
+
+from ibzmq.broadcast import message_topic
+from ibzmq.framing import FieldSplitter, join_fields
+from ibzmq.proxy import IBTWSProtocol
+
+HANDSHAKE = join_fields([76, '20121018 10:00:00 EST'])
+
+MESSAGES = [
+    (1, 6, 1042, 1, '1.25', 100, 1),
+    (2, 6, 1042, 0, 300),
+    (53, 1),
+    (9, 1, 3),
+    (17, 3, 7, '20121018', '20121019', 2,
+        '20121018', '1.0', '1.5', '0.5', '1.25', 100, '1.2', 'false', 4,
+        '20121019', '1.25', '1.75', '1.0', '1.5', 200, '1.4', 'false', 8),
+    (45, 6, 1042, 49, '0.0'),
+]
+
+STREAM = HANDSHAKE + ''.join(join_fields(m) for m in MESSAGES)
+
+class FakeRequests(object):
+    def setTWSProtocol(self, protocol):
+        self.protocol = protocol
+
+class FakeBroadcast(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+def feed(chunks, table_decoding=True, topics=False):
+    broadcast = FakeBroadcast()
+    protocol = IBTWSProtocol(FakeRequests(), broadcast, topics=topics)
+    protocol.table_decoding = table_decoding
+    protocol.makeConnection(StringTransport())
+    for chunk in chunks:
+        protocol.dataReceived(chunk)
+    return broadcast.sent
+
+def test_split_complete_fields():
+    splitter = FieldSplitter()
+    assert splitter.split('a\0b\0') == ['a', 'b']
+    assert splitter.partial == ''
+
+def test_split_carries_partial_field():
+    splitter = FieldSplitter()
+    assert splitter.split('a\0b') == ['a']
+    assert splitter.partial == 'b'
+    assert splitter.split('c\0\0d') == ['bc', '']
+    assert splitter.split('\0') == ['d']
+
+def test_split_empty_chunk():
+    splitter = FieldSplitter()
+    assert splitter.split('') == []
+    assert splitter.split('x') == []
+    assert splitter.split('') == []
+    assert splitter.partial == 'x'
+
+def test_publishes_each_message():
+    sent = feed([STREAM])
+    assert sent == [join_fields(m) for m in MESSAGES]
+
+def test_publishes_topic_frames():
+    sent = feed([STREAM], topics=True)
+    assert sent == [[message_topic(m), join_fields(m)] for m in MESSAGES]
+
+def test_output_independent_of_chunking():
+    expected = feed([STREAM])
+    for size in (1, 2, 3, 7, 64):
+        chunks = [STREAM[i:i+size] for i in xrange(0, len(STREAM), size)]
+        assert feed(chunks) == expected
+        assert feed(chunks, table_decoding=False) == expected
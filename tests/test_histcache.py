@@ -0,0 +1,129 @@
+from ibzmq.framing import join_fields
+from ibzmq.histcache import HistoricalDataCache, is_forming
+from ibzmq.incoming import HISTORICAL_DATA, ERR_MSG
+from ibzmq.outgoing import REQ_HISTORICAL_DATA, CANCEL_HISTORICAL_DATA, REQ_MKT_DATA
+
+NOW = 1350550000.0
+
+class Timer(object):
+    def __init__(self):
+        self.now = NOW
+
+    def __call__(self):
+        return self.now
+
+def request(id, symbol='AAPL', end='20121017 16:00:00'):
+    return join_fields([REQ_HISTORICAL_DATA, 4, id, symbol, 'STK', '', '0.0', '', '', 'SMART', '', 'USD', '', 0,
+                        end, '1 day', '1 W', 1, 'TRADES', 1])
+
+def bars(id, count=2):
+    fields = (HISTORICAL_DATA, 3, str(id), '20121010', '20121017', str(count))
+    for i in xrange(count):
+        fields += ('2012101{0}'.format(i), '1.0', '1.5', '0.5', '1.25', '100', '1.2', 'false', '4')
+    return fields
+
+def cache(**kwargs):
+    timer = Timer()
+    return HistoricalDataCache(':memory:', timer=timer, **kwargs), timer
+
+def test_repeated_request_answered_from_cache():
+    c, timer = cache()
+    assert c.request(request(1)) is None
+    c.received(bars(1))
+    assert c.request(request(2)) == bars(2)
+    assert c.request(request(3, 'MSFT')) is None
+    assert (c.hits, c.misses) == (1, 2)
+
+def test_only_pending_results_cached():
+    c, timer = cache()
+    c.received(bars(1))
+    assert c.size == 0
+    c.request(request(1))
+    c.received((ERR_MSG, 2, '1', '162', 'Historical market data Service error message'))
+    c.received(bars(1))
+    assert c.size == 0
+
+def test_cancelled_request_not_cached():
+    c, timer = cache()
+    c.request(request(1))
+    c.request(join_fields([CANCEL_HISTORICAL_DATA, 1, 1]))
+    c.received(bars(1))
+    assert c.request(request(2)) is None
+
+def test_forming_bars_expire():
+    c, timer = cache(ttl=60)
+    c.request(request(1, end=''))
+    c.received(bars(1))
+    timer.now += 59
+    assert c.request(request(2, end='')) == bars(2)
+    timer.now += 2
+    assert c.request(request(3, end='')) is None
+    assert c.size == 0
+
+def test_is_forming():
+    assert is_forming(request(1, end='').split('\0')[:-1], NOW)
+    assert is_forming(request(1, end='20991231 16:00:00 EST').split('\0')[:-1], NOW)
+    assert not is_forming(request(1, end='20121017 16:00:00 EST').split('\0')[:-1], NOW)
+
+def test_evicts_least_recently_used():
+    size = len(join_fields(bars(1)))
+    c, timer = cache(max_size=2 * size)
+    for id, symbol in enumerate(('A', 'B', 'C')):
+        timer.now += 1
+        c.request(request(id, symbol))
+        c.received(bars(id))
+        if symbol == 'B':
+            timer.now += 1
+            c.request(request(9, 'A'))
+    assert c.evictions == 1
+    assert c.request(request(10, 'A')) is not None
+    assert c.request(request(11, 'B')) is None
+    assert c.size == 2 * size
+
+def test_ignores_other_requests():
+    c, timer = cache()
+    assert c.request(join_fields([REQ_MKT_DATA, 9, 1, 'AAPL'])) is None
+    assert c.misses == 0
+
+def test_persists_between_instances(tmpdir):
+    path = str(tmpdir.join('histcache.db'))
+    c = HistoricalDataCache(path, timer=Timer())
+    c.request(request(1))
+    c.received(bars(1))
+    c.close()
+    c = HistoricalDataCache(path, timer=Timer())
+    assert c.size == len(join_fields(bars(1)))
+    assert c.request(request(2)) == bars(2)
+
+def test_hits_written_with_next_result(tmpdir):
+    import sqlite3
+    path = str(tmpdir.join('histcache.db'))
+    timer = Timer()
+    c = HistoricalDataCache(path, timer=timer)
+    c.request(request(1))
+    c.received(bars(1))
+    timer.now += 10
+    assert c.request(request(2)) == bars(2)
+
+    def used():
+        db = sqlite3.connect(path)
+        try:
+            return db.execute('SELECT used FROM historical').fetchone()[0]
+        finally:
+            db.close()
+    assert used() == NOW
+    c.close()
+    assert used() == NOW + 10
+
+def test_pending_cleared_on_connection_loss():
+    c, timer = cache()
+    c.request(request(1))
+    c.routed(request(1), 'a')
+    c.request(request(2, 'MSFT'))
+    c.routed(request(2, 'MSFT'), 'b')
+    c.clear_pending('a')
+    assert c.stats()['pending'] == 1
+    c.received(bars(1))
+    assert c.size == 0
+    c.received(bars(2))
+    assert c.size > 0
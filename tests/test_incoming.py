@@ -0,0 +1,81 @@
+from itertools import product
+
+from py.test import raises
+
+from ibzmq.incoming import (MESSAGE_PARSERS, MESSAGE_FIELD_COUNTS, MESSAGE_DECODERS,
+                            OPEN_ORDER, CONTRACT_DATA, HISTORICAL_DATA,
+                            BOND_CONTRACT_DATA, SCANNER_DATA, IB_MAX_DOUBLE,
+                            decode, parse)
+
+def filler(n, prefix='f'):
+    return tuple('{0}{1}'.format(prefix, i) for i in xrange(n))
+
+def open_order(delta_neutral, combo_legs, order_combo_legs, smart_combo_routing,
+               scale, hedge, undercomp, algo, algo_params):
+    fields = (OPEN_ORDER, 30) + filler(58)
+    fields += (delta_neutral, '0.0') + (filler(4, 'dn') if delta_neutral else ())
+    fields += filler(6, 's')
+    fields += ('', str(combo_legs)) + filler(8*combo_legs, 'cl')
+    fields += (str(order_combo_legs),) + filler(order_combo_legs, 'ocl')
+    fields += (str(smart_combo_routing),) + filler(2*smart_combo_routing, 'scr')
+    fields += ('', '', scale) + (filler(7, 'sc') if scale not in ('', '0.0', IB_MAX_DOUBLE) else ())
+    fields += (hedge,) + (('1',) if hedge else ())
+    fields += filler(4, 't')
+    fields += (str(undercomp),) + (filler(3, 'u') if undercomp else ())
+    fields += (algo,)
+    if algo:
+        fields += (str(algo_params),) + filler(2*algo_params, 'a')
+    return fields + filler(10, 'st')
+
+def variable_messages():
+    for delta_neutral, legs, scale, hedge, undercomp, algo in product(
+            ('', 'MKT'), (0, 2), ('', '0.0', IB_MAX_DOUBLE, '5.0'),
+            ('', 'D'), (0, 1), ('', 'Adaptive')):
+        yield open_order(delta_neutral, legs, legs, legs, scale, hedge, undercomp, algo, legs)
+
+    for secids in (0, 3):
+        yield (CONTRACT_DATA, 8) + filler(29) + (str(secids),) + filler(2*secids)
+    for bars in (0, 1, 5):
+        yield (HISTORICAL_DATA, 3) + filler(3) + (str(bars),) + filler(9*bars)
+    for secids in (0, 2):
+        yield (BOND_CONTRACT_DATA, 6) + filler(29) + (str(secids),) + filler(2*secids)
+    for results in (0, 4):
+        yield (SCANNER_DATA, 3, 'f0', str(results)) + filler(16*results)
+
+def fixed_messages():
+    for msgid, fieldcount in MESSAGE_FIELD_COUNTS.items():
+        yield (msgid, 1) + filler(fieldcount)
+
+def all_messages():
+    return list(fixed_messages()) + list(variable_messages())
+
+def test_every_parser_has_a_decoder():
+    assert set(MESSAGE_PARSERS) == set(MESSAGE_FIELD_COUNTS) | set(MESSAGE_DECODERS)
+    assert not set(MESSAGE_FIELD_COUNTS) & set(MESSAGE_DECODERS)
+
+def test_decoders_match_generators():
+    for message in all_messages():
+        assert decode(message) == (parse(message), len(message))
+
+def test_decode_incomplete():
+    for message in all_messages():
+        for length in xrange(len(message)):
+            assert decode(message[:length]) is None
+
+def test_decode_with_offset():
+    messages = all_messages()
+    stream = [field for message in messages for field in message]
+
+    offset = 0
+    for message in messages:
+        decoded, offset = decode(stream, offset)
+        assert decoded == parse(message)
+    assert offset == len(stream)
+
+def test_decode_unknown_message():
+    with raises(KeyError):
+        decode((999, 1, 'f0'))
+
+def test_open_order_version():
+    with raises(AssertionError):
+        decode((OPEN_ORDER, 29) + open_order('', 0, 0, 0, '', '', 0, '', 0)[2:])
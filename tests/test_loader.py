@@ -0,0 +1,104 @@
+import math
+
+from py.test import raises
+
+from ibzmq.capture import CaptureWriter
+from ibzmq.framing import join_fields
+from ibzmq.incoming import TICK_PRICE, TICK_SIZE, ACCT_VALUE, REAL_TIME_BARS
+from ibzmq.loader import load, load_chunks, decode, index_messages, write_columns, read_columns
+from ibzmq.msglog import connect, insert_messages
+
+def tick_price(tickerid, price):
+    return join_fields([TICK_PRICE, 6, tickerid, 4, price, 100, 1])
+
+def tick_size(tickerid, size):
+    return join_fields([TICK_SIZE, 6, tickerid, 5, size])
+
+ACCOUNT = join_fields([ACCT_VALUE, 2, 'CashBalance', '100', 'USD', 'DU1'])
+
+def messages():
+    for i in xrange(100):
+        yield 1000 + i, TICK_PRICE, tick_price(i % 4, 100 + i * 0.25)
+        yield 1000 + i, TICK_SIZE, tick_size(i % 4, i)
+        yield 1000 + i, ACCT_VALUE, ACCOUNT
+
+def write_sqlite(tmpdir):
+    database = str(tmpdir.join('log.db'))
+    db = connect(database)
+    insert_messages(db, messages())
+    index_messages(db)
+    db.close()
+    return database
+
+def write_capture(tmpdir):
+    directory = str(tmpdir.join('capture'))
+    writer = CaptureWriter(directory, segment_size=4096)
+    for t, type, content in messages():
+        writer.write(type, content, t)
+    writer.close()
+    return directory
+
+def logs(tmpdir):
+    return write_sqlite(tmpdir), write_capture(tmpdir)
+
+def test_decode():
+    array = decode([tick_price(7, 101.5), join_fields([TICK_PRICE, 6, 8, 4, '', '', 0])], [1.0, 2.0], TICK_PRICE)
+    assert list(array['logged']) == [1.0, 2.0]
+    assert list(array['version']) == [6, 6]
+    assert list(array['tickerId']) == [7, 8]
+    assert array['price'][0] == 101.5
+    assert math.isnan(array['price'][1])
+    assert list(array['size']) == [100, 0]
+
+def test_decode_bars():
+    bar = join_fields([REAL_TIME_BARS, 3, 7, 1350550000, '1.0', '1.5', '0.5', '1.25', 100, '1.2', 4])
+    array = decode([bar], [1350550005.0], REAL_TIME_BARS)
+    assert list(array['logged']) == [1350550005.0]
+    assert list(array['time']) == [1350550000]
+    assert list(array['close']) == [1.25]
+    assert list(array['count']) == [4]
+
+def test_decode_skips_other_versions():
+    array = decode([join_fields([TICK_PRICE, 1, 7, 4, 101.5]), tick_price(8, 102)], [1.0, 2.0], TICK_PRICE)
+    assert list(array['tickerId']) == [8]
+    assert list(array['logged']) == [2.0]
+
+def test_load(tmpdir):
+    for source in logs(tmpdir):
+        array = load(source, TICK_PRICE)
+        assert len(array) == 100
+        assert list(array['logged']) == range(1000, 1100)
+        assert list(array['price']) == [100 + i * 0.25 for i in xrange(100)]
+        assert list(array['tickerId']) == [i % 4 for i in xrange(100)]
+
+        assert list(load(source, TICK_SIZE)['size']) == range(100)
+
+def test_load_time_range_and_ids(tmpdir):
+    for source in logs(tmpdir):
+        array = load(source, TICK_SIZE, start=1020, end=1060, ids=[1, 3])
+        assert list(array['size']) == [i for i in xrange(20, 60) if i % 4 in (1, 3)]
+        assert len(load(source, TICK_SIZE, start=2000)) == 0
+
+def test_load_chunks(tmpdir):
+    for source in logs(tmpdir):
+        chunks = list(load_chunks(source, TICK_PRICE, chunk_size=16))
+        assert max(len(chunk) for chunk in chunks) == 16
+        assert sum(len(chunk) for chunk in chunks) == 100
+
+def test_unloadable_types(tmpdir):
+    source = write_sqlite(tmpdir)
+    with raises(ValueError):
+        list(load_chunks(source, ACCT_VALUE))
+    with raises(IOError):
+        list(load_chunks(str(tmpdir.join('missing.db')), TICK_PRICE))
+
+def test_columns_round_trip(tmpdir):
+    source = write_capture(tmpdir)
+    directory = str(tmpdir.join('columns'))
+    assert write_columns(load_chunks(source, TICK_PRICE, chunk_size=30), directory) == 100
+
+    columns = read_columns(directory)
+    array = load(source, TICK_PRICE)
+    assert sorted(columns) == sorted(array.dtype.names)
+    for name in array.dtype.names:
+        assert list(columns[name]) == list(array[name])
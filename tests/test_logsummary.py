@@ -0,0 +1,42 @@
+import logging
+
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransport
+
+from ibzmq.incoming import TICK_PRICE, TICK_SIZE
+from ibzmq.logsummary import MessageSummary
+from ibzmq.proxy import IBTWSProtocol
+
+from test_framing import STREAM, FakeRequests, FakeBroadcast
+
+def test_summarizes_once_per_interval(caplog):
+    caplog.set_level(logging.INFO)
+    clock = Clock()
+    summary = MessageSummary(interval=10, clock=clock)
+    for msgid in (TICK_PRICE, TICK_SIZE, TICK_PRICE):
+        summary.add(msgid)
+    assert not caplog.records
+    clock.advance(10)
+    assert [r.getMessage() for r in caplog.records] == ['parsed=3 interval=10.0s rate=0/s TickPrice=2 TickSize=1']
+    clock.advance(100)
+    assert len(caplog.records) == 1
+
+def test_flush_cancels_pending_summary(caplog):
+    caplog.set_level(logging.INFO)
+    clock = Clock()
+    summary = MessageSummary(interval=10, clock=clock)
+    summary.add(TICK_SIZE)
+    clock.advance(4)
+    summary.flush()
+    assert caplog.records[0].getMessage().startswith('parsed=1 interval=4.0s')
+    assert not clock.getDelayedCalls()
+
+def test_no_line_per_message_at_info(caplog):
+    caplog.set_level(logging.INFO)
+    clock = Clock()
+    protocol = IBTWSProtocol(FakeRequests(), FakeBroadcast(), summary=MessageSummary(clock=clock))
+    protocol.makeConnection(StringTransport())
+    protocol.dataReceived(STREAM)
+    assert len(caplog.records) == 1
+    clock.advance(10)
+    assert caplog.records[-1].getMessage().startswith('parsed=6 ')
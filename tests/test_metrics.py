@@ -0,0 +1,82 @@
+from py.test import raises
+from twisted.test.proto_helpers import StringTransport
+
+from ibzmq.framing import join_fields
+from ibzmq.metrics import Histogram, Metrics
+from ibzmq.proxy import IBTWSProtocol
+
+from test_framing import HANDSHAKE, STREAM, MESSAGES, FakeRequests, FakeBroadcast
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_histogram_buckets():
+    histogram = Histogram()
+    for value in (1e-6, 3e-6, 3e-6, 1e-3):
+        histogram.add(value)
+    assert histogram.count == 4
+    assert histogram.max == 1e-3
+    assert histogram.percentile(50) == 4e-6
+    assert histogram.percentile(100) == 1e-3
+    summary = histogram.summary()
+    assert summary['count'] == 4
+    assert abs(summary['mean'] - 0.25175e-3) < 1e-12
+
+def test_histogram_overflow_and_empty():
+    histogram = Histogram()
+    assert histogram.percentile(50) is None
+    histogram.add(100.0)
+    assert histogram.percentile(99) == 100.0
+
+def test_histogram_sampling():
+    histogram = Histogram(sample=3)
+    assert [histogram.sample() for _ in xrange(6)] == [False, False, True, False, False, True]
+    with raises(ValueError):
+        Histogram(sample=0)
+
+def test_request_latency():
+    timer = FakeTimer()
+    metrics = Metrics(timer=timer)
+    metrics.request_received('m1')
+    timer.now = 0.5
+    metrics.request_replied('m1')
+    metrics.request_replied('m2')
+    report = metrics.report(queued=3)
+    assert report['requests'] == 1
+    assert report['requests_pending'] == 0
+    assert report['reply']['count'] == 1
+    assert report['reply']['max'] == 0.5
+    assert report['queued'] == 3
+
+def feed(chunks, metrics):
+    protocol = IBTWSProtocol(FakeRequests(), FakeBroadcast(), metrics=metrics)
+    protocol.makeConnection(StringTransport())
+    for chunk in chunks:
+        metrics.timer.now += 1.0
+        protocol.dataReceived(chunk)
+
+def test_protocol_counts():
+    metrics = Metrics(sample=1, timer=FakeTimer())
+    feed([STREAM + join_fields([999, 1])], metrics)
+    report = metrics.report()
+    assert report['bytes_received'] == len(STREAM) + len(join_fields([999, 1]))
+    assert report['fields_received'] == len(STREAM.split('\0')) - 1 + 2
+    assert report['messages'] == {'TickPrice': 1, 'TickSize': 1, 'OrderOpenEnd': 1,
+                                  'NextValidID': 1, 'HistoricalData': 1, 'TickGeneric': 1}
+    assert report['unknown'] == {'999': 1}
+    assert report['published'] == len(MESSAGES)
+    assert report['publish']['count'] == len(MESSAGES)
+
+def test_parse_time_from_first_field():
+    metrics = Metrics(sample=1, timer=FakeTimer())
+    message = join_fields(MESSAGES[0])
+    # The first message arrives in three chunks a second apart,
+    # the second in one.
+    feed([HANDSHAKE + message[:3], message[3:6], message[6:] + message], metrics)
+    assert metrics.parse.count == 2
+    assert metrics.parse.max == 2.0
+    assert metrics.parse.buckets[0] == 1
@@ -0,0 +1,60 @@
+import time
+import sqlite3
+
+from ibzmq.msglog import BatchWriter, connect, timestamp
+
+def rows(database):
+    return sqlite3.connect(database).execute('SELECT time, type, content FROM messages ORDER BY id').fetchall()
+
+def test_close_flushes_pending(tmpdir):
+    database = str(tmpdir.join('log.db'))
+    writer = BatchWriter(database, batch_size=1000, batch_interval=60)
+    writer.start()
+    for i in xrange(10):
+        writer.write(1, '1\x006\x00{0}\x00'.format(i), t=0)
+    writer.close()
+
+    assert [(str(content), type) for _, type, content in rows(database)] == \
+           [('1\x006\x00{0}\x00'.format(i), 1) for i in xrange(10)]
+    assert rows(database)[0][0] == '1970-01-01 00:00:00'
+    assert writer.written == 10
+    assert writer.batches == 1
+
+def test_commits_every_batch_size(tmpdir):
+    database = str(tmpdir.join('log.db'))
+    writer = BatchWriter(database, batch_size=4, batch_interval=60)
+    writer.start()
+    for i in xrange(10):
+        writer.write(2, 'x')
+    writer.close()
+
+    assert len(rows(database)) == 10
+    assert writer.batches == 3
+
+def test_commits_after_batch_interval(tmpdir):
+    database = str(tmpdir.join('log.db'))
+    writer = BatchWriter(database, batch_size=1000, batch_interval=0.01)
+    writer.start()
+    writer.write(2, 'x')
+
+    deadline = time.time() + 5
+    while not writer.written and time.time() < deadline:
+        time.sleep(0.01)
+    assert writer.written == 1
+    writer.close()
+
+def test_drops_when_queue_is_full(tmpdir):
+    writer = BatchWriter(str(tmpdir.join('log.db')), queue_size=2)
+    # Not started, so nothing drains the queue.
+    writer.is_alive = lambda: True
+    for i in xrange(5):
+        writer.write(1, 'x')
+    assert writer.dropped == 3
+
+def test_connect_pragmas(tmpdir):
+    db = connect(str(tmpdir.join('log.db')), wal=True, synchronous='normal')
+    assert db.execute('PRAGMA journal_mode').fetchone() == ('wal',)
+    assert db.execute('PRAGMA synchronous').fetchone() == (1,)
+
+def test_timestamp():
+    assert timestamp(86400.5) == '1970-01-02 00:00:00'
@@ -0,0 +1,132 @@
+from py.test import raises
+from twisted.internet.task import Clock
+
+from ibzmq.framing import join_fields
+from ibzmq.incoming import TICK_PRICE, TICK_SIZE, ERR_MSG
+from ibzmq.outgoing import REQ_MKT_DATA, CANCEL_MKT_DATA, REQ_MKT_DEPTH, CANCEL_MKT_DEPTH, REQ_IDS
+from ibzmq.multiplex import SubscriptionMultiplexer
+
+UPSTREAM = 100
+
+def req_mkt_data(id, symbol='AAPL', snapshot=0):
+    return join_fields([REQ_MKT_DATA, 9, id, 0, symbol, 'STK', '', '0.0', '', '', 'SMART', '', 'USD', '', '', 0, '', snapshot])
+
+def cancel(msgid, id):
+    return join_fields([msgid, 1, id])
+
+def multiplexer():
+    return SubscriptionMultiplexer(first_id=UPSTREAM)
+
+def test_first_subscription_goes_upstream():
+    m = multiplexer()
+    assert m.outgoing('a', req_mkt_data(7)) == [req_mkt_data(UPSTREAM)]
+    assert m.upstream_count == 1
+
+def test_identical_subscriptions_share_upstream():
+    m = multiplexer()
+    m.outgoing('a', req_mkt_data(7))
+    assert m.outgoing('b', req_mkt_data(3)) == []
+    assert m.outgoing('b', req_mkt_data(4, 'MSFT')) == [req_mkt_data(UPSTREAM + 1, 'MSFT')]
+    assert m.upstream_count == 2
+    assert m.subscriber_count == 3
+
+def test_cancel_sent_with_last_subscriber():
+    m = multiplexer()
+    m.outgoing('a', req_mkt_data(7))
+    m.outgoing('b', req_mkt_data(3))
+    assert m.outgoing('a', cancel(CANCEL_MKT_DATA, 7)) == []
+    assert m.outgoing('b', cancel(CANCEL_MKT_DATA, 3)) == [cancel(CANCEL_MKT_DATA, UPSTREAM)]
+    assert m.upstream_count == 0
+    assert m.outgoing('b', cancel(CANCEL_MKT_DATA, 3)) == []
+
+def test_resubscribing_replaces_subscription():
+    m = multiplexer()
+    m.outgoing('a', req_mkt_data(7))
+    assert m.outgoing('a', req_mkt_data(7, 'MSFT')) == \
+        [cancel(CANCEL_MKT_DATA, UPSTREAM), req_mkt_data(UPSTREAM + 1, 'MSFT')]
+    assert m.subscriptions() == {UPSTREAM + 1: req_mkt_data(UPSTREAM + 1, 'MSFT')}
+
+def test_ticker_id_of_another_client_refused():
+    m = multiplexer()
+    m.outgoing('a', req_mkt_data(7))
+    with raises(ValueError):
+        m.outgoing('b', req_mkt_data(7, 'MSFT'))
+    assert m.outgoing('b', req_mkt_data(7)) == []
+    assert m.subscriber_count == 2
+
+    # Free again once every client using it cancelled.
+    m.outgoing('a', cancel(CANCEL_MKT_DATA, 7))
+    m.outgoing('b', cancel(CANCEL_MKT_DATA, 7))
+    assert m.outgoing('b', req_mkt_data(7, 'MSFT')) == [req_mkt_data(UPSTREAM + 1, 'MSFT')]
+
+def test_request_types_kept_apart():
+    m = multiplexer()
+    depth = join_fields([REQ_MKT_DEPTH, 4, 7, 0, 'AAPL', 'STK', '', '0.0', '', '', 'SMART', 'USD', '', 5])
+    m.outgoing('a', depth)
+    assert m.outgoing('a', req_mkt_data(7)) == [req_mkt_data(UPSTREAM + 1)]
+    assert m.outgoing('a', cancel(CANCEL_MKT_DEPTH, 7)) == [cancel(CANCEL_MKT_DEPTH, UPSTREAM)]
+
+def test_snapshots_and_other_requests_pass_through():
+    m = multiplexer()
+    assert m.outgoing('a', req_mkt_data(7, snapshot=1)) == [req_mkt_data(7, snapshot=1)]
+    assert m.outgoing('a', join_fields([REQ_IDS, 1, 1])) == [join_fields([REQ_IDS, 1, 1])]
+    assert m.upstream_count == 0
+
+def test_incoming_fanned_out_to_subscribers():
+    m = multiplexer()
+    m.outgoing('a', req_mkt_data(7))
+    m.outgoing('b', req_mkt_data(3))
+    tick = (str(TICK_PRICE), '6', str(UPSTREAM), '1', '1.25', '100', '1')
+    assert m.incoming(tick) == [
+        (str(TICK_PRICE), '6', '7', '1', '1.25', '100', '1'),
+        (str(TICK_PRICE), '6', '3', '1', '1.25', '100', '1'),
+    ]
+    error = (str(ERR_MSG), '2', str(UPSTREAM), '200', 'No security definition')
+    assert [e[2] for e in m.incoming(error)] == ['7', '3']
+
+def test_incoming_passed_through_otherwise():
+    m = multiplexer()
+    tick = (str(TICK_SIZE), '6', '7', '0', '300')
+    assert m.incoming(tick) == [tick]
+    error = (str(ERR_MSG), '2', '-1', '2104', 'Market data farm connection is OK')
+    assert m.incoming(error) == [error]
+
+def test_joining_client_sent_last_values():
+    m = multiplexer()
+    m.outgoing('a', req_mkt_data(7))
+    assert m.replay('a', req_mkt_data(7)) == []
+    m.incoming((TICK_PRICE, 6, str(UPSTREAM), '1', '1.25', '100', '1'))
+    m.incoming((TICK_PRICE, 6, str(UPSTREAM), '1', '1.30', '100', '1'))
+    m.incoming((TICK_SIZE, 6, str(UPSTREAM), '0', '300'))
+
+    assert m.outgoing('b', req_mkt_data(3)) == []
+    assert m.replay('b', req_mkt_data(3)) == [
+        (TICK_PRICE, 6, '3', '1', '1.30', '100', '1'),
+        (TICK_SIZE, 6, '3', '0', '300'),
+    ]
+    assert m.replay('b', req_mkt_data(3, snapshot=1)) == []
+    assert m.replay('c', req_mkt_data(3)) == []
+
+def test_release_cancels_client_subscriptions():
+    m = multiplexer()
+    m.outgoing('a', req_mkt_data(7))
+    m.outgoing('a', req_mkt_data(8, 'MSFT'))
+    m.outgoing('b', req_mkt_data(3))
+    assert m.release('a') == [cancel(CANCEL_MKT_DATA, UPSTREAM + 1)]
+    assert m.subscriber_count == 1
+    assert m.release('b') == [cancel(CANCEL_MKT_DATA, UPSTREAM)]
+    assert m.upstream_count == 0
+
+def test_idle_clients_expire():
+    clock = Clock()
+    m = SubscriptionMultiplexer(first_id=UPSTREAM, timeout=10, clock=clock)
+    m.outgoing('a', req_mkt_data(7))
+    m.outgoing('b', req_mkt_data(3))
+    clock.advance(6)
+    m.seen('b')
+    clock.advance(6)
+    assert m.expire() == []
+    assert m.subscriber_count == 1
+    clock.advance(6)
+    assert m.expire() == [cancel(CANCEL_MKT_DATA, UPSTREAM)]
+    assert m.expire() == []
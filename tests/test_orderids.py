@@ -0,0 +1,50 @@
+from py.test import raises
+from twisted.test.proto_helpers import StringTransport
+
+from ibzmq.framing import join_fields
+from ibzmq.incoming import NEXT_VALID_ID
+from ibzmq.outgoing import PLACE_ORDER, REQ_IDS
+from ibzmq.orderids import OrderIdAllocator, MAX_BLOCK
+from ibzmq.proxy import IBTWSProtocol
+
+from test_framing import HANDSHAKE, FakeRequests, FakeBroadcast
+
+def test_allocates_unique_blocks():
+    orderids = OrderIdAllocator()
+    orderids.received((NEXT_VALID_ID, 1, '100'))
+    assert orderids.allocate() == 100
+    assert orderids.allocate(10) == 101
+    assert orderids.allocate() == 111
+    assert orderids.allocated == 12
+
+def test_never_goes_back():
+    orderids = OrderIdAllocator()
+    orderids.received((NEXT_VALID_ID, 1, '100'))
+    orderids.allocate(10)
+    orderids.received((NEXT_VALID_ID, 1, '105'))
+    assert orderids.allocate() == 110
+    orderids.received((NEXT_VALID_ID, 1, '200'))
+    assert orderids.allocate() == 200
+
+def test_skips_ids_of_placed_orders():
+    orderids = OrderIdAllocator()
+    orderids.received((NEXT_VALID_ID, 1, '100'))
+    orderids.placed(join_fields([PLACE_ORDER, 35, 150, 0, 'AAPL']))
+    orderids.placed(join_fields([REQ_IDS, 1, 500]))
+    assert orderids.allocate() == 151
+
+def test_refuses_until_known_and_bad_counts():
+    orderids = OrderIdAllocator()
+    with raises(ValueError):
+        orderids.allocate()
+    orderids.received((NEXT_VALID_ID, 1, '1'))
+    for count in (0, -1, MAX_BLOCK + 1):
+        with raises(ValueError):
+            orderids.allocate(count)
+
+def test_protocol_tracks_next_valid_id():
+    orderids = OrderIdAllocator()
+    protocol = IBTWSProtocol(FakeRequests(), FakeBroadcast(), orderids=orderids)
+    protocol.makeConnection(StringTransport())
+    protocol.dataReceived(HANDSHAKE + join_fields([NEXT_VALID_ID, 1, 42]))
+    assert orderids.allocate() == 42
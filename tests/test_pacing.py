@@ -0,0 +1,76 @@
+from twisted.internet.task import Clock
+
+from ibzmq.framing import join_fields
+from ibzmq.outgoing import PLACE_ORDER, CANCEL_MKT_DATA, REQ_MKT_DATA, REQ_HISTORICAL_DATA, REQ_IDS
+from ibzmq.pacing import (Scheduler, TokenBucket, request_lane,
+                          ORDERS, CANCELS, GENERAL, MARKET_DATA, HISTORICAL)
+
+def request(msgid, n):
+    return join_fields([msgid, 1, n])
+
+def scheduler(**kwargs):
+    clock, sent = Clock(), []
+    s = Scheduler(lambda messageid, msg: sent.append(messageid), clock=clock, **kwargs)
+    return s, sent, clock
+
+def test_request_lane():
+    assert request_lane(request(PLACE_ORDER, 1)) == ORDERS
+    assert request_lane(request(CANCEL_MKT_DATA, 1)) == CANCELS
+    assert request_lane(request(REQ_MKT_DATA, 1)) == MARKET_DATA
+    assert request_lane(request(REQ_HISTORICAL_DATA, 1)) == HISTORICAL
+    assert request_lane(request(REQ_IDS, 1)) == GENERAL
+
+def test_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(10, 2, clock)
+    bucket.take()
+    bucket.take()
+    assert bucket.delay() == 0.1
+    clock.advance(0.1)
+    assert bucket.delay() == 0
+
+def test_sends_immediately_within_burst():
+    s, sent, clock = scheduler(rate=10, burst=3)
+    for i in xrange(3):
+        assert s.submit(i, request(REQ_MKT_DATA, i))
+    assert sent == [0, 1, 2]
+    assert s.depth == 0
+
+def test_paces_at_rate():
+    s, sent, clock = scheduler(rate=10, burst=1)
+    for i in xrange(5):
+        s.submit(i, request(REQ_MKT_DATA, i))
+    assert sent == [0]
+    clock.pump([0.1] * 4)
+    assert sent == [0, 1, 2, 3, 4]
+    assert s.report()[MARKET_DATA]['wait_max'] == 0.4
+
+def test_orders_and_cancels_jump_the_queue():
+    s, sent, clock = scheduler(rate=10, burst=1)
+    s.submit('md0', request(REQ_MKT_DATA, 0))
+    s.submit('md1', request(REQ_MKT_DATA, 1))
+    s.submit('hist', request(REQ_HISTORICAL_DATA, 2))
+    s.submit('cancel', request(CANCEL_MKT_DATA, 3))
+    s.submit('order', request(PLACE_ORDER, 4))
+    clock.pump([0.1] * 4)
+    assert sent == ['md0', 'order', 'cancel', 'md1', 'hist']
+
+def test_lane_limit_does_not_block_other_lanes():
+    s, sent, clock = scheduler(rate=100, burst=100, lane_limits={HISTORICAL: (0.1, 1)})
+    s.submit('h0', request(REQ_HISTORICAL_DATA, 0))
+    s.submit('h1', request(REQ_HISTORICAL_DATA, 1))
+    s.submit('md', request(REQ_MKT_DATA, 2))
+    assert sent == ['h0', 'md']
+    clock.advance(9.9)
+    assert sent == ['h0', 'md']
+    clock.advance(0.1)
+    assert sent == ['h0', 'md', 'h1']
+
+def test_rejects_when_full():
+    s, sent, clock = scheduler(rate=1, burst=1, queue_size=2)
+    assert s.submit(0, request(REQ_MKT_DATA, 0))
+    assert s.submit(1, request(REQ_MKT_DATA, 1))
+    assert s.submit(2, request(REQ_MKT_DATA, 2))
+    assert not s.submit(3, request(REQ_MKT_DATA, 3))
+    assert s.report()['rejected'] == 1
+    assert s.report()[MARKET_DATA]['depth'] == 2
@@ -0,0 +1,99 @@
+from py.test import raises
+
+from ibzmq.framing import join_fields
+from ibzmq.incoming import HISTORICAL_DATA, ORDER_STATUS
+from ibzmq.outgoing import (PLACE_ORDER, CANCEL_ORDER, REQ_MKT_DATA, CANCEL_MKT_DATA,
+                            REQ_HISTORICAL_DATA, REQ_IDS)
+from ibzmq.pacing import ORDERS, CANCELS, GENERAL, MARKET_DATA, HISTORICAL
+from ibzmq.pool import Connection, ConnectionPool
+
+class FakeProtocol(object):
+    def __init__(self, source):
+        self.source = source
+
+def request(msgid, id):
+    return join_fields([msgid, 1, id])
+
+def pool(*names):
+    p = ConnectionPool([
+        Connection('orders', 'localhost', 4002, 0, (ORDERS, CANCELS, GENERAL)),
+        Connection('data1', 'localhost', 4002, 1, (MARKET_DATA, HISTORICAL, CANCELS)),
+        Connection('data2', 'localhost', 4002, 2, (MARKET_DATA, HISTORICAL, CANCELS)),
+    ])
+    for name in names:
+        p.attach(FakeProtocol(name))
+    return p
+
+def test_routes_by_lane():
+    p = pool('orders', 'data1', 'data2')
+    assert p.route(request(PLACE_ORDER, 1)).name == 'orders'
+    assert p.route(request(REQ_IDS, 1)).name == 'orders'
+    assert p.route(request(REQ_MKT_DATA, 1)).name in ('data1', 'data2')
+
+def test_spreads_over_least_active():
+    p = pool('orders', 'data1', 'data2')
+    names = [p.route(request(REQ_MKT_DATA, id)).name for id in xrange(4)]
+    assert sorted(names) == ['data1', 'data1', 'data2', 'data2']
+
+def test_cancels_follow_request():
+    p = pool('orders', 'data1', 'data2')
+    first = p.route(request(REQ_MKT_DATA, 1)).name
+    p.route(request(REQ_MKT_DATA, 2))
+    assert p.route(request(CANCEL_MKT_DATA, 1)).name == first
+    assert p.route(request(REQ_MKT_DATA, 3)).name == first
+    assert p.route(request(CANCEL_ORDER, 7)).name == 'orders'
+
+def test_order_modifications_follow_order():
+    p = ConnectionPool([Connection('a', 'localhost', 4002, 0), Connection('b', 'localhost', 4002, 1)])
+    p.attach(FakeProtocol('a'))
+    p.attach(FakeProtocol('b'))
+    first = p.route(request(PLACE_ORDER, 7)).name
+    p.route(request(PLACE_ORDER, 8))
+    assert p.route(request(PLACE_ORDER, 7)).name == first
+
+def test_completed_requests_released():
+    p = pool('orders', 'data1', 'data2')
+    connection = p.route(request(REQ_HISTORICAL_DATA, 5))
+    p.route(request(PLACE_ORDER, 7))
+    p.completed(connection.name, (HISTORICAL_DATA, 3, '5', '', '', '0'))
+    p.completed('orders', (ORDER_STATUS, 6, '7', 'Submitted'))
+    assert [c.active for c in p] == [1, 0, 0]
+    p.completed('orders', (ORDER_STATUS, 6, '7', 'Filled'))
+    assert [c.active for c in p] == [0, 0, 0]
+
+def test_no_route_without_connection():
+    p = pool('orders')
+    assert p.route(request(REQ_MKT_DATA, 1)) is None
+
+def test_detach_keeps_persistent_requests():
+    p = pool('orders', 'data1')
+    connection = p.route(request(REQ_MKT_DATA, 1))
+    p.route(request(REQ_HISTORICAL_DATA, 5))
+    p.detach(connection.protocol)
+    assert not connection.connected
+    assert connection.active == 1
+    assert p.route(request(CANCEL_MKT_DATA, 1)) is connection
+    assert connection.active == 0
+
+def test_from_config():
+    config = {'ibtws.host': 'tws', 'ibtws.port': 4001, 'ibtws.clientid': 3, 'ibtws.connections': None}
+    p = ConnectionPool.from_config(config)
+    assert [(c.name, c.host, c.port, c.clientid) for c in p] == [(None, 'tws', 4001, 3)]
+
+    config['ibtws.connections'] = [{'name': 'orders', 'lanes': ['orders']}, {'name': 'data', 'clientid': 1, 'port': 4002}]
+    p = ConnectionPool.from_config(config)
+    assert [(c.name, c.host, c.port, c.clientid) for c in p] == [('orders', 'tws', 4001, 3), ('data', 'tws', 4002, 1)]
+
+    config['ibtws.connections'] = [{'name': 'data1'}, {'name': 'data2'}, {'name': 'data3', 'clientid': 0}]
+    p = ConnectionPool.from_config(config)
+    assert [c.clientid for c in p] == [3, 4, 0]
+
+def test_rejects_bad_config():
+    with raises(ValueError):
+        Connection('a', 'localhost', 4002, lanes=['quotes'])
+    with raises(ValueError):
+        ConnectionPool([Connection('a', 'localhost', 4002), Connection('a', 'localhost', 4002)])
+    with raises(ValueError):
+        ConnectionPool([Connection('a', 'localhost', 4002, 1), Connection('b', 'localhost', 4002, 1)])
+    # The same client id is fine on another gateway.
+    ConnectionPool([Connection('a', 'localhost', 4002, 1), Connection('b', 'localhost', 4001, 1)])
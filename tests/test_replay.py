@@ -0,0 +1,85 @@
+from twisted.internet.task import Clock
+
+from ibzmq.msglog import BatchWriter
+from ibzmq.replay import Replayer, MAX_SPEED_BATCH, open_log
+
+MESSAGES = [(100.0, 1, 'a'), (100.5, 1, 'b'), (102.0, 2, 'c')]
+
+def replayer(messages, speed):
+    clock, sent = Clock(), []
+    r = Replayer(messages, lambda content: sent.append((clock.seconds(), content)),
+                 speed, clock=clock, timer=clock.seconds)
+    return r, sent, clock
+
+def test_replays_at_recorded_speed():
+    r, sent, clock = replayer(MESSAGES, 1.0)
+    done = []
+    r.start().addCallback(done.append)
+
+    clock.pump([0, 0.5, 1.5])
+    assert sent == [(0, 'a'), (0.5, 'b'), (2.0, 'c')]
+    assert done == [r]
+    assert r.lags.count == 3 and r.lags.max == 0
+
+def test_replays_at_scaled_speed():
+    r, sent, clock = replayer(MESSAGES, 4.0)
+    r.start()
+    clock.pump([0, 0.125, 0.375])
+    assert sent == [(0, 'a'), (0.125, 'b'), (0.5, 'c')]
+
+def turn(clock):
+    """
+    Runs the calls due at the start of a reactor iteration,
+    leaving those they schedule to the next.
+
+    """
+    due = [call for call in clock.getDelayedCalls() if call.getTime() <= clock.seconds()]
+    for call in due:
+        clock.calls.remove(call)
+        call.func(*call.args, **call.kw)
+
+def test_replays_at_maximum_speed():
+    messages = [(i, 1, str(i)) for i in xrange(2*MAX_SPEED_BATCH + 1)]
+    r, sent, clock = replayer(messages, None)
+    done = []
+    r.start().addCallback(done.append)
+
+    turn(clock)
+    assert len(sent) == MAX_SPEED_BATCH
+    turn(clock)
+    assert len(sent) == 2*MAX_SPEED_BATCH and not done
+    turn(clock)
+    assert [content for _, content in sent] == [content for _, _, content in messages]
+    assert done == [r] and r.sent == len(messages)
+
+    # Every message is due at once, so only send times are recorded.
+    assert r.lags.count == 0 and r.send_times.count == len(messages)
+    assert 'Send time' in r.report()
+
+def test_empty_log():
+    r, sent, clock = replayer([], 1.0)
+    done = []
+    r.start().addCallback(done.append)
+    clock.advance(0)
+    assert done == [r] and sent == []
+
+def test_send_failure_errbacks():
+    def send(content):
+        raise ValueError(content)
+    clock = Clock()
+    r = Replayer(MESSAGES, send, 1.0, clock=clock, timer=clock.seconds)
+    failures = []
+    r.start().addErrback(failures.append)
+    clock.advance(0)
+    assert failures[0].check(ValueError)
+
+def test_reads_sqlite_log(tmpdir):
+    database = str(tmpdir.join('log.db'))
+    writer = BatchWriter(database)
+    writer.start()
+    for t, type, content in MESSAGES:
+        writer.write(type, content, t=t)
+    writer.close()
+
+    messages = open_log(database)
+    assert [content for _, _, content in messages] == ['a', 'b', 'c']
@@ -0,0 +1,80 @@
+from twisted.python.failure import Failure
+from twisted.internet.error import ConnectionLost
+from twisted.test.proto_helpers import StringTransport
+
+from ibzmq.framing import join_fields
+from ibzmq.incoming import CONNECTION_STATUS
+from ibzmq.outgoing import (REQ_MKT_DATA, CANCEL_MKT_DATA, REQ_MKT_DEPTH, CANCEL_MKT_DEPTH,
+                            REQ_ACCOUNT_DATA, REQ_HISTORICAL_DATA)
+from ibzmq.proxy import IBTWSProtocol, Disconnected, CONNECTED, DISCONNECTED
+from ibzmq.session import Session
+
+from test_framing import HANDSHAKE, FakeBroadcast
+
+def req_mkt_data(id, snapshot=0):
+    return join_fields([REQ_MKT_DATA, 9, id, 0, 'AAPL', 'STK', '', '0.0', '', '', 'SMART', '', 'USD', '', '', 0, '', snapshot])
+
+def request(msgid, *fields):
+    return join_fields((msgid, 1) + fields)
+
+def test_records_active_subscriptions():
+    session = Session()
+    session.record(req_mkt_data(1))
+    session.record(request(REQ_MKT_DEPTH, 2, 'AAPL'))
+    session.record(request(REQ_ACCOUNT_DATA, 1, 'DU1'))
+    session.record(request(REQ_HISTORICAL_DATA, 3, 'AAPL'))
+    session.record(req_mkt_data(4, snapshot=1))
+    assert session.requests() == [req_mkt_data(1), request(REQ_MKT_DEPTH, 2, 'AAPL'),
+                                  request(REQ_ACCOUNT_DATA, 1, 'DU1')]
+
+def test_cancels_end_subscriptions():
+    session = Session()
+    session.record(req_mkt_data(1))
+    session.record(request(REQ_MKT_DEPTH, 1, 'AAPL'))
+    session.record(request(REQ_ACCOUNT_DATA, 1, 'DU1'))
+    session.record(request(CANCEL_MKT_DATA, 1))
+    session.record(request(REQ_ACCOUNT_DATA, 0, 'DU1'))
+    assert session.requests() == [request(REQ_MKT_DEPTH, 1, 'AAPL')]
+
+def test_forget():
+    session = Session()
+    session.record(req_mkt_data(1))
+    assert not session.forget(request(CANCEL_MKT_DEPTH, 1))
+    assert session.forget(request(CANCEL_MKT_DATA, 1))
+    assert not session.forget(request(CANCEL_MKT_DATA, 1))
+    assert len(session) == 0
+
+class FakeRequests(object):
+    def __init__(self, restored):
+        self.restored = restored
+        self.lost = []
+
+    def setTWSProtocol(self, protocol):
+        return self.restored
+
+    def lostTWSProtocol(self, protocol):
+        self.lost.append(protocol)
+
+def connect(restored):
+    requests, broadcast = FakeRequests(restored), FakeBroadcast()
+    protocol = IBTWSProtocol(requests, broadcast)
+    protocol.makeConnection(StringTransport())
+    protocol.dataReceived(HANDSHAKE)
+    return protocol, requests, broadcast
+
+def status(message):
+    fields = message.split('\0')
+    return int(fields[0]), fields[2], int(fields[5])
+
+def test_publishes_status_on_reconnection():
+    protocol, requests, broadcast = connect(None)
+    assert broadcast.sent == []
+    protocol, requests, broadcast = connect(3)
+    assert [status(m) for m in broadcast.sent] == [(CONNECTION_STATUS, CONNECTED, 3)]
+
+def test_publishes_status_on_connection_lost():
+    protocol, requests, broadcast = connect(None)
+    protocol.connectionLost(Failure(ConnectionLost()))
+    assert protocol.is_state(Disconnected)
+    assert requests.lost == [protocol]
+    assert [status(m) for m in broadcast.sent] == [(CONNECTION_STATUS, DISCONNECTED, 0)]
@@ -0,0 +1,59 @@
+from itertools import islice
+
+from twisted.test.proto_helpers import StringTransport
+
+from ibzmq.framing import FieldSplitter, join_fields
+from ibzmq.incoming import MESSAGE_PARSERS, decode, parse
+from ibzmq.simulator import (TWSSimulatorProtocol, SERVER_VERSION, PROBE_END,
+                             synthetic_messages, probe, is_probe)
+
+def test_synthetic_messages_cover_every_parser():
+    seen = set()
+    for message in islice(synthetic_messages(), 1000):
+        fields = message.split('\0')[:-1]
+        decoded, end = decode(fields)
+        assert end == len(fields)
+        assert decoded == parse(fields)
+        seen.add(decoded[0])
+    assert seen == set(MESSAGE_PARSERS)
+
+def connect(count, probe_interval=0):
+    protocol = TWSSimulatorProtocol(synthetic_messages(), count=count, probe_interval=probe_interval)
+    transport = StringTransport()
+    protocol.makeConnection(transport)
+    protocol.dataReceived(join_fields([59]))
+    return protocol, transport
+
+def test_handshake():
+    protocol, transport = connect(10)
+    fields = FieldSplitter().split(transport.value())
+    assert fields[0] == str(SERVER_VERSION)
+    assert protocol.clientVersion == 59
+    assert protocol.clientId is None
+
+    protocol.dataReceived(join_fields([3]))
+    assert protocol.clientId == 3
+    assert transport.producer is protocol
+
+def test_streams_count_messages_then_end_probe():
+    protocol, transport = connect(10, probe_interval=5)
+    protocol.dataReceived(join_fields([0]))
+    transport.clear()
+
+    protocol.resumeProducing()
+    fields = FieldSplitter().split(transport.value())
+    messages = []
+    while fields:
+        message, end = decode(fields)
+        messages.append(message)
+        fields = fields[end:]
+
+    assert protocol.sent == 10
+    assert len(messages) == 13
+    assert [m[-1] for m in messages if is_probe(m)][-1] == PROBE_END
+    assert sum(1 for m in messages if is_probe(m)) == 3
+    assert transport.producer is None
+
+def test_probe():
+    assert is_probe(probe())
+    assert not is_probe(next(synthetic_messages()).split('\0'))
@@ -0,0 +1,98 @@
+from twisted.test.proto_helpers import StringTransport
+
+from txzmq import ZmqFactory, ZmqEndpoint, ZmqEndpointType
+
+from ibzmq.framing import join_fields
+from ibzmq.incoming import TICK_PRICE, TICK_SIZE, ACCT_VALUE, PORTFOLIO_VALUE, ACCT_UPDATE_TIME
+from ibzmq.outgoing import CANCEL_MKT_DATA
+from ibzmq.pool import ConnectionPool, Connection
+from ibzmq.proxy import IBTWSProtocol, ZmqRequests
+from ibzmq.snapshot import SnapshotCache
+
+from test_framing import HANDSHAKE, FakeRequests, FakeBroadcast
+
+def price(tickerid, ticktype, value):
+    return (TICK_PRICE, 6, str(tickerid), str(ticktype), value, '100', '1')
+
+def account_value(key, value, account='DU1'):
+    return (ACCT_VALUE, 2, key, value, 'USD', account)
+
+def portfolio_value(conid, position, account='DU1'):
+    return (PORTFOLIO_VALUE, 8, str(conid)) + ('0',) * 9 + (str(position),) + ('0',) * 5 + (account,)
+
+def test_keeps_last_value_per_tick_type():
+    cache = SnapshotCache()
+    cache.update(price(1, 1, '1.00'))
+    cache.update(price(1, 2, '1.10'))
+    cache.update(price(1, 1, '1.05'))
+    assert cache.snapshot() == [join_fields(price(1, 1, '1.05')), join_fields(price(1, 2, '1.10'))]
+
+def test_keeps_account_state():
+    cache = SnapshotCache()
+    cache.update(account_value('NetLiquidation', '100'))
+    cache.update(account_value('NetLiquidation', '90'))
+    cache.update(account_value('NetLiquidation', '50', 'DU2'))
+    cache.update(portfolio_value(265598, 100))
+    cache.update(portfolio_value(265598, 200))
+    cache.update((ACCT_UPDATE_TIME, 1, '10:00'))
+    cache.update((ACCT_UPDATE_TIME, 1, '10:01'))
+    assert cache.snapshot() == [join_fields(m) for m in (
+        account_value('NetLiquidation', '90'),
+        account_value('NetLiquidation', '50', 'DU2'),
+        portfolio_value(265598, 200),
+        (ACCT_UPDATE_TIME, 1, '10:01'),
+    )]
+
+def test_filters_by_tickerid():
+    cache = SnapshotCache()
+    cache.update(price(1, 1, '1.00'))
+    cache.update(price(2, 1, '2.00'))
+    cache.update((TICK_SIZE, 6, '2', '0', '300'))
+    cache.update(account_value('NetLiquidation', '100'))
+    assert cache.snapshot(['2']) == [join_fields(price(2, 1, '2.00')), join_fields((TICK_SIZE, 6, '2', '0', '300'))]
+    assert cache.snapshot([3]) == []
+
+def test_ignores_other_messages():
+    cache = SnapshotCache()
+    cache.update((9, 1, '3'))
+    assert len(cache) == 0
+
+def test_filled_by_published_messages():
+    cache = SnapshotCache()
+    protocol = IBTWSProtocol(FakeRequests(), FakeBroadcast(), snapshot=cache)
+    protocol.makeConnection(StringTransport())
+    protocol.dataReceived(HANDSHAKE + join_fields(price(1042, 1, '1.25')) + join_fields(price(1042, 1, '1.30')))
+    assert cache.snapshot() == [join_fields(price(1042, 1, '1.30'))]
+
+def test_discards_cancelled_ticker():
+    cache = SnapshotCache()
+    cache.update(price(1, 1, '1.00'))
+    cache.update((TICK_SIZE, 6, '1', '0', '300'))
+    cache.update(price(2, 1, '2.00'))
+    cache.update(account_value('NetLiquidation', '100'))
+    cache.discard_ticker(1)
+    assert cache.snapshot() == [join_fields(price(2, 1, '2.00')), join_fields(account_value('NetLiquidation', '100'))]
+
+def test_discards_values_of_lost_connection():
+    cache = SnapshotCache()
+    cache.update(price(1, 1, '1.00'), 'data1')
+    cache.update(price(2, 1, '2.00'), 'data2')
+    cache.update(account_value('NetLiquidation', '100'), 'data1')
+    cache.discard_source('data1')
+    assert cache.snapshot() == [join_fields(price(2, 1, '2.00'))]
+
+def test_evicted_by_requests():
+    factory = ZmqFactory()
+    requests = ZmqRequests(factory, ZmqEndpoint(ZmqEndpointType.bind, 'inproc://snapshot'))
+    requests.setPool(ConnectionPool([Connection(None, '127.0.0.1', 4002, 0)]))
+    cache = SnapshotCache()
+    requests.setSnapshotCache(cache)
+    protocol = IBTWSProtocol(requests, FakeBroadcast(), snapshot=cache)
+    protocol.makeConnection(StringTransport())
+    protocol.dataReceived(HANDSHAKE + join_fields(price(1, 1, '1.25')) + join_fields(price(2, 1, '2.50')))
+
+    requests.submitRequest(None, join_fields([CANCEL_MKT_DATA, 1, 1]))
+    assert cache.snapshot() == [join_fields(price(2, 1, '2.50'))]
+    requests.lostTWSProtocol(protocol)
+    assert len(cache) == 0
+    factory.shutdown()